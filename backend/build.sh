@@ -5,7 +5,8 @@ python manage.py collectstatic --noinput
 if [ ! -f ./ffmpeg ]; then
     curl -L https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz | tar xJ
     mv ffmpeg-*-static/ffmpeg ./ffmpeg
-    chmod +x ./ffmpeg
+    mv ffmpeg-*-static/ffprobe ./ffprobe
+    chmod +x ./ffmpeg ./ffprobe
 fi
 # Verify FFmpeg
 ./ffmpeg -version || { echo "FFmpeg download failed"; exit 1; }
\ No newline at end of file
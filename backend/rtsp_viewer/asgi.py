@@ -11,4 +11,9 @@ application = ProtocolTypeRouter({
     'websocket': AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
-})
\ No newline at end of file
+})
+
+# Bring back the streams that were running before this restart, then open
+# the warm pool's camera sessions now rather than on the first click
+from stream import recovery, warm  # noqa: E402
+recovery.start(after=warm.start)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.urls import re_path
-from stream.consumers import StreamConsumer
+from stream.consumers import StreamConsumer, StreamMediaConsumer
 
 websocket_urlpatterns = [
-    re_path(r'ws/streams/$', StreamConsumer.as_view()),
+    re_path(r'ws/streams/$', StreamConsumer.as_asgi()),
+    re_path(r'ws/streams/(?P<stream_id>[0-9a-f-]+)/media/$', StreamMediaConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'stream.middleware.ViewerActivityMiddleware',
 ]
 
 ROOT_URLCONF = 'rtsp_viewer.urls'
@@ -79,12 +80,25 @@ TEMPLATES = [
 
 ASGI_APPLICATION = 'rtsp_viewer.asgi.application'
 
-# Use in-memory channel layer for development
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+# redis:// URL of any Redis-compatible server (Redis, Valkey, KeyDB). Stream
+# events then reach WebSocket clients of every process, which is needed with
+# several web workers or a standalone stream supervisor.
+CHANNEL_REDIS_URL = config('CHANNEL_REDIS_URL', default='')
+
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+        }
+    }
+else:
+    # Use in-memory channel layer for development
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
     }
-}
 
 DATABASES = {
     'default': {
@@ -100,6 +114,103 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Development HLS URL
 HLS_URL = 'http://127.0.0.1:8000/media/streams/'
+# Low-Latency HLS playlists are generated by the 'stream-llhls' view
+LLHLS_URL = 'http://127.0.0.1:8000/api/stream/llhls/'
+# WebSocket fMP4 push for the 'mse' profile
+MSE_WS_URL = 'ws://127.0.0.1:8000/ws/streams/'
+
+# JPEG of a warm stream's latest keyframe, see the 'stream-keyframe' view
+KEYFRAME_URL = 'http://127.0.0.1:8000/api/stream/keyframe/'
+
+# Cameras kept connected and encoding so they start instantly, comma
+# separated, each `rtsp_url` or `rtsp_url|profile`
+WARM_CAMERAS = config('WARM_CAMERAS', default='', cast=Csv())
+
+# Keep HLS segments in memory instead of under MEDIA_ROOT: ffmpeg PUTs them to
+# the 'stream-store' view, which also serves them to players
+SEGMENT_STORE_ENABLED = config('SEGMENT_STORE_ENABLED', default=False, cast=bool)
+SEGMENT_STORE_URL = 'http://127.0.0.1:8000/api/stream/store/'
+# Segments kept per stream (all variants of an 'abr' stream share the ring)
+SEGMENT_STORE_MAX_SEGMENTS = config('SEGMENT_STORE_MAX_SEGMENTS', default=12, cast=int)
+# Oldest segments of any stream are evicted beyond this many bytes
+SEGMENT_STORE_MAX_BYTES = config('SEGMENT_STORE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+
+# Variants produced by the 'abr' stream profile, bitrate in kbit/s
+HLS_RENDITIONS = [
+    {'name': '360p', 'width': 640, 'height': 360, 'bitrate': 500},
+    {'name': '720p', 'width': 1280, 'height': 720, 'bitrate': 2000},
+]
+
+# ffprobe runs allowed at once when testing RTSP URLs, and URLs per batch request
+PROBE_CONCURRENCY = config('PROBE_CONCURRENCY', default=16, cast=int)
+PROBE_BATCH_LIMIT = 500
+
+# Streams started or stopped at once by the bulk endpoints, and streams per bulk request
+STREAM_BULK_CONCURRENCY = config('STREAM_BULK_CONCURRENCY', default=8, cast=int)
+STREAM_BULK_LIMIT = 500
+
+# Continuous recording of streams started with "record": true, see
+# stream/archive.py. RECORDING_STORE is 'local' (segments under
+# RECORDING_ROOT) or 's3'; RECORDING_S3_ENDPOINT_URL points at any
+# S3-compatible service, e.g. a local MinIO. The index always stays local.
+RECORDING_ROOT = os.path.join(MEDIA_ROOT, 'recordings')
+RECORDING_URL = 'http://127.0.0.1:8000/api/recordings/'
+RECORDING_STORE = config('RECORDING_STORE', default='local')
+RECORDING_S3_BUCKET = config('RECORDING_S3_BUCKET', default='')
+RECORDING_S3_PREFIX = config('RECORDING_S3_PREFIX', default='recordings/')
+RECORDING_S3_ENDPOINT_URL = config('RECORDING_S3_ENDPOINT_URL', default='')
+RECORDING_RETENTION_HOURS = config('RECORDING_RETENTION_HOURS', default=72, cast=int)
+
+# Motion detection for streams started with "motion": true or a
+# "motion_threshold" (fraction of changed pixels), see stream/motion.py.
+# Analysis cost is bounded by the sample rate and frame size.
+MOTION_SAMPLE_FPS = config('MOTION_SAMPLE_FPS', default=2, cast=int)
+MOTION_WIDTH = 160
+MOTION_HEIGHT = 90
+MOTION_WORKERS = config('MOTION_WORKERS', default=2, cast=int)
+MOTION_DEFAULT_THRESHOLD = 0.02
+
+# Camera snapshots and mosaics, see stream/snapshot.py
+SNAPSHOT_TTL = config('SNAPSHOT_TTL', default=10, cast=int)
+SNAPSHOT_CONCURRENCY = config('SNAPSHOT_CONCURRENCY', default=8, cast=int)
+SNAPSHOT_MOSAIC_LIMIT = 256
+
+# Cores encoders may use together. Starts beyond it wait in a queue of
+# ENCODER_QUEUE_LIMIT streams and are refused once that is full too.
+ENCODER_CPU_BUDGET = config('ENCODER_CPU_BUDGET', default=float(os.cpu_count() or 1), cast=float)
+ENCODER_QUEUE_LIMIT = config('ENCODER_QUEUE_LIMIT', default=20, cast=int)
+# Pin each encoder to its own least loaded cores (Linux only)
+ENCODER_PIN_CORES = config('ENCODER_PIN_CORES', default=True, cast=bool)
+
+# Seconds without playlist fetches or WebSocket viewers after which a stream's
+# encoder is suspended; it resumes on the next request. 0 keeps encoders running.
+STREAM_IDLE_TIMEOUT = config('STREAM_IDLE_TIMEOUT', default=60, cast=int)
+
+# host:port of a standalone `manage.py stream_supervisor`. Empty runs the
+# supervisor inside each web process, which is only safe with one worker.
+# Out of process, stream events need CHANNEL_REDIS_URL.
+STREAM_SUPERVISOR_ADDRESS = config('STREAM_SUPERVISOR_ADDRESS', default='')
+# Shared secret every request to a stream_supervisor must carry. Required for
+# supervisors listening on an address other hosts can reach.
+STREAM_NODE_TOKEN = config('STREAM_NODE_TOKEN', default='')
+
+# Several stream_supervisor nodes to spread streams over (see
+# stream/coordinator.py), as comma-separated "address" or "address=origin"
+# entries, e.g. "10.0.0.2:8765=http://10.0.0.2:8000". The address is the
+# node's --address; HLS, LL-HLS and keyframe URLs of its streams point at
+# the origin, a web server on the node. Failover and reconciliation read the
+# Stream rows, so nodes must share the database. Nodes reachable from other
+# hosts need STREAM_NODE_TOKEN. Overrides STREAM_SUPERVISOR_ADDRESS.
+STREAM_NODES = config('STREAM_NODES', default='', cast=Csv())
+# Seconds between node health checks, and failed checks before a node's
+# streams are moved to the others
+STREAM_NODE_CHECK_INTERVAL = config('STREAM_NODE_CHECK_INTERVAL', default=2, cast=float)
+STREAM_NODE_FAILURE_LIMIT = config('STREAM_NODE_FAILURE_LIMIT', default=3, cast=int)
+
+# Relaunch the streams that ran before a restart under their old IDs (see
+# stream/recovery.py), this many at a time
+STREAM_RECOVERY = config('STREAM_RECOVERY', default=True, cast=bool)
+STREAM_RECOVERY_CONCURRENCY = config('STREAM_RECOVERY_CONCURRENCY', default=16, cast=int)
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [],
@@ -109,4 +220,63 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
-}
\ No newline at end of file
+}
+# Logging goes through a bounded queue to a listener thread (see stream/logs.py).
+# LOG_FORMAT is 'text' or 'json'; LOG_FILE rotates at LOG_FILE_MAX_BYTES, empty
+# logs to the console only. A call site logging more than LOG_RATE_LIMIT records
+# per LOG_RATE_WINDOW seconds is muted for the rest of the window (0 disables).
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+LOG_DIR = config('LOG_DIR', default=os.path.join(BASE_DIR, 'logs'))
+LOG_FILE = config('LOG_FILE', default=os.path.join(LOG_DIR, 'server.log'))
+LOG_FILE_MAX_BYTES = config('LOG_FILE_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+LOG_FILE_BACKUPS = config('LOG_FILE_BACKUPS', default=5, cast=int)
+LOG_QUEUE_SIZE = 10000
+LOG_RATE_LIMIT = config('LOG_RATE_LIMIT', default=20, cast=int)
+LOG_RATE_WINDOW = config('LOG_RATE_WINDOW', default=10, cast=int)
+
+# ffmpeg stderr of each stream, in STREAM_LOG_DIR/<stream_id>.log. 0 bytes disables it.
+STREAM_LOG_DIR = config('STREAM_LOG_DIR', default=os.path.join(LOG_DIR, 'streams'))
+STREAM_LOG_MAX_BYTES = config('STREAM_LOG_MAX_BYTES', default=1024 * 1024, cast=int)
+STREAM_LOG_BACKUPS = config('STREAM_LOG_BACKUPS', default=1, cast=int)
+STREAM_LOG_RETENTION_HOURS = config('STREAM_LOG_RETENTION_HOURS', default=24, cast=int)
+
+LOGGING_CONFIG = 'stream.logs.configure'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            '()': 'stream.logs.TextFormatter',
+            'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        },
+        'json': {
+            '()': 'stream.logs.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+        },
+        'file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': LOG_FILE or os.devnull,
+            'maxBytes': LOG_FILE_MAX_BYTES,
+            'backupCount': LOG_FILE_BACKUPS,
+            'formatter': LOG_FORMAT,
+            'delay': True,
+        },
+    },
+    'root': {
+        'handlers': ['console', 'file'] if LOG_FILE else ['console'],
+        'level': LOG_LEVEL,
+    },
+    'loggers': {
+        # Through the root's queue instead of Django's own console handler
+        'django': {
+            'handlers': [],
+            'level': 'INFO',
+        },
+    },
+}
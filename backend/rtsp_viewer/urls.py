@@ -6,12 +6,14 @@ from django.views.generic import RedirectView
 from django.conf import settings
 from django.conf.urls.static import static
 from .views import status_view # Assuming you have a status view here
+from stream.views import metrics_view
 
 urlpatterns = [
     path('', RedirectView.as_view(url='status/', permanent=False), name='index'),  # Add root URL pattern
     path('admin/', admin.site.urls),
     path('api/', include('stream.urls')), # Include your stream app's URLs under '/api/'
     path('status/', status_view, name='status'), # Your status view
+    path('metrics', metrics_view, name='metrics'), # Prometheus scrape target
 ]
 
 if settings.DEBUG:
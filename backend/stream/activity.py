@@ -0,0 +1,73 @@
+"""Viewer activity reported to the supervisor, which suspends idle encoders.
+
+Playlist and segment fetches (see ``ViewerActivityMiddleware``) mark a
+stream as watched; an 'mse' stream's media WebSocket holds it watched for
+as long as it is open. Status WebSockets don't count, or a forgotten tab
+would keep the encoder running. Rather than one supervisor call per request, the
+streams seen are sent together every ``FLUSH_INTERVAL`` seconds from the
+runner loop.
+"""
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+from . import runner
+from .supervisor import get_supervisor, SupervisorError
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1
+
+_lock = threading.Lock()
+_seen = set()
+_held = Counter()
+_flusher = None
+
+
+def note(stream_id):
+    """Record a request for one of a stream's files. Safe to call from any thread."""
+    with _lock:
+        _seen.add(str(stream_id))
+    _ensure_flusher()
+
+
+def hold(stream_id):
+    """Keep a stream active until the matching ``unhold``, e.g. for an open media WebSocket."""
+    with _lock:
+        _held[str(stream_id)] += 1
+    _ensure_flusher()
+
+
+def unhold(stream_id):
+    with _lock:
+        stream_id = str(stream_id)
+        _held[stream_id] -= 1
+        if _held[stream_id] <= 0:
+            del _held[stream_id]
+        # Counts as seen once more so the idle window starts now
+        _seen.add(stream_id)
+
+
+def _ensure_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = asyncio.run_coroutine_threadsafe(_flush_forever(), runner.get_loop())
+
+
+async def _flush_forever():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        with _lock:
+            stream_ids = sorted(_seen | set(_held))
+            _seen.clear()
+        if not stream_ids:
+            continue
+        try:
+            # The client blocks (and may talk to a socket), keep it off the runner loop.
+            # So does get_supervisor(): creating the local supervisor waits on this loop.
+            await loop.run_in_executor(None, lambda: get_supervisor().touch(stream_ids))
+        except SupervisorError as e:
+            logger.warning(f"Could not report viewer activity for {len(stream_ids)} streams: {str(e)}")
@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Stream
+
+
+@admin.register(Stream)
+class StreamAdmin(admin.ModelAdmin):
+    list_display = ('id', 'profile', 'status', 'viewers', 'warm', 'record', 'node', 'pid', 'updated_at')
+    list_filter = ('status', 'profile', 'warm', 'record', 'node')
+    search_fields = ('id', 'rtsp_url')
+    readonly_fields = ('created_at', 'updated_at')
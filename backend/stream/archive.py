@@ -0,0 +1,383 @@
+"""Continuous recording: a time-partitioned archive of HLS segments.
+
+Recording reuses the live encoder's output. A ``Recorder`` follows a
+stream's playlist and hands every finished segment to the archive before
+``delete_segments`` removes it, so recording costs no second encode.
+Segments are stored per camera (a hash of the normalized RTSP URL, so the
+archive spans restarts and never exposes credentials) under
+``<camera>/<YYYY>/<MM>/<DD>/<HH>/<start_ms>.ts``, on local disk or in an
+S3-compatible bucket (``RECORDING_STORE``).
+
+Each camera and UTC day also has an append-only index file of fixed-size
+``(start_ms, duration_ms)`` records, taken from the segments'
+``EXT-X-PROGRAM-DATE-TIME``. Seeks and VOD playlists bisect the in-memory
+copy of the days they cover instead of listing segments, and the copy is
+extended from the file's tail as the recorder appends to it. Retention
+drops whole hours of segments and rewrites the index of the day they
+belong to.
+"""
+import os
+import math
+import time
+import array
+import shutil
+import asyncio
+import hashlib
+import logging
+import calendar
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import boto3
+from django.conf import settings
+
+from . import watcher
+from .registry import normalize_rtsp_url
+
+logger = logging.getLogger(__name__)
+
+# int64 start_ms, int64 duration_ms
+INDEX_RECORD_SIZE = 16
+DAY_MS = 86400 * 1000
+HOUR_MS = 3600 * 1000
+# A gap longer than this between segments is marked as a discontinuity
+GAP_TOLERANCE_MS = 1000
+SEGMENT_CONTENT_TYPE = 'video/MP2T'
+
+
+def camera_id(rtsp_url):
+    """Stable archive name of a camera."""
+    return hashlib.sha1(normalize_rtsp_url(rtsp_url).encode()).hexdigest()[:16]
+
+
+def _day(ms):
+    return time.strftime('%Y%m%d', time.gmtime(ms // 1000))
+
+
+def _day_start(day):
+    return calendar.timegm(time.strptime(day, '%Y%m%d')) * 1000
+
+
+def hour_prefix(camera, ms):
+    return f"{camera}/{time.strftime('%Y/%m/%d/%H', time.gmtime(ms // 1000))}/"
+
+
+def segment_key(camera, start_ms):
+    return f'{hour_prefix(camera, start_ms)}{start_ms}.ts'
+
+
+def parse_playlist(text):
+    """``[(name, start_ms, duration_ms)]`` of a media playlist written with ``program_date_time``."""
+    segments = []
+    start_ms = duration_ms = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+            try:
+                start_ms = int(datetime.strptime(line.split(':', 1)[1], '%Y-%m-%dT%H:%M:%S.%f%z').timestamp() * 1000)
+            except ValueError:
+                start_ms = None
+        elif line.startswith('#EXTINF:'):
+            try:
+                duration_ms = int(float(line[8:].split(',', 1)[0]) * 1000)
+            except ValueError:
+                duration_ms = None
+        elif line and not line.startswith('#'):
+            if start_ms is None and segments:
+                # Without a date tag a segment follows on from the previous one
+                start_ms = segments[-1][1] + segments[-1][2]
+            if start_ms is not None and duration_ms is not None:
+                segments.append((line, start_ms, duration_ms))
+            start_ms = duration_ms = None
+    return segments
+
+
+class LocalArchiveStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put_file(self, key, path):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            # ffmpeg only unlinks its name for the segment, a hard link keeps the data without a copy
+            os.link(path, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(path, target)
+
+    def read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def url(self, key):
+        return None
+
+    def delete_prefix(self, prefix):
+        path = self._path(prefix.rstrip('/'))
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+        # Drop the day/month/year directories it leaves empty, never the root
+        parent = os.path.dirname(path)
+        while parent != self.root and parent.startswith(self.root):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+
+class S3ArchiveStore:
+    """Segments in an S3-compatible bucket; ``endpoint_url`` points at e.g. a local MinIO."""
+
+    URL_EXPIRY = 3600
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def put_file(self, key, path):
+        self.client.upload_file(path, self.bucket, self.prefix + key,
+                                ExtraArgs={'ContentType': SEGMENT_CONTENT_TYPE})
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+    def url(self, key):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key}, ExpiresIn=self.URL_EXPIRY
+        )
+
+    def delete_prefix(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+
+
+class ArchiveIndex:
+    """Per camera and UTC day, an append-only file of ``(start_ms, duration_ms)`` records."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        # path -> (bytes loaded, starts, durations), both array('q') sorted by start
+        self._days = {}
+
+    def _path(self, camera, day):
+        return os.path.join(self.root, camera, f'{day}.idx')
+
+    def append(self, camera, start_ms, duration_ms):
+        path = self._path(camera, _day(start_ms))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(array.array('q', (start_ms, duration_ms)).tobytes())
+
+    def load(self, camera, day):
+        path = self._path(camera, day)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        size -= size % INDEX_RECORD_SIZE
+        with self._lock:
+            loaded, starts, durations = self._days.get(path, (0, array.array('q'), array.array('q')))
+            if size == loaded:
+                return starts, durations
+            if size < loaded:
+                # Rewritten by retention
+                loaded, starts, durations = 0, array.array('q'), array.array('q')
+            records = array.array('q')
+            if size:
+                with open(path, 'rb') as f:
+                    f.seek(loaded)
+                    records.frombytes(f.read(size - loaded))
+            new_starts, new_durations = records[0::2], records[1::2]
+            if starts and new_starts and new_starts[0] < starts[-1] or any(
+                    a > b for a, b in zip(new_starts, new_starts[1:])):
+                # Out of order after a clock change, keep the arrays sorted
+                pairs = sorted(zip(list(starts) + list(new_starts), list(durations) + list(new_durations)))
+                starts = array.array('q', (start for start, _ in pairs))
+                durations = array.array('q', (duration for _, duration in pairs))
+            else:
+                starts, durations = starts + new_starts, durations + new_durations
+            self._days[path] = (size, starts, durations)
+            return starts, durations
+
+    def segments(self, camera, start_ms, end_ms):
+        """``[(start_ms, duration_ms)]`` of the segments overlapping ``[start_ms, end_ms)``."""
+        found = []
+        day_start = _day_start(_day(start_ms))
+        while day_start < end_ms:
+            starts, durations = self.load(camera, _day(day_start))
+            first = max(bisect_right(starts, start_ms) - 1, 0)
+            if first < len(starts) and starts[first] + durations[first] <= start_ms:
+                first += 1
+            last = bisect_left(starts, end_ms)
+            found.extend(zip(starts[first:last], durations[first:last]))
+            day_start += DAY_MS
+        return found
+
+    def seek(self, camera, t_ms):
+        """The segment containing ``t_ms``, else the first one after it that day, else None."""
+        starts, durations = self.load(camera, _day(t_ms))
+        i = bisect_right(starts, t_ms) - 1
+        if i >= 0 and starts[i] + durations[i] > t_ms:
+            return starts[i], durations[i]
+        if i + 1 < len(starts):
+            return starts[i + 1], durations[i + 1]
+        return None
+
+    def cameras(self):
+        try:
+            return sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return []
+
+    def days(self, camera):
+        try:
+            return sorted(name[:-4] for name in os.listdir(os.path.join(self.root, camera)) if name.endswith('.idx'))
+        except FileNotFoundError:
+            return []
+
+    def trim(self, camera, day, cutoff_ms):
+        """Drop a day's records that start before ``cutoff_ms``, and the file once it is empty."""
+        starts, durations = self.load(camera, day)
+        keep = bisect_left(starts, cutoff_ms)
+        path = self._path(camera, day)
+        if keep >= len(starts):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        elif keep:
+            records = array.array('q')
+            for start, duration in zip(starts[keep:], durations[keep:]):
+                records.extend((start, duration))
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(records.tobytes())
+            os.replace(f'{path}.tmp', path)
+        with self._lock:
+            self._days.pop(path, None)
+
+
+class Archive:
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def record(self, camera, start_ms, duration_ms, path):
+        self.store.put_file(segment_key(camera, start_ms), path)
+        self.index.append(camera, start_ms, duration_ms)
+
+    def playlist(self, camera, start_ms, end_ms, base_url):
+        """VOD media playlist of the recording between two times, or None if nothing was recorded."""
+        segments = self.index.segments(camera, start_ms, end_ms)
+        if not segments:
+            return None
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(max(duration for _, duration in segments) / 1000)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        expected = None
+        for start, duration in segments:
+            if expected is not None and abs(start - expected) > GAP_TOLERANCE_MS:
+                lines.append('#EXT-X-DISCONTINUITY')
+            expected = start + duration
+            date = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(start // 1000))
+            lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{date}.{start % 1000:03d}Z')
+            lines.append(f'#EXTINF:{duration / 1000:.3f},')
+            lines.append(f'{base_url}{camera}/{start}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def evict(self, now_ms=None):
+        """Delete everything recorded before the retention window. Returns the hours dropped."""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        cutoff = (now_ms - settings.RECORDING_RETENTION_HOURS * HOUR_MS) // HOUR_MS * HOUR_MS
+        dropped = 0
+        for camera in self.index.cameras():
+            for day in self.index.days(camera):
+                day_start = _day_start(day)
+                if day_start >= cutoff:
+                    break
+                starts, _ = self.index.load(camera, day)
+                # One prefix per recorded hour, found from the index rather than a listing
+                hours = sorted({start // HOUR_MS * HOUR_MS for start in starts if start < cutoff})
+                for hour in hours:
+                    self.store.delete_prefix(hour_prefix(camera, hour))
+                self.index.trim(camera, day, cutoff)
+                dropped += len(hours)
+        if dropped:
+            logger.info(f"Recording retention dropped {dropped} hours of segments")
+        return dropped
+
+
+class Recorder:
+    """Archives each segment of one stream's playlist as soon as ffmpeg lists it."""
+
+    def __init__(self, camera, stream_dir, playlist='index.m3u8'):
+        self.camera = camera
+        self.stream_dir = stream_dir
+        self.playlist = playlist
+        self.last_start = 0
+
+    def _playlist_version(self):
+        try:
+            return os.stat(os.path.join(self.stream_dir, self.playlist)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        archive = get_archive()
+        version = None
+        while True:
+            await watcher.wait_for(self.stream_dir, lambda: self._playlist_version() not in (None, version))
+            version = self._playlist_version()
+            try:
+                with open(os.path.join(self.stream_dir, self.playlist)) as f:
+                    segments = parse_playlist(f.read())
+            except FileNotFoundError:
+                continue
+            for name, start_ms, duration_ms in segments:
+                if start_ms <= self.last_start:
+                    continue
+                path = os.path.join(self.stream_dir, name)
+                try:
+                    # Uploads block, keep them off the runner loop
+                    await loop.run_in_executor(None, archive.record, self.camera, start_ms, duration_ms, path)
+                except FileNotFoundError:
+                    logger.warning(f"Segment {path} was deleted before it could be recorded")
+                except Exception as e:
+                    logger.error(f"Could not record segment {path}: {str(e)}")
+                self.last_start = start_ms
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            if settings.RECORDING_STORE == 's3':
+                store = S3ArchiveStore(settings.RECORDING_S3_BUCKET, settings.RECORDING_S3_PREFIX,
+                                       settings.RECORDING_S3_ENDPOINT_URL)
+            else:
+                store = LocalArchiveStore(os.path.join(settings.RECORDING_ROOT, 'segments'))
+            _archive = Archive(store, ArchiveIndex(os.path.join(settings.RECORDING_ROOT, 'index')))
+    return _archive
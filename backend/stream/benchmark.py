@@ -0,0 +1,427 @@
+"""Load generator for the start/stop/serve paths, used by ``manage.py stream_benchmark``.
+
+It drives a running server the way players do, over HTTP and the
+``ws/streams/`` socket, against synthetic cameras. ffmpeg publishes
+``testsrc2`` into a local RTSP server (mediamtx by default) under one path
+per stream. It measures:
+
+* start: ``/api/stream/start/`` response time and time until the playlist
+  lists a segment (or, for 'mse', until the stream reports connected);
+* encoders: CPU and resident memory of each ffmpeg, from ``/proc`` when the
+  server runs on this machine;
+* serve: playlist and segment fetches per second, bytes per second and
+  fetch latency, with ``concurrency`` workers;
+* fan-out: time from each ``/api/stream/stop/`` response until every
+  WebSocket client has the matching 'stopped' update.
+"""
+import os
+import re
+import json
+import time
+import base64
+import random
+import shutil
+import struct
+import asyncio
+import logging
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from . import encoder
+from .scheduler import cpu_seconds
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 60
+POLL_INTERVAL = 0.1
+FANOUT_TIMEOUT = 10
+HTTP_TIMEOUT = 30
+
+
+def percentiles(values):
+    """``{count, mean, p50, p90, p99, max}`` of a list of numbers, rounded to the millisecond."""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 3),
+        'p50': at(0.5),
+        'p90': at(0.9),
+        'p99': at(0.99),
+        'max': round(values[-1], 3),
+    }
+
+
+class SyntheticCameras:
+    """A local RTSP server with one ffmpeg ``testsrc2`` publisher per camera."""
+
+    def __init__(self, count, server='mediamtx', port=8554, size='1280x720', fps=25):
+        self.count = count
+        self.server = server
+        self.port = port
+        self.size = size
+        self.fps = fps
+        self.processes = []
+
+    @property
+    def urls(self):
+        return [f'rtsp://127.0.0.1:{self.port}/bench{i}' for i in range(self.count)]
+
+    def publish_command(self, rtsp_url):
+        return [
+            encoder.ffmpeg_path(), '-v', 'error', '-re',
+            '-f', 'lavfi', '-i', f'testsrc2=size={self.size}:rate={self.fps}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+            '-pix_fmt', 'yuv420p', '-g', str(self.fps * 2),
+            '-f', 'rtsp', '-rtsp_transport', 'tcp', rtsp_url,
+        ]
+
+    def start(self):
+        if shutil.which(self.server) is None:
+            raise RuntimeError(f'RTSP server {self.server!r} not found, install mediamtx or pass --source')
+        # mediamtx takes its settings from MTX_* variables, no config file needed
+        env = dict(os.environ, MTX_RTSPADDRESS=f':{self.port}', MTX_RTMP='no', MTX_HLS='no',
+                   MTX_WEBRTC='no', MTX_SRT='no')
+        self.processes.append(subprocess.Popen([self.server], env=env, stdout=subprocess.DEVNULL,
+                                               stderr=subprocess.DEVNULL))
+        time.sleep(1)
+        for rtsp_url in self.urls:
+            self.processes.append(subprocess.Popen(self.publish_command(rtsp_url), stdin=subprocess.DEVNULL,
+                                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        # Let every publisher reach its first keyframe
+        time.sleep(3)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+
+
+class WebSocketClient:
+    """Just enough of RFC 6455 to read the status socket's text frames."""
+
+    def __init__(self, url):
+        self.url = url
+        self.reader = self.writer = None
+
+    async def connect(self):
+        parts = urlsplit(self.url)
+        self.reader, self.writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        status = await self.reader.readline()
+        if b' 101 ' not in status:
+            raise RuntimeError(f'WebSocket handshake failed: {status.decode(errors="replace").strip()}')
+        while (await self.reader.readline()) not in (b'\r\n', b''):
+            pass
+
+    async def receive(self):
+        """Next text message, or None once the server closes the socket."""
+        while True:
+            head = await self.reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', await self.reader.readexactly(8))[0]
+            payload = await self.reader.readexactly(length)
+            if opcode == 0x8:
+                return None
+            if opcode == 0x1:
+                return payload.decode()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Benchmark:
+    def __init__(self, base_url, rtsp_urls, profile='transcode', concurrency=8, ws_clients=10,
+                 sample_seconds=5, serve_seconds=10, log=print):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.rtsp_urls = rtsp_urls
+        self.profile = profile
+        self.concurrency = concurrency
+        self.ws_clients = ws_clients
+        self.sample_seconds = sample_seconds
+        self.serve_seconds = serve_seconds
+        self.log = log
+        self.executor = ThreadPoolExecutor(max_workers=max(concurrency, 4))
+        self.streams = []
+        # per client: (stream_id, status) -> monotonic time first seen
+        self.received = []
+
+    # HTTP, run in the executor so the loop only schedules
+
+    def _request(self, method, path, body=None):
+        url = urljoin(self.base_url, path)
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def request(self, method, path, body=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, method, path, body)
+
+    async def request_json(self, method, path, body=None):
+        code, data = await self.request(method, path, body)
+        try:
+            return code, json.loads(data or b'{}')
+        except ValueError:
+            return code, {}
+
+    # Phases
+
+    async def _listen(self, client, seen):
+        try:
+            while True:
+                message = await client.receive()
+                if message is None:
+                    return
+                message = json.loads(message)
+                now = time.monotonic()
+                for update in message.get('updates', [message]):
+                    seen.setdefault((update['stream_id'], update['status']), now)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+    async def open_sockets(self):
+        ws_url = re.sub(r'^http', 'ws', self.base_url) + 'ws/streams/'
+        self.sockets, self.listeners = [], []
+        for _ in range(self.ws_clients):
+            client = WebSocketClient(ws_url)
+            await client.connect()
+            seen = {}
+            self.sockets.append(client)
+            self.received.append(seen)
+            self.listeners.append(asyncio.ensure_future(self._listen(client, seen)))
+
+    async def _playable(self, stream):
+        """Wait until a player could start: a media playlist with a segment, or 'connected' for mse."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if stream['stream_url'].startswith('ws'):
+                code, data = await self.request_json('GET', f"api/stream/status/?stream_id={stream['stream_id']}")
+                if code == 200 and data.get('status') == 'connected':
+                    return True
+            else:
+                segments = await self._segment_urls(stream['stream_url'])
+                if segments:
+                    return True
+            await asyncio.sleep(POLL_INTERVAL)
+        return False
+
+    async def _segment_urls(self, playlist_url):
+        code, data = await self.request('GET', playlist_url)
+        if code != 200:
+            return []
+        lines = [line.strip() for line in data.decode(errors='replace').splitlines()]
+        uris = [urljoin(playlist_url, line) for line in lines if line and not line.startswith('#')]
+        if uris and uris[0].split('?')[0].endswith('.m3u8'):
+            # Master playlist: follow the first variant
+            return await self._segment_urls(uris[0])
+        return uris
+
+    async def _start_one(self, rtsp_url, semaphore, results):
+        async with semaphore:
+            started = time.monotonic()
+            code, data = await self.request_json('POST', 'api/stream/start/', {'rtsp_url': rtsp_url,
+                                                                              'profile': self.profile})
+            responded = time.monotonic() - started
+            if code >= 400:
+                results['errors'].append(f"{rtsp_url}: {code} {data.get('error', '')}")
+                return
+            results['response'].append(responded)
+            self.streams.append(data)
+        if await self._playable(data):
+            results['playable'].append(time.monotonic() - started)
+        else:
+            # e.g. still 'queued' when the server's encoder budget is exhausted
+            _, status = await self.request_json('GET', f"api/stream/status/?stream_id={data['stream_id']}")
+            results['errors'].append(f"{rtsp_url}: not playable within {READY_TIMEOUT}s "
+                                     f"(status {status.get('status', 'unknown')})")
+
+    async def start_streams(self):
+        results = {'response': [], 'playable': [], 'errors': []}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        await asyncio.gather(*(self._start_one(rtsp_url, semaphore, results) for rtsp_url in self.rtsp_urls))
+        return {
+            'streams': len(self.rtsp_urls),
+            'wall_seconds': round(time.monotonic() - started, 3),
+            'response': percentiles(results['response']),
+            'playable': percentiles(results['playable']),
+            'errors': results['errors'],
+        }
+
+    async def sample_encoders(self):
+        pids = []
+        for stream in self.streams:
+            code, data = await self.request_json('GET', f"api/stream/status/?stream_id={stream['stream_id']}")
+            if code == 200 and data.get('pid'):
+                pids.append(data['pid'])
+        before = {pid: _proc_sample(pid) for pid in pids}
+        before = {pid: sample for pid, sample in before.items() if sample is not None}
+        if not before:
+            return {'available': False, 'reason': 'encoder processes are not visible in /proc on this machine'}
+        await asyncio.sleep(self.sample_seconds)
+        cpu, rss = [], []
+        for pid, (cpu_before, _) in before.items():
+            sample = _proc_sample(pid)
+            if sample is None:
+                continue
+            cpu.append((sample[0] - cpu_before) / self.sample_seconds * 100)
+            rss.append(sample[1] / (1024 * 1024))
+        return {'available': True, 'encoders': len(cpu), 'cpu_percent': percentiles(cpu),
+                'rss_mb': percentiles(rss)}
+
+    async def _serve_worker(self, playlists, deadline, results):
+        while time.monotonic() < deadline:
+            playlist_url = random.choice(playlists)
+            started = time.monotonic()
+            segments = await self._segment_urls(playlist_url)
+            results['playlist'].append(time.monotonic() - started)
+            if not segments:
+                results['errors'] += 1
+                continue
+            started = time.monotonic()
+            code, data = await self.request('GET', segments[-1])
+            if code != 200:
+                results['errors'] += 1
+                continue
+            results['segment'].append(time.monotonic() - started)
+            results['bytes'] += len(data)
+
+    async def serve_segments(self):
+        playlists = [stream['stream_url'] for stream in self.streams if not stream['stream_url'].startswith('ws')]
+        if not playlists:
+            return {'available': False, 'reason': 'no HLS streams running'}
+        results = {'playlist': [], 'segment': [], 'bytes': 0, 'errors': 0}
+        deadline = time.monotonic() + self.serve_seconds
+        started = time.monotonic()
+        await asyncio.gather(*(self._serve_worker(playlists, deadline, results) for _ in range(self.concurrency)))
+        elapsed = time.monotonic() - started
+        return {
+            'available': True,
+            'requests_per_second': round((len(results['playlist']) + len(results['segment'])) / elapsed, 1),
+            'megabytes_per_second': round(results['bytes'] / elapsed / (1024 * 1024), 2),
+            'playlist': percentiles(results['playlist']),
+            'segment': percentiles(results['segment']),
+            'errors': results['errors'],
+        }
+
+    async def _stop_one(self, stream, semaphore, latencies, stopped_at):
+        async with semaphore:
+            started = time.monotonic()
+            code, data = await self.request_json('POST', 'api/stream/stop/', {'stream_id': stream['stream_id']})
+            latencies.append(time.monotonic() - started)
+            # Releasing one viewer of a shared stream publishes nothing
+            if code == 200 and not data.get('viewers'):
+                stopped_at[stream['stream_id']] = time.monotonic()
+
+    async def stop_streams(self):
+        latencies, stopped_at = [], {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._stop_one(stream, semaphore, latencies, stopped_at) for stream in self.streams))
+        expected = len(stopped_at) * len(self.received)
+        deadline = time.monotonic() + FANOUT_TIMEOUT
+        while time.monotonic() < deadline and sum(
+                1 for seen in self.received for stream_id in stopped_at if (stream_id, 'stopped') in seen) < expected:
+            await asyncio.sleep(POLL_INTERVAL)
+        fanout = [seen[(stream_id, 'stopped')] - at for seen in self.received
+                  for stream_id, at in stopped_at.items() if (stream_id, 'stopped') in seen]
+        return {
+            'response': percentiles(latencies),
+            'fanout': percentiles(fanout),
+            'fanout_missing': expected - len(fanout),
+            'ws_clients': len(self.received),
+        }
+
+    async def run(self):
+        report = {'profile': self.profile, 'concurrency': self.concurrency}
+        try:
+            if self.ws_clients:
+                await self.open_sockets()
+            self.log(f'Starting {len(self.rtsp_urls)} streams, {self.concurrency} at a time')
+            report['start'] = await self.start_streams()
+            self.log(f'Sampling encoders for {self.sample_seconds}s')
+            report['encoders'] = await self.sample_encoders()
+            self.log(f'Fetching segments for {self.serve_seconds}s')
+            report['serve'] = await self.serve_segments()
+        finally:
+            self.log(f'Stopping {len(self.streams)} streams')
+            report['stop'] = await self.stop_streams()
+            for client in getattr(self, 'sockets', []):
+                client.close()
+            for listener in getattr(self, 'listeners', []):
+                listener.cancel()
+            self.executor.shutdown(wait=False)
+        return report
+
+
+def _proc_sample(pid):
+    """``(cpu_seconds, rss_bytes)`` of a local process, or None."""
+    cpu = cpu_seconds(pid)
+    if cpu is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return cpu, rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+# (metric path, True when higher is better) compared against a baseline
+REGRESSION_METRICS = (
+    (('start', 'response', 'p90'), False),
+    (('start', 'playable', 'p90'), False),
+    (('encoders', 'cpu_percent', 'mean'), False),
+    (('encoders', 'rss_mb', 'mean'), False),
+    (('serve', 'requests_per_second'), True),
+    (('serve', 'segment', 'p90'), False),
+    (('stop', 'response', 'p90'), False),
+    (('stop', 'fanout', 'p90'), False),
+)
+
+
+def _metric(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """Metrics worse than ``baseline`` by more than ``tolerance`` (a fraction), as messages."""
+    found = []
+    for path, higher_is_better in REGRESSION_METRICS:
+        current, previous = _metric(report, path), _metric(baseline, path)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            found.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.0%})")
+    return found
@@ -1,17 +1,111 @@
 import json
+import uuid
+import asyncio
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
+from . import activity
+from .events import STREAMS_GROUP, bind_consumer_loop, stream_group
+from .supervisor import get_supervisor, SupervisorError
+
+MAX_SUBSCRIPTIONS = 1000
+
+def _update(event):
+    update = {
+        'stream_id': event['stream_id'],
+        'status': event['status'],
+        'error': event.get('error', '')
+    }
+    if 'motion' in event:
+        update['motion'] = event['motion']
+    return update
 
 class StreamConsumer(AsyncWebsocketConsumer):
+    """Stream status events.
+
+    Connect with ``?stream_id=<id>`` (repeatable or comma separated) to get
+    single-update frames for those streams only, and change the selection
+    later with ``{"subscribe": [...]}``/``{"unsubscribe": [...]}`` messages.
+    Without a filter, or after subscribing to ``"*"``, every stream's
+    updates arrive as ``{"updates": [...]}`` batches. Subscriptions are not
+    viewer activity: a tab left open on a stream's status must not keep its
+    encoder from being suspended, its player's fetches do that.
+    """
+
     async def connect(self):
-        await self.channel_layer.group_add('streams', self.channel_name)
+        bind_consumer_loop(asyncio.get_running_loop())
+        self.subscriptions = set()
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        stream_ids = [stream_id for value in params.get('stream_id', []) for stream_id in value.split(',') if stream_id]
         await self.accept()
+        await self._subscribe(stream_ids or ['*'])
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard('streams', self.channel_name)
+        for group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.subscriptions = set()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or '')
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        if isinstance(message.get('subscribe'), list):
+            await self._subscribe(message['subscribe'])
+        if isinstance(message.get('unsubscribe'), list):
+            await self._unsubscribe(message['unsubscribe'])
+
+    def _groups(self, stream_ids):
+        for stream_id in stream_ids:
+            if stream_id == '*':
+                yield STREAMS_GROUP
+                continue
+            try:
+                yield stream_group(str(uuid.UUID(str(stream_id))))
+            except ValueError:
+                continue
+
+    async def _subscribe(self, stream_ids):
+        for group in self._groups(stream_ids):
+            if group in self.subscriptions or len(self.subscriptions) >= MAX_SUBSCRIPTIONS:
+                continue
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions.add(group)
+
+    async def _unsubscribe(self, stream_ids):
+        for group in self._groups(stream_ids):
+            if group in self.subscriptions:
+                await self.channel_layer.group_discard(group, self.channel_name)
+                self.subscriptions.discard(group)
 
     async def stream_update(self, event):
-        await self.send(text_data=json.dumps({
-            'stream_id': event['stream_id'],
-            'status': event['status'],
-            'error': event.get('error', '')
-        }))
\ No newline at end of file
+        await self.send(text_data=json.dumps(_update(event)))
+
+    async def stream_batch(self, event):
+        await self.send(text_data=json.dumps({'updates': [_update(update) for update in event['updates']]}))
+
+class StreamMediaConsumer(AsyncWebsocketConsumer):
+    """Pushes an 'mse' stream's fMP4 init segment and fragments as binary frames."""
+
+    async def connect(self):
+        self.stream_id = self.scope['url_route']['kwargs']['stream_id']
+        await self.accept()
+        activity.hold(self.stream_id)
+        self.pump = asyncio.ensure_future(self._pump())
+
+    async def disconnect(self, close_code):
+        self.pump.cancel()
+        activity.unhold(self.stream_id)
+
+    async def _pump(self):
+        try:
+            async for fragment in get_supervisor().fragments(self.stream_id):
+                await self.send(bytes_data=fragment)
+        except SupervisorError as e:
+            await self.send(text_data=json.dumps({
+                'stream_id': self.stream_id,
+                'status': 'failed',
+                'error': str(e)
+            }))
+        await self.close()
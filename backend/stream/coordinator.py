@@ -0,0 +1,331 @@
+"""Stream placement over several supervisor nodes (``STREAM_NODES``).
+
+Each node is a ``manage.py stream_supervisor`` with its own encoder budget.
+``CoordinatorClient`` stands in for the supervisor client of the web tier
+and sends each command to the node running the stream:
+
+- A camera and profile not running anywhere is placed on the healthy node
+  with the lowest load: the CPU its encoders use plus the estimated cost
+  of its queued streams, over its budget. New streams charge the node's
+  estimate right away, so a burst of starts spreads over the nodes.
+- Which node runs a stream is remembered; a stream this process has not
+  seen (started by another web worker) is looked up on every node.
+- Listings, camera lookups and capacity merge the answers of all nodes,
+  each stream tagged with its ``node``.
+- Every ``STREAM_NODE_CHECK_INTERVAL`` seconds each node's capacity is
+  polled. After ``STREAM_NODE_FAILURE_LIMIT`` failed polls in a row the
+  node is down: nothing new is placed there and its streams are
+  relaunched on the other nodes under their IDs from their ``Stream`` rows
+  (see ``recovery.restart``). A node that comes back stops the copies of
+  streams that were moved away meanwhile.
+
+Running streams are not moved when the load shifts; new placements even
+it out over time. Placement is per web process, so two workers starting
+the same new camera at once may each place it, on different nodes.
+"""
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import recovery
+from .models import Stream
+from .registry import normalize_rtsp_url
+from .supervisor import SupervisorClient, SocketSupervisorClient, SupervisorError, SupervisorUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Commands answered by merging every node's answer
+MERGED_COMMANDS = ('list', 'find')
+# A hung node must not hold up the health checks of the others for long
+CHECK_TIMEOUT = 2
+
+
+class Node:
+    def __init__(self, entry):
+        address, _, origin = entry.partition('=')
+        self.address = address.strip()
+        # scheme://host[:port] of the node's web server, or '' to serve from the web tier
+        self.origin = origin.strip().rstrip('/')
+        if self.origin and not urlsplit(self.origin).netloc:
+            raise ValueError(f'Invalid origin for stream node {self.address}: {self.origin}')
+        self.client = SocketSupervisorClient(self.address)
+        self.probe = SocketSupervisorClient(self.address, timeout=CHECK_TIMEOUT)
+        self.capacity = None
+        self.healthy = True
+        self.failures = 0
+
+    @property
+    def load(self):
+        if not self.capacity or not self.capacity['budget']:
+            return float('inf')
+        estimates = self.capacity['estimates']
+        waiting = self.capacity['queued'] * (sum(estimates.values()) / len(estimates) if estimates else 1)
+        return (self.capacity['used'] + waiting) / self.capacity['budget']
+
+    def charge(self, profile):
+        """Count a stream just placed here until the next poll measures it."""
+        if self.capacity:
+            self.capacity['used'] += self.capacity['estimates'].get(profile, 1)
+            self.capacity['running'] += 1
+
+    def as_dict(self):
+        capacity = self.capacity or {}
+        return {
+            'address': self.address,
+            'origin': self.origin,
+            'healthy': self.healthy,
+            'budget': capacity.get('budget'),
+            'used': capacity.get('used'),
+            'running': capacity.get('running'),
+            'queued': capacity.get('queued'),
+            'load': round(self.load, 3) if self.capacity else None,
+        }
+
+
+class CoordinatorClient(SupervisorClient):
+    """Supervisor client spreading streams over ``nodes`` (``STREAM_NODES`` entries)."""
+
+    def __init__(self, nodes):
+        self.nodes = [Node(entry) for entry in nodes if entry.strip()]
+        if not self.nodes:
+            raise SupervisorError('STREAM_NODES lists no nodes')
+        # stream_id -> Node, and (camera key, profile) -> stream_id
+        self._placements = {}
+        self._cameras = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=len(self.nodes), thread_name_prefix='stream-nodes')
+        self._check()
+        self._thread = threading.Thread(target=self._watch, name='stream-nodes', daemon=True)
+        self._thread.start()
+
+    def call(self, command, **args):
+        if command == 'acquire':
+            return self._acquire(**args)
+        if command in MERGED_COMMANDS:
+            return self._merged(command, args)
+        if command == 'capacity':
+            return self._capacity()
+        if command == 'touch':
+            return self._touch(args['stream_ids'])
+        stream_id = args['stream_id']
+        # A stream no node knows gets the answer of any node, e.g. None from status;
+        # one being restored there is placed on it
+        node = self._node_of(stream_id) or self._least_loaded()
+        result = node.client.call(command, **args)
+        if command == 'restore' and result:
+            node.charge(args['profile'])
+            self._place(stream_id, node)
+        elif command == 'abandon' or command == 'drop' or (
+                command == 'release' and (result is None or not result['viewers'])):
+            self._forget(stream_id)
+        elif command in ('launch', 'status', 'record') and result is not None:
+            self._tag(result, node)
+        return result
+
+    async def fragments(self, stream_id):
+        node = await asyncio.get_running_loop().run_in_executor(None, self._node_of, stream_id)
+        if node is None:
+            raise SupervisorError(f'Stream {stream_id} has no fragment output')
+        async for data in node.client.fragments(stream_id):
+            yield data
+
+    def _acquire(self, rtsp_url, profile, warm=False):
+        key = (normalize_rtsp_url(rtsp_url), profile)
+        with self._lock:
+            stream_id = self._cameras.get(key)
+        node = self._placement(stream_id) if stream_id else None
+        if node is None or not node.healthy:
+            node = self._running_camera(rtsp_url, profile)
+        candidates = [node] if node is not None else self._by_load()
+        error = None
+        for node in candidates:
+            try:
+                result = node.client.acquire(rtsp_url, profile, warm)
+            except SupervisorUnavailable as e:
+                # Try the next node rather than failing the start
+                logger.warning(f"Stream node {node.address} unavailable: {str(e)}")
+                node.failures += 1
+                error = e
+                continue
+            if result['created']:
+                node.charge(profile)
+                logger.info(f"Placed stream {result['stream_id']} on node {node.address}")
+            self._place(result['stream_id'], node, key)
+            return self._tag(result, node)
+        raise error or SupervisorUnavailable('No stream node is available')
+
+    def _running_camera(self, rtsp_url, profile):
+        """The healthy node already running ``rtsp_url`` under ``profile``, if any."""
+        for node, streams in self._ask_all('find', rtsp_url=rtsp_url):
+            if any(stream['profile'] == profile for stream in streams):
+                return node
+        return None
+
+    def _merged(self, command, args):
+        merged = {}
+        for node, streams in self._ask_all(command, **args):
+            for stream in streams:
+                # A copy on a node it was moved away from loses to the placement
+                if stream['stream_id'] not in merged or self._placement(stream['stream_id']) is node:
+                    merged[stream['stream_id']] = self._tag(stream, node)
+        return list(merged.values())
+
+    def _capacity(self):
+        capacities = [node.capacity for node in self.nodes if node.healthy and node.capacity]
+        return {
+            'budget': sum(capacity['budget'] for capacity in capacities),
+            'used': round(sum(capacity['used'] for capacity in capacities), 2),
+            'running': sum(capacity['running'] for capacity in capacities),
+            'queued': sum(capacity['queued'] for capacity in capacities),
+            'estimates': capacities[0]['estimates'] if capacities else {},
+            'nodes': [node.as_dict() for node in self.nodes],
+        }
+
+    def _touch(self, stream_ids):
+        by_node = {}
+        unknown = []
+        for stream_id in stream_ids:
+            node = self._placement(stream_id)
+            if node is not None:
+                by_node.setdefault(node, []).append(stream_id)
+            else:
+                unknown.append(stream_id)
+        if unknown:
+            # Unknown IDs are ignored by the nodes not running them
+            for node in self._healthy():
+                by_node.setdefault(node, []).extend(unknown)
+        for node, ids in by_node.items():
+            try:
+                node.client.touch(ids)
+            except SupervisorError as e:
+                logger.warning(f"Could not report activity to stream node {node.address}: {str(e)}")
+
+    def _node_of(self, stream_id):
+        node = self._placement(stream_id)
+        if node is not None and node.healthy:
+            return node
+        for node, stream in self._ask_all('status', stream_id=stream_id):
+            if stream is not None:
+                self._place(stream_id, node)
+                return node
+        return None
+
+    def _ask_all(self, command, **args):
+        """``(node, result)`` of ``command`` on every healthy node, leaving out nodes that failed."""
+        nodes = self._healthy()
+        futures = [self._pool.submit(node.client.call, command, **args) for node in nodes]
+        answers = []
+        for node, future in zip(nodes, futures):
+            try:
+                answers.append((node, future.result()))
+            except SupervisorError as e:
+                logger.warning(f"Stream node {node.address} failed {command}: {str(e)}")
+        return answers
+
+    def _healthy(self):
+        return [node for node in self.nodes if node.healthy]
+
+    def _by_load(self):
+        return sorted(self._healthy(), key=lambda node: node.load)
+
+    def _least_loaded(self):
+        nodes = self._by_load()
+        if not nodes:
+            raise SupervisorUnavailable('No stream node is available')
+        return nodes[0]
+
+    def _placement(self, stream_id):
+        with self._lock:
+            return self._placements.get(stream_id)
+
+    def _place(self, stream_id, node, key=None):
+        with self._lock:
+            self._placements[stream_id] = node
+            if key is not None:
+                self._cameras[key] = stream_id
+
+    def _forget(self, stream_id):
+        with self._lock:
+            self._placements.pop(stream_id, None)
+            for key in [key for key, value in self._cameras.items() if value == stream_id]:
+                del self._cameras[key]
+
+    def _tag(self, result, node):
+        result['node'] = node.address
+        result['origin'] = node.origin
+        return result
+
+    def close(self):
+        """Stop the health checks."""
+        self._closed.set()
+        self._thread.join()
+        self._pool.shutdown()
+
+    def _watch(self):
+        while not self._closed.wait(settings.STREAM_NODE_CHECK_INTERVAL):
+            try:
+                self._check()
+            except Exception as e:
+                logger.error(f"Stream node check failed: {str(e)}", exc_info=True)
+
+    def _check(self):
+        futures = [self._pool.submit(node.probe.capacity) for node in self.nodes]
+        for node, future in zip(self.nodes, futures):
+            try:
+                node.capacity = future.result()
+            except SupervisorError as e:
+                node.failures += 1
+                if node.healthy and node.failures >= settings.STREAM_NODE_FAILURE_LIMIT:
+                    node.healthy = False
+                    logger.error(f"Stream node {node.address} is down: {str(e)}")
+                    threading.Thread(target=self.fail_over, args=(node,), name='stream-failover',
+                                     daemon=True).start()
+                continue
+            node.failures = 0
+            if not node.healthy:
+                node.healthy = True
+                logger.info(f"Stream node {node.address} is back")
+                self.reconcile(node)
+
+    def fail_over(self, node):
+        """Relaunch the streams of a node that went down on the healthy ones. Returns how many moved."""
+        with self._lock:
+            for stream_id in [stream_id for stream_id, placed in self._placements.items() if placed is node]:
+                del self._placements[stream_id]
+        moved = 0
+        rows = list(Stream.objects.filter(node=node.address, status__in=recovery.RECOVERABLE_STATUSES))
+        for row in rows:
+            # Claimed first, so only one web process moves each stream
+            if not Stream.objects.filter(id=row.id, node=node.address).update(node=''):
+                continue
+            try:
+                moved += recovery.restart(row, self)
+            except SupervisorError as e:
+                logger.error(f"Could not move stream {row.id} off node {node.address}: {str(e)}")
+        if rows:
+            logger.info(f"Moved {moved} of {len(rows)} streams off node {node.address}")
+        return moved
+
+    def reconcile(self, node):
+        """Stop the streams a returning node still runs that have moved to another node."""
+        try:
+            streams = node.client.list(brief=True)
+        except SupervisorError as e:
+            logger.warning(f"Could not list the streams of node {node.address}: {str(e)}")
+            return
+        rows = Stream.objects.filter(id__in=[stream['stream_id'] for stream in streams]).values_list('id', 'node')
+        owners = {str(stream_id): owner for stream_id, owner in rows}
+        for stream in streams:
+            owner = owners.get(stream['stream_id'])
+            if owner is None or owner == node.address:
+                continue
+            logger.info(f"Stopping stream {stream['stream_id']} on node {node.address}, it runs on {owner or 'none'}")
+            try:
+                node.client.drop(stream['stream_id'])
+            except SupervisorError as e:
+                logger.warning(f"Could not stop stream {stream['stream_id']} on node {node.address}: {str(e)}")
@@ -0,0 +1,355 @@
+import os
+import json
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Codecs/pixel formats HLS (MPEG-TS segments) can carry without re-encoding
+COPYABLE_CODECS = ('h264',)
+COPYABLE_PIX_FMTS = ('yuv420p', 'yuvj420p')
+
+# Low-latency HLS: ffmpeg cuts fMP4 "parts" on every keyframe and the
+# llhls view groups them into segments (see stream/llhls.py)
+LLHLS_PLAYLIST = 'parts.m3u8'
+LLHLS_PART_PATTERN = 'part%d.m4s'
+LLHLS_INIT = 'init.mp4'
+LLHLS_FPS = 15
+LLHLS_PART_FRAMES = 5
+LLHLS_WINDOW_PARTS = 30
+
+# WebSocket/MSE push: fragmented MP4 on ffmpeg's stdout, one fragment per
+# keyframe so every fragment is a valid starting point for a late joiner
+MSE_GOP = 5
+MSE_MIME = 'video/mp4; codecs="avc1.42E01F"'
+
+# Warm streams also keep their latest keyframe as a JPEG in the stream directory
+KEYFRAME_IMAGE = 'keyframe.jpg'
+
+HLS_FLAGS = 'delete_segments+append_list+independent_segments+program_date_time'
+PUSH_HLS_FLAGS = 'delete_segments+independent_segments+program_date_time'
+
+
+def ffmpeg_path():
+    # Windows compatibility
+    return os.path.abspath('./ffmpeg.exe') if os.path.exists('./ffmpeg.exe') else 'ffmpeg'
+
+
+def ffprobe_path():
+    return os.path.abspath('./ffprobe.exe') if os.path.exists('./ffprobe.exe') else 'ffprobe'
+
+
+def probe_command(rtsp_url):
+    """ffprobe invocation that reports the first video stream as JSON."""
+    return [
+        ffprobe_path(),
+        '-v', 'error',
+        '-rtsp_transport', 'tcp',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,pix_fmt,width,height,avg_frame_rate',
+        '-of', 'json',
+        '-i', rtsp_url,
+    ]
+
+
+def snapshot_command(source, width):
+    """ffmpeg invocation that writes the first keyframe of ``source`` to stdout as a JPEG.
+
+    ``source`` is an RTSP URL or a local segment file. Only keyframes are
+    decoded, so grabbing a frame costs one I-frame decode however long the
+    camera's GOP is.
+    """
+    input_options = ['-rtsp_transport', 'tcp'] if '://' in source else []
+    return [
+        ffmpeg_path(),
+        '-v', 'error',
+    ] + input_options + [
+        '-skip_frame', 'nokey',
+        '-i', source,
+        '-map', '0:v:0',
+        '-frames:v', '1',
+        '-vf', f'scale={width}:-2',
+        '-q:v', '5',
+        '-f', 'image2',
+        '-c:v', 'mjpeg',
+        'pipe:1',
+    ]
+
+
+def mosaic_command(columns, rows, tile_width, tile_height):
+    """ffmpeg invocation that tiles JPEGs read back to back from stdin into one JPEG on stdout.
+
+    Every image is letterboxed into a ``tile_width`` x ``tile_height`` cell,
+    filled left to right and top to bottom. The images may differ in size:
+    ``-reinit_filter 0`` keeps one filtergraph, as a rebuilt one would
+    restart ``tile`` and lose the tiles placed so far, and the padding is
+    worked out for each image rather than for the first.
+    """
+    cell = (f'scale={tile_width}:{tile_height}:force_original_aspect_ratio=decrease,'
+            f'pad={tile_width}:{tile_height}:(ow-iw)/2:(oh-ih)/2:eval=frame,setsar=1')
+    return [
+        ffmpeg_path(),
+        '-v', 'error',
+        '-f', 'image2pipe',
+        '-c:v', 'mjpeg',
+        '-reinit_filter', '0',
+        '-i', 'pipe:0',
+        '-vf', f'{cell},tile={columns}x{rows}',
+        '-frames:v', '1',
+        '-q:v', '4',
+        '-f', 'image2',
+        '-c:v', 'mjpeg',
+        'pipe:1',
+    ]
+
+
+def blank_tile_command(tile_width, tile_height):
+    """ffmpeg invocation that writes a dark placeholder JPEG for cameras without a snapshot."""
+    return [
+        ffmpeg_path(),
+        '-v', 'error',
+        '-f', 'lavfi',
+        '-i', f'color=c=0x202020:s={tile_width}x{tile_height}',
+        '-frames:v', '1',
+        '-f', 'image2',
+        '-c:v', 'mjpeg',
+        'pipe:1',
+    ]
+
+def _parse_rate(rate):
+    try:
+        num, _, den = rate.partition('/')
+        return round(float(num) / float(den or 1), 2)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return None
+
+
+def parse_probe(output):
+    """Turn ``probe_command`` output into a dict, or None if no video stream was found."""
+    try:
+        streams = json.loads(output or '{}').get('streams') or []
+    except ValueError:
+        return None
+    if not streams:
+        return None
+    video = streams[0]
+    return {
+        'codec': video.get('codec_name'),
+        'profile': video.get('profile'),
+        'pix_fmt': video.get('pix_fmt'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': _parse_rate(video.get('avg_frame_rate')),
+    }
+
+
+def can_copy(video):
+    """Whether the camera's video can be remuxed into HLS as-is."""
+    if not video or video.get('codec') not in COPYABLE_CODECS:
+        return False
+    return video.get('pix_fmt') in COPYABLE_PIX_FMTS + (None,)
+
+
+def progress_args():
+    # Machine-readable progress on stderr for stream/metrics.py, instead of the stats line
+    return ['-progress', 'pipe:2', '-nostats']
+
+
+def input_args(rtsp_url):
+    return [
+        '-rtsp_transport', 'tcp',
+        '-analyzeduration', '1000000',  # Increased analyze duration
+        '-probesize', '1000000',        # Increased probe size
+        '-timeout', '5000000',
+        '-i', rtsp_url,
+    ]
+
+
+def transcode_args(gop=15):
+    return [
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-tune', 'zerolatency',
+        '-g', str(gop),
+        '-keyint_min', str(gop),
+        '-sc_threshold', '0',
+        '-bf', '0',
+        '-maxrate', '500k',
+        '-bufsize', '1000k',
+        '-s', '640x360',
+        '-r', '15',
+        '-threads', '4',
+    ]
+
+
+def abr_args(renditions):
+    """One decode, split into a scaled x264 encode per rendition.
+
+    Audio is dropped: var_stream_map would otherwise need an audio track in
+    every variant and camera audio is rarely wanted on a wall of tiles.
+    """
+    count = len(renditions)
+    graph = [f"[0:v]split={count}" + ''.join(f'[v{i}]' for i in range(count))]
+    graph += [f"[v{i}]scale={r['width']}:{r['height']}[v{i}out]" for i, r in enumerate(renditions)]
+    args = ['-filter_complex', ';'.join(graph)]
+    for i, rendition in enumerate(renditions):
+        bitrate = rendition['bitrate']
+        args += [
+            '-map', f'[v{i}out]',
+            f'-c:v:{i}', 'libx264',
+            f'-b:v:{i}', f'{bitrate}k',
+            f'-maxrate:v:{i}', f'{bitrate}k',
+            f'-bufsize:v:{i}', f'{bitrate * 2}k',
+        ]
+    args += [
+        '-an',
+        '-preset', 'ultrafast',
+        '-tune', 'zerolatency',
+        '-g', '15',
+        '-keyint_min', '15',
+        '-sc_threshold', '0',
+        '-bf', '0',
+        '-r', '15',
+        '-threads', '4',
+    ]
+    return args
+
+
+def abr_output_args(renditions, master_playlist):
+    return [
+        '-var_stream_map', ' '.join(f"v:{i},name:{r['name']}" for i, r in enumerate(renditions)),
+        '-master_pl_name', master_playlist,
+    ]
+
+
+def copy_args():
+    # Segments can only be cut on the camera's own keyframes, so they may run
+    # longer than hls_time when the camera GOP is long.
+    return ['-c:v', 'copy']
+
+
+def push_args():
+    # One keep-alive connection for every PUT/DELETE instead of one per file.
+    # append_list is dropped because ffmpeg cannot read a playlist back over HTTP.
+    return ['-method', 'PUT', '-http_persistent', '1']
+
+
+def hls_args(playlist, segment_pattern, extra_args=(), flags=HLS_FLAGS):
+    return list(extra_args) + [
+        '-f', 'hls',
+        '-hls_time', '2',
+        '-hls_list_size', '3',
+        '-hls_flags', flags,
+        '-hls_segment_type', 'mpegts',
+        '-hls_playlist_type', 'event',
+        '-hls_segment_filename', segment_pattern,
+        '-hls_init_time', '1',
+        '-hls_start_number_source', 'datetime',
+        '-hls_allow_cache', '0',
+        playlist,
+    ]
+
+
+def llhls_output_args(playlist, part_pattern):
+    # Every part starts on a keyframe (gop == part length), so each one is
+    # independently decodable. temp_file makes parts appear atomically, and
+    # epoch_us numbering keeps part numbers increasing across encoder restarts.
+    return [
+        '-f', 'hls',
+        '-hls_time', f'{LLHLS_PART_FRAMES / LLHLS_FPS:.3f}',
+        '-hls_list_size', str(LLHLS_WINDOW_PARTS),
+        '-hls_flags', 'delete_segments+independent_segments+temp_file',
+        '-hls_segment_type', 'fmp4',
+        '-hls_fmp4_init_filename', LLHLS_INIT,
+        '-hls_segment_filename', part_pattern,
+        '-hls_start_number_source', 'epoch_us',
+        '-hls_allow_cache', '0',
+        playlist,
+    ]
+
+
+def keyframe_args(image):
+    # A second output that rewrites one small JPEG on every keyframe
+    return [
+        '-map', '0:v:0',
+        '-vf', "select='eq(pict_type,I)',scale=640:-2",
+        '-fps_mode', 'vfr',
+        '-q:v', '5',
+        '-update', '1',
+        '-f', 'image2',
+        image,
+    ]
+
+
+def motion_args(fd):
+    # Low-rate gray frames for stream/motion.py on an inherited pipe
+    return [
+        '-map', '0:v:0',
+        '-vf', f'fps={settings.MOTION_SAMPLE_FPS},scale={settings.MOTION_WIDTH}:{settings.MOTION_HEIGHT},format=gray',
+        '-f', 'rawvideo',
+        f'pipe:{fd}',
+    ]
+
+
+def mse_args():
+    # Constrained baseline matches MSE_MIME, audio would need its own codec string
+    return transcode_args(gop=MSE_GOP) + ['-profile:v', 'baseline', '-level', '3.1', '-an']
+
+
+def mse_output_args():
+    return [
+        '-f', 'mp4',
+        '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-flush_packets', '1',
+        'pipe:1',
+    ]
+
+
+def build_hls_command(rtsp_url, profile, video=None, playlist='index.m3u8', segment_pattern='%03d.ts',
+                      push_url=None, keyframe_image=None):
+    """Build the ffmpeg command for a profile. Returns ``(cmd, video_mode)``.
+
+    Outputs are relative because ffmpeg runs with the stream directory as cwd,
+    and ``playlist`` is always what players should load. The 'remux' profile
+    copies the camera bitstream when ``video`` (from ``parse_probe``) shows it
+    is HLS compatible and transcodes otherwise. The 'abr' profile writes one
+    variant playlist per ``settings.HLS_RENDITIONS`` entry next to a master
+    ``playlist``. The 'llhls' profile ignores ``playlist``/``segment_pattern``
+    and writes the ``LLHLS_*`` files the llhls view serves from. The 'mse'
+    profile writes nothing to disk and streams fragmented MP4 to stdout.
+
+    With ``push_url`` the HLS profiles PUT every file under that URL (the
+    segment store) instead of writing to the stream directory. With
+    ``keyframe_image`` every keyframe is also written to that JPEG, except
+    when the video is copied: that would decode every frame just for the
+    image, so ``snapshot.stream_keyframe`` takes it from a segment instead.
+    """
+    extra_output = keyframe_args(keyframe_image) if keyframe_image else []
+    output, extra_args, flags = playlist, (), HLS_FLAGS
+    if profile == 'mse':
+        cmd = [ffmpeg_path()] + progress_args() + input_args(rtsp_url) + mse_args() + mse_output_args()
+        return cmd + extra_output, 'transcode'
+    if profile == 'llhls':
+        video_args = transcode_args(gop=LLHLS_PART_FRAMES)
+        cmd = [ffmpeg_path()] + progress_args() + input_args(rtsp_url) + video_args + llhls_output_args(LLHLS_PLAYLIST, LLHLS_PART_PATTERN)
+        return cmd + extra_output, 'transcode'
+    if profile == 'abr':
+        renditions = settings.HLS_RENDITIONS
+        video_mode, video_args = 'abr', abr_args(renditions)
+        stem, _, ext = playlist.rpartition('.')
+        output, segment_pattern = f'{stem}_%v.{ext}', f'%v_{segment_pattern}'
+        extra_args = abr_output_args(renditions, playlist)
+    elif profile == 'remux' and can_copy(video):
+        video_mode, video_args = 'copy', copy_args()
+    else:
+        video_mode, video_args = 'transcode', transcode_args()
+    if profile == 'remux' and video_mode == 'transcode':
+        logger.info(f"Camera video {video} is not HLS compatible, falling back to transcoding")
+    if push_url:
+        # The master playlist name stays relative, ffmpeg resolves it against the output URL
+        output, segment_pattern = push_url + output, push_url + segment_pattern
+        extra_args, flags = list(extra_args) + push_args(), PUSH_HLS_FLAGS
+    cmd = [ffmpeg_path()] + progress_args() + input_args(rtsp_url) + video_args + hls_args(output, segment_pattern, extra_args, flags)
+    if video_mode == 'copy':
+        return cmd, video_mode
+    return cmd + extra_output, video_mode
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import threading
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# Receives every stream's events, delivered in batches
+STREAMS_GROUP = 'streams'
+# Status changes inside this window are coalesced, the latest per stream wins
+BATCH_INTERVAL = 0.25
+
+# Loop serving StreamConsumer connections. The in-memory channel layer is not
+# thread-safe, so events raised on the stream runner loop are handed over to it.
+_consumer_loop = None
+
+# stream_id -> latest pending stream_update, in order of last change
+_pending = {}
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+
+
+def bind_consumer_loop(loop):
+    global _consumer_loop
+    _consumer_loop = loop
+
+
+def stream_group(stream_id):
+    return f'stream.{stream_id}'
+
+
+def _message(stream_id, status, error='', motion=None):
+    message = {'type': 'stream_update', 'stream_id': stream_id, 'status': status, 'error': error}
+    if motion is not None:
+        message['motion'] = motion
+    return message
+
+
+async def publish(stream_id, status, error='', motion=None):
+    """Queue a stream_update event for the next batch, from async code running on any loop.
+
+    ``motion`` is the stream's activity state (see stream/motion.py); a
+    status change coalesced with it keeps the latest one.
+    """
+    global _flush_scheduled
+    with _pending_lock:
+        previous = _pending.pop(stream_id, None)
+        if motion is None and previous is not None:
+            motion = previous.get('motion')
+        _pending[stream_id] = _message(stream_id, status, error, motion)
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    asyncio.get_running_loop().call_later(BATCH_INTERVAL, lambda: asyncio.ensure_future(flush()))
+
+
+async def flush():
+    """Send queued events: one per stream group and a single batch to STREAMS_GROUP."""
+    global _flush_scheduled
+    with _pending_lock:
+        updates = list(_pending.values())
+        _pending.clear()
+        _flush_scheduled = False
+    if not updates:
+        return
+    channel_layer = get_channel_layer()
+
+    async def send():
+        for update in updates:
+            await channel_layer.group_send(stream_group(update['stream_id']), update)
+        await channel_layer.group_send(STREAMS_GROUP, {'type': 'stream_batch', 'updates': updates})
+
+    try:
+        loop = _consumer_loop
+        if (not isinstance(channel_layer, InMemoryChannelLayer) or loop is None or not loop.is_running()
+                or loop is asyncio.get_running_loop()):
+            await send()
+        else:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(send(), loop))
+    except Exception as e:
+        logger.error(f"Error sending {len(updates)} stream events: {str(e)}")
@@ -0,0 +1,106 @@
+"""Low-Latency HLS playlists built from ffmpeg's short fMP4 parts.
+
+ffmpeg's hls muxer has no notion of partial segments, so the 'llhls' profile
+has it emit one small fMP4 fragment per keyframe (a "part") into
+``encoder.LLHLS_PLAYLIST``. This module groups every ``PARTS_PER_SEGMENT``
+consecutive parts into a media segment and renders the LL-HLS playlist with
+``#EXT-X-PART`` entries, a preload hint for the next part and blocking reload
+support. Part number ``k`` belongs to media sequence ``k // PARTS_PER_SEGMENT``.
+"""
+import os
+import re
+import math
+
+from . import encoder
+
+PARTS_PER_SEGMENT = 6
+# Complete segments that still list their parts, besides the one in progress
+RECENT_SEGMENTS_WITH_PARTS = 2
+
+PART_RE = re.compile(r'^part(\d+)\.m4s$')
+SEGMENT_RE = re.compile(r'^seg(\d+)\.m4s$')
+
+
+def part_name(part):
+    return encoder.LLHLS_PART_PATTERN % part
+
+
+def read_parts(stream_dir):
+    """Return ``[(part_number, duration), ...]`` from ffmpeg's playlist, oldest first."""
+    try:
+        with open(os.path.join(stream_dir, encoder.LLHLS_PLAYLIST)) as playlist:
+            lines = playlist.read().splitlines()
+    except FileNotFoundError:
+        return []
+    parts = []
+    duration = None
+    for line in lines:
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[len('#EXTINF:'):].split(',', 1)[0])
+            except ValueError:
+                duration = None
+        elif line and not line.startswith('#'):
+            match = PART_RE.match(line.strip())
+            if match and duration is not None:
+                parts.append((int(match.group(1)), duration))
+            duration = None
+    return parts
+
+
+def last_part(stream_dir):
+    parts = read_parts(stream_dir)
+    return parts[-1][0] if parts else None
+
+
+def part_target(parts):
+    return max(duration for _, duration in parts)
+
+
+def target_duration(parts):
+    return math.ceil(part_target(parts) * PARTS_PER_SEGMENT)
+
+
+def render_playlist(parts):
+    """Render the LL-HLS media playlist, or None until ffmpeg has written parts."""
+    if not parts:
+        return None
+    first = parts[0][0]
+    last = parts[-1][0]
+    # A segment at the head of ffmpeg's window may already have lost parts
+    first_msn = -(-first // PARTS_PER_SEGMENT)
+    durations = dict(parts)
+    target = part_target(parts)
+    last_msn = last // PARTS_PER_SEGMENT
+    complete_msn = last_msn if (last + 1) % PARTS_PER_SEGMENT == 0 else last_msn - 1
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:9',
+        f'#EXT-X-TARGETDURATION:{target_duration(parts)}',
+        f'#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={target * 3:.3f}',
+        f'#EXT-X-PART-INF:PART-TARGET={target:.3f}',
+        f'#EXT-X-MEDIA-SEQUENCE:{first_msn}',
+        f'#EXT-X-MAP:URI="{encoder.LLHLS_INIT}"',
+    ]
+    for msn in range(first_msn, last_msn + 1):
+        segment_parts = [p for p in range(msn * PARTS_PER_SEGMENT, (msn + 1) * PARTS_PER_SEGMENT) if p in durations]
+        if msn > complete_msn - RECENT_SEGMENTS_WITH_PARTS:
+            for part in segment_parts:
+                lines.append(f'#EXT-X-PART:DURATION={durations[part]:.3f},URI="{part_name(part)}",INDEPENDENT=YES')
+        if msn <= complete_msn:
+            lines.append(f'#EXTINF:{sum(durations[p] for p in segment_parts):.3f},')
+            lines.append(f'seg{msn}.m4s')
+    lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{part_name(last + 1)}"')
+    return '\n'.join(lines) + '\n'
+
+
+def blocking_target(msn, part=None):
+    """Part number that must exist before a ``_HLS_msn``/``_HLS_part`` reload can be answered."""
+    if part is None:
+        return (msn + 1) * PARTS_PER_SEGMENT - 1
+    return msn * PARTS_PER_SEGMENT + part
+
+
+def segment_parts(msn):
+    return [part_name(p) for p in range(msn * PARTS_PER_SEGMENT, (msn + 1) * PARTS_PER_SEGMENT)]
@@ -0,0 +1,265 @@
+"""Non-blocking, structured logging (``LOGGING_CONFIG`` points at ``configure``).
+
+Code logging on a request path or on the runner loop only puts records on
+a bounded in-memory queue; a listener thread formats and writes them to
+the console and a size-rotated ``LOG_FILE``. When the queue is full,
+records are dropped and counted rather than waited for.
+
+Records carry the ``stream_id`` and ``pid`` bound to the current thread
+or asyncio task with ``bind``/``bound``, shown as a suffix in text logs
+and as fields with ``LOG_FORMAT=json``. A call site that logs more than
+``LOG_RATE_LIMIT`` records in ``LOG_RATE_WINDOW`` seconds is muted for the
+rest of the window, and its next record says how many were suppressed.
+
+ffmpeg's stderr does not go to the main log: each stream's lines are
+written to ``STREAM_LOG_DIR/<stream_id>.log``, rotated at
+``STREAM_LOG_MAX_BYTES`` with ``STREAM_LOG_BACKUPS`` old files, and logs of
+streams idle for ``STREAM_LOG_RETENTION_HOURS`` are deleted.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.config
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from django.conf import settings
+
+CONTEXT_FIELDS = ('stream_id', 'pid')
+FFMPEG_LOGGER = 'stream.ffmpeg'
+# Per-stream stderr files kept open at once, least recently written closed first
+STREAM_LOG_OPEN_FILES = 64
+STREAM_LOG_PRUNE_INTERVAL = 600
+
+_context = contextvars.ContextVar('log_context', default={})
+_listeners = []
+
+
+def bind(**fields):
+    """Attach ``fields`` (e.g. stream_id, pid) to records logged from the current task or thread."""
+    _context.set({**_context.get(), **fields})
+
+
+@contextmanager
+def bound(**fields):
+    """``bind`` for the duration of a block, for threads that serve many streams."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the bound context to records that were not given it explicitly."""
+
+    def filter(self, record):
+        context = _context.get()
+        for key in CONTEXT_FIELDS:
+            if getattr(record, key, None) is None:
+                setattr(record, key, context.get(key))
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most ``limit`` records per ``window`` seconds through from each call site."""
+
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (pathname, lineno) -> [window start, records passed, records suppressed]
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= self.window:
+                suppressed = site[2] if site is not None else 0
+                self._sites[key] = [record.created, 1, 0]
+            elif site[1] < self.limit:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f'{record.getMessage()} ({suppressed} similar messages suppressed)'
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to a bounded queue, dropping them instead of blocking when it is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f'Dropped {dropped} log records, the log queue was full',
+            })
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped = dropped
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        context = ' '.join(f'{key}={getattr(record, key)}' for key in CONTEXT_FIELDS
+                           if getattr(record, key, None) is not None)
+        return f'{text} [{context}]' if context else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the record's level, logger, message and context."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StreamStderrHandler(logging.Handler):
+    """Writes each stream's ffmpeg stderr lines to its own rotating file. Runs on the listener thread."""
+
+    def __init__(self, directory, max_bytes, backups, retention_hours):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.retention = retention_hours * 3600
+        self._files = OrderedDict()
+        self._pruned_at = 0
+        self.setFormatter(logging.Formatter('%(asctime)s [%(pid)s] %(message)s'))
+
+    def emit(self, record):
+        stream_id = getattr(record, 'stream_id', None)
+        if not stream_id:
+            return
+        handler = self._files.get(stream_id)
+        if handler is None:
+            self._prune()
+            # Made on the first stream's output, not for processes that never run ffmpeg
+            os.makedirs(self.directory, exist_ok=True)
+            handler = RotatingFileHandler(os.path.join(self.directory, f'{stream_id}.log'),
+                                          maxBytes=self.max_bytes, backupCount=self.backups, delay=True)
+            handler.setFormatter(self.formatter)
+            self._files[stream_id] = handler
+            while len(self._files) > STREAM_LOG_OPEN_FILES:
+                self._files.popitem(last=False)[1].close()
+        else:
+            self._files.move_to_end(stream_id)
+        handler.emit(record)
+
+    def _prune(self):
+        now = time.time()
+        if not self.retention or now - self._pruned_at < STREAM_LOG_PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            stream_id = entry.name.split('.', 1)[0]
+            try:
+                if stream_id not in self._files and now - entry.stat().st_mtime > self.retention:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def close(self):
+        for handler in self._files.values():
+            handler.close()
+        self._files.clear()
+        super().close()
+
+
+def _listen(log_queue, *handlers):
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return listener
+
+
+def _stop_listeners():
+    # Flushes what is still queued, so records logged while exiting are kept
+    for listener in _listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    _listeners.clear()
+
+
+def configure(config):
+    """Apply ``LOGGING``, then move the root handlers behind a queue and set up ffmpeg stderr logs."""
+    if settings.LOG_FILE:
+        os.makedirs(os.path.dirname(settings.LOG_FILE), exist_ok=True)
+    logging.config.dictConfig(config)
+    _stop_listeners()
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    queue_handler = DroppingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT, settings.LOG_RATE_WINDOW))
+    root.addHandler(queue_handler)
+    _listen(queue_handler.queue, *handlers)
+
+    ffmpeg_logger = logging.getLogger(FFMPEG_LOGGER)
+    ffmpeg_logger.propagate = False
+    ffmpeg_logger.handlers.clear()
+    ffmpeg_logger.disabled = not settings.STREAM_LOG_MAX_BYTES
+    if settings.STREAM_LOG_MAX_BYTES:
+        ffmpeg_logger.setLevel(logging.INFO)
+        stderr_handler = DroppingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+        ffmpeg_logger.addHandler(stderr_handler)
+        _listen(stderr_handler.queue, StreamStderrHandler(
+            settings.STREAM_LOG_DIR, settings.STREAM_LOG_MAX_BYTES, settings.STREAM_LOG_BACKUPS,
+            settings.STREAM_LOG_RETENTION_HOURS,
+        ))
+
+
+atexit.register(_stop_listeners)
+
+_ffmpeg_logger = logging.getLogger(FFMPEG_LOGGER)
+
+
+def ffmpeg_line(stream_id, pid, line):
+    """Log one line of a stream's ffmpeg stderr to its own file."""
+    _ffmpeg_logger.info(line, extra={'stream_id': stream_id, 'pid': pid})
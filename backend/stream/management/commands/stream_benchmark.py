@@ -0,0 +1,116 @@
+import json
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from stream.benchmark import Benchmark, SyntheticCameras, regressions
+from stream.registry import PROFILES
+
+
+class Command(BaseCommand):
+    help = 'Load-test a running server: stream start/stop latency, encoder cost, segment serving, WebSocket fan-out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/',
+                            help='server to test, which must be running already')
+        parser.add_argument('--streams', type=int, default=8, help='number of streams to start')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='starts, stops and segment fetchers in flight at once')
+        parser.add_argument('--profile', default='transcode', choices=PROFILES)
+        parser.add_argument('--ws-clients', type=int, default=10,
+                            help='status sockets to open for the fan-out measurement')
+        parser.add_argument('--sample-seconds', type=float, default=5,
+                            help='how long to measure encoder CPU for')
+        parser.add_argument('--serve-seconds', type=float, default=10,
+                            help='how long to fetch playlists and segments for')
+        parser.add_argument('--source', action='append', default=[],
+                            help='RTSP URL to use instead of synthetic cameras (repeatable, reused round robin)')
+        parser.add_argument('--rtsp-server', default='mediamtx',
+                            help='RTSP server binary for the synthetic cameras')
+        parser.add_argument('--rtsp-port', type=int, default=8554)
+        parser.add_argument('--size', default='1280x720', help='synthetic camera resolution')
+        parser.add_argument('--fps', type=int, default=25, help='synthetic camera frame rate')
+        parser.add_argument('--json', dest='json_path', help='write the report to this file')
+        parser.add_argument('--baseline', help='earlier --json report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed slowdown against --baseline, as a fraction')
+
+    def handle(self, *args, **options):
+        if options['streams'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--streams and --concurrency must be at least 1')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {options['baseline']}: {str(e)}")
+
+        cameras = None
+        if options['source']:
+            sources = options['source']
+            rtsp_urls = [sources[i % len(sources)] for i in range(options['streams'])]
+        else:
+            cameras = SyntheticCameras(options['streams'], options['rtsp_server'], options['rtsp_port'],
+                                       options['size'], options['fps'])
+            self.stdout.write(f"Publishing {options['streams']} synthetic cameras on port {options['rtsp_port']}")
+            try:
+                cameras.start()
+            except (RuntimeError, OSError) as e:
+                cameras.stop()
+                raise CommandError(str(e))
+            rtsp_urls = cameras.urls
+
+        benchmark = Benchmark(
+            options['base_url'], rtsp_urls, options['profile'], options['concurrency'], options['ws_clients'],
+            options['sample_seconds'], options['serve_seconds'], log=self.stdout.write,
+        )
+        try:
+            report = asyncio.run(benchmark.run())
+        except (OSError, RuntimeError) as e:
+            raise CommandError(f'Benchmark failed: {str(e)}')
+        finally:
+            if cameras is not None:
+                cameras.stop()
+
+        self._print(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if baseline is not None:
+            found = regressions(report, baseline, options['tolerance'])
+            if found:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(found))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def _print(self, report):
+        def line(label, stats, unit='s'):
+            if not stats or not stats.get('count'):
+                self.stdout.write(f'  {label:<22} n/a')
+                return
+            self.stdout.write(f"  {label:<22} n={stats['count']:<5} mean={stats['mean']}{unit} p50={stats['p50']}{unit} "
+                              f"p90={stats['p90']}{unit} p99={stats['p99']}{unit} max={stats['max']}{unit}")
+
+        start, encoders, serve, stop = report['start'], report['encoders'], report['serve'], report['stop']
+        self.stdout.write(f"Start ({start['streams']} streams in {start['wall_seconds']}s)")
+        line('API response', start['response'])
+        line('time to playable', start['playable'])
+        for error in start['errors']:
+            self.stdout.write(self.style.WARNING(f'  failed: {error}'))
+        self.stdout.write('Encoders')
+        if encoders['available']:
+            line('CPU per stream', encoders['cpu_percent'], '%')
+            line('RSS per stream', encoders['rss_mb'], 'MB')
+        else:
+            self.stdout.write(f"  {encoders['reason']}")
+        self.stdout.write('Segment serving')
+        if serve['available']:
+            self.stdout.write(f"  {serve['requests_per_second']} requests/s, {serve['megabytes_per_second']} MB/s, "
+                              f"{serve['errors']} errors")
+            line('playlist fetch', serve['playlist'])
+            line('segment fetch', serve['segment'])
+        else:
+            self.stdout.write(f"  {serve['reason']}")
+        self.stdout.write(f"Stop and WebSocket fan-out ({stop['ws_clients']} clients)")
+        line('API response', stop['response'])
+        line('update delivered', stop['fanout'])
+        if stop['fanout_missing']:
+            self.stdout.write(self.style.WARNING(f"  {stop['fanout_missing']} updates never arrived"))
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Run several local stream supervisor nodes, to try out placement and failover on one machine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=3, help='number of nodes to run')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--base-port', type=int, default=8765, help='port of the first node, the others follow')
+        parser.add_argument('--budget', type=float,
+                            help='ENCODER_CPU_BUDGET of each node (defaults to the setting)')
+        parser.add_argument('--origin', default='',
+                            help='web server the nodes\' files are served from, e.g. http://127.0.0.1:8000')
+
+    def handle(self, *args, **options):
+        if options['nodes'] < 1:
+            raise CommandError('--nodes must be at least 1')
+        env = dict(os.environ)
+        if options['budget'] is not None:
+            env['ENCODER_CPU_BUDGET'] = str(options['budget'])
+        # The nodes serve streams themselves; STREAM_NODES is for the web tier
+        env.pop('STREAM_NODES', None)
+        manage = os.path.abspath(sys.argv[0])
+        processes = {}
+        for index in range(options['nodes']):
+            address = f"{options['host']}:{options['base_port'] + index}"
+            processes[address] = subprocess.Popen(
+                [sys.executable, manage, 'stream_supervisor', '--address', address], env=env)
+        entries = [f"{address}={options['origin']}" if options['origin'] else address for address in processes]
+        for address, process in processes.items():
+            self.stdout.write(f'Node {address} running as PID {process.pid}')
+        self.stdout.write(f"Start the web tier with STREAM_NODES={','.join(entries)}")
+        self.stdout.write('Kill a node\'s PID to see its streams move, Ctrl+C stops all nodes')
+
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            while any(process.poll() is None for process in processes.values()):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes.values():
+                if process.poll() is None:
+                    process.send_signal(signal.SIGINT)
+            for process in processes.values():
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            self.stdout.write('All nodes stopped')
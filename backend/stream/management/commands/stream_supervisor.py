@@ -0,0 +1,64 @@
+import signal
+import ipaddress
+import asyncio
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from stream import recovery
+from stream.supervisor import Supervisor, SocketSupervisorClient
+
+logger = logging.getLogger(__name__)
+
+
+def _loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Command(BaseCommand):
+    help = 'Run the stream supervisor that owns all ffmpeg processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--address',
+            default=settings.STREAM_SUPERVISOR_ADDRESS or '127.0.0.1:8765',
+            help='host:port to listen on (defaults to STREAM_SUPERVISOR_ADDRESS)',
+        )
+
+    def handle(self, *args, **options):
+        host, _, port = options['address'].rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            raise CommandError(f"Invalid address: {options['address']}")
+        if not settings.STREAM_NODE_TOKEN and not _loopback(host or '127.0.0.1'):
+            # Anyone reaching the port could start and stop encoders
+            raise CommandError(f'Set STREAM_NODE_TOKEN to listen on {host}, which is not a loopback address')
+        asyncio.run(self._serve(host or '127.0.0.1', port, options['address']))
+
+    async def _serve(self, host, port, node):
+        # Rows are tagged with the address as given, which STREAM_NODES entries must match
+        supervisor = Supervisor(node=node)
+        server = await supervisor.serve(host, port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, AttributeError):
+                # Windows: Ctrl+C surfaces as KeyboardInterrupt instead
+                pass
+        self.stdout.write(f'Stream supervisor listening on {host}:{port}')
+        # Relaunches what this node ran before a restart, through this server like any web worker
+        recovery.start(supervisor=SocketSupervisorClient(f'{host}:{port}'), node=node)
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await supervisor.shutdown()
+            self.stdout.write('Stream supervisor stopped, all encoders terminated')
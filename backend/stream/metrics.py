@@ -0,0 +1,175 @@
+"""Encoder health from ffmpeg's ``-progress`` reports.
+
+ffmpeg is started with ``-progress pipe:2 -nostats``, so every half second a
+block of ``key=value`` lines ending in ``progress=continue`` is interleaved
+with its log on stderr. ``StreamMetrics`` is fed each stderr line by the
+drain task, turns complete blocks into samples kept in a small ring buffer,
+and also times the "Opening '...' for writing" lines the segmenting muxers
+log. That gives the inter-segment interval, how far apart new segments are
+started, which grows past the segment duration when the encoder falls
+behind. It is not a write latency; ffmpeg does not report how long a
+segment takes to write.
+"""
+import re
+import time
+from collections import deque
+
+# Samples kept per stream, one every progress period (0.5 s by default)
+SAMPLES = 120
+
+PROGRESS_KEYS = frozenset((
+    'frame', 'fps', 'stream_0_0_q', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms',
+    'out_time', 'dup_frames', 'drop_frames', 'speed', 'progress',
+))
+OPENING_RE = re.compile(r"Opening '(.+?)' for writing")
+
+PROMETHEUS_METRICS = (
+    # (name, type, help, sample key)
+    ('rtsp_stream_fps', 'gauge', 'Frames per second produced by the encoder', 'fps'),
+    ('rtsp_stream_bitrate_bits', 'gauge', 'Output bitrate in bits per second', 'bitrate'),
+    ('rtsp_stream_speed', 'gauge', 'Encoding speed relative to real time', 'speed'),
+    ('rtsp_stream_lag_seconds', 'gauge', 'How far the encoder has fallen behind real time since its first report', 'lag'),
+    ('rtsp_stream_segment_interval_seconds', 'gauge',
+     'Inter-segment interval: wall time between the openings of the last two segments',
+     'segment_interval'),
+    ('rtsp_stream_dropped_frames_total', 'counter', 'Frames dropped by the current encoder', 'drop_frames'),
+    ('rtsp_stream_duplicated_frames_total', 'counter', 'Frames duplicated by the current encoder', 'dup_frames'),
+)
+
+NODE_GAUGES = (
+    # (name, help, key of the node in capacity['nodes'])
+    ('rtsp_node_up', 'Whether the stream node answers health checks', 'healthy'),
+    ('rtsp_node_load', 'Encoder load of the node relative to its CPU budget', 'load'),
+    ('rtsp_node_streams', 'Encoders running on the node', 'running'),
+)
+
+
+def _float(value):
+    try:
+        return float(value.rstrip('x'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _bitrate(value):
+    # "1024.5kbits/s", or "N/A" before the first packet is written
+    if not value or not value.endswith('kbits/s'):
+        return None
+    rate = _float(value[:-len('kbits/s')])
+    return rate * 1000 if rate is not None else None
+
+
+class StreamMetrics:
+    def __init__(self):
+        self.samples = deque(maxlen=SAMPLES)
+        self._block = {}
+        self._baseline = None
+        self._last_segment = None
+        self.segment_interval = None
+
+    def reset(self):
+        """Call when a new encoder process starts; its counters start from zero."""
+        self._block = {}
+        self._baseline = None
+        self._last_segment = None
+
+    def feed(self, line):
+        """Consume one stderr line. Returns True for progress lines, which are not log output."""
+        key, sep, value = line.partition('=')
+        key = key.strip()
+        if sep and key in PROGRESS_KEYS:
+            self._block[key] = value.strip()
+            if key == 'progress':
+                self._add_sample(self._block)
+                self._block = {}
+            return True
+        match = OPENING_RE.search(line)
+        if match and not match.group(1).endswith('.m3u8') and not match.group(1).endswith('.m3u8.tmp'):
+            now = time.monotonic()
+            if self._last_segment is not None:
+                self.segment_interval = round(now - self._last_segment, 3)
+            self._last_segment = now
+        return False
+
+    def _add_sample(self, block):
+        now = time.monotonic()
+        out_time = _float(block.get('out_time_us'))
+        lag = None
+        if out_time is not None and out_time >= 0:
+            # Measured from the first report so connection setup doesn't count
+            if self._baseline is None:
+                self._baseline = (now, out_time)
+            lag = round((now - self._baseline[0]) - (out_time - self._baseline[1]) / 1000000, 3)
+        self.samples.append((
+            time.time(),
+            _float(block.get('fps')),
+            _bitrate(block.get('bitrate')),
+            _float(block.get('speed')),
+            int(_float(block.get('drop_frames')) or 0),
+            int(_float(block.get('dup_frames')) or 0),
+            lag,
+        ))
+
+    def as_dict(self, history=False):
+        result = {'segment_interval': self.segment_interval}
+        if self.samples:
+            timestamp, fps, bitrate, speed, drop_frames, dup_frames, lag = self.samples[-1]
+            speeds = [sample[3] for sample in self.samples if sample[3] is not None]
+            result.update({
+                'updated_at': timestamp,
+                'fps': fps,
+                'bitrate': bitrate,
+                'speed': speed,
+                'min_speed': min(speeds) if speeds else None,
+                'drop_frames': drop_frames,
+                'dup_frames': dup_frames,
+                'lag': lag,
+            })
+        if history:
+            result['history'] = [list(sample) for sample in self.samples]
+        return result
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(streams, capacity=None):
+    """Prometheus text exposition for ``Supervisor.list()`` and ``Supervisor.capacity()`` output."""
+    lines = []
+    if capacity is not None:
+        for name, help_text, key in (
+            ('rtsp_encoder_cpu_budget_cores', 'Cores encoders may use together', 'budget'),
+            ('rtsp_encoder_cpu_used_cores', 'Cores charged to running encoders', 'used'),
+            ('rtsp_encoder_queued', 'Streams waiting for encoder capacity', 'queued'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {capacity[key]}']
+        # Per node when streams are spread over several (stream/coordinator.py)
+        for name, help_text, key in NODE_GAUGES if capacity.get('nodes') else ():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for node in capacity['nodes']:
+                value = node[key]
+                if value is not None:
+                    value = int(value) if isinstance(value, bool) else value
+                    lines.append(f'{name}{{node="{_label(node["address"])}"}} {value}')
+
+    def family(name, kind, help_text, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for stream, value in values:
+            if value is None:
+                continue
+            labels = f'stream_id="{_label(stream["stream_id"])}",profile="{_label(stream["profile"])}"'
+            lines.append(f'{name}{{{labels}}} {value}')
+
+    family('rtsp_stream_up', 'gauge', 'Whether the stream is producing output',
+           [(stream, 1 if stream['status'] == 'connected' else 0) for stream in streams])
+    family('rtsp_stream_viewers', 'gauge', 'Viewers sharing the stream',
+           [(stream, stream['viewers']) for stream in streams])
+    family('rtsp_stream_restarts_total', 'counter', 'Encoder restarts after a crash',
+           [(stream, stream['restarts']) for stream in streams])
+    family('rtsp_stream_cpu_cores', 'gauge', 'Measured CPU use of the encoder in cores',
+           [(stream, (stream.get('encoder') or {}).get('cpu')) for stream in streams])
+    for name, kind, help_text, key in PROMETHEUS_METRICS:
+        family(name, kind, help_text, [(stream, (stream.get('metrics') or {}).get(key)) for stream in streams])
+    return '\n'.join(lines) + '\n'
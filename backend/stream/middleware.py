@@ -0,0 +1,37 @@
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import activity
+
+
+class ViewerActivityMiddleware:
+    """Counts player fetches of HLS files as viewer activity (see stream/activity.py)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pattern = re.compile(
+            rf'^(?:{re.escape(settings.MEDIA_URL)}streams|/api/stream/(?:llhls|store))/([0-9a-f-]{{36}})/'
+        )
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._note(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self._note(request)
+        return await self.get_response(request)
+
+    def _note(self, request):
+        # ffmpeg's own PUT/DELETE into the segment store is not a viewer
+        if request.method not in ('GET', 'HEAD'):
+            return
+        match = self.pattern.match(request.path)
+        if match:
+            activity.note(match.group(1))
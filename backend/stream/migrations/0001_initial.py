@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stream',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('rtsp_url', models.TextField()),
+                ('profile', models.CharField(max_length=16)),
+                ('output', models.CharField(default='files', max_length=8)),
+                ('warm', models.BooleanField(default=False)),
+                ('record', models.BooleanField(default=False)),
+                ('motion_threshold', models.FloatField(blank=True, null=True)),
+                ('viewers', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(default='starting', max_length=16)),
+                ('error', models.TextField(blank=True, default='')),
+                ('pid', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='node',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -1,3 +1,33 @@
 from django.db import models
 
-# Create your models here.
+
+class Stream(models.Model):
+    """A stream viewers asked for, kept so a restarted server can bring it back.
+
+    The supervisor writes a row as the stream changes state and deletes it
+    when the last viewer releases the stream. Rows left after a crash or a
+    restart are recovered under the same ID by stream/recovery.py, so
+    players holding the stream URL keep working.
+    """
+    id = models.UUIDField(primary_key=True)
+    rtsp_url = models.TextField()
+    profile = models.CharField(max_length=16)
+    output = models.CharField(max_length=8, default='files')
+    warm = models.BooleanField(default=False)
+    record = models.BooleanField(default=False)
+    motion_threshold = models.FloatField(null=True, blank=True)
+    viewers = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, default='starting')
+    error = models.TextField(blank=True, default='')
+    # ffmpeg's PID while it runs, to find survivors of a crash
+    pid = models.IntegerField(null=True, blank=True)
+    # Supervisor address of the node running it, empty for an in-process supervisor
+    node = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'{self.id} ({self.profile}, {self.status})'
@@ -0,0 +1,135 @@
+"""Motion detection on a grayscale frame tap of a stream's own decode.
+
+Streams started with a motion threshold get a second ffmpeg output: the
+decoded video resampled to ``MOTION_SAMPLE_FPS`` frames per second,
+scaled to ``MOTION_WIDTH`` x ``MOTION_HEIGHT`` gray pixels and written raw
+to a pipe the supervisor passes in. So analysis costs one tiny scale per
+sampled frame and no second RTSP session or decode.
+
+Each frame is compared with the previous one in a small thread pool
+(NumPy releases the GIL). The score is the fraction of pixels whose
+brightness changed by more than ``PIXEL_DELTA``. The reader never
+waits for scoring and drops frames that arrive while the previous one is
+still being scored, because ffmpeg would stall its live output if the pipe filled up.
+``MotionDetector`` turns scores into debounced activity start/end events,
+which the supervisor publishes as the ``motion`` field of stream updates.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Brightness change (0-255) that counts a pixel as changed, above sensor noise
+PIXEL_DELTA = 25
+# Samples above the threshold before activity starts, and below it before it ends
+START_AFTER = 2
+END_AFTER_SECONDS = 3
+# While active, score updates are published at most this often
+REPORT_INTERVAL = 1
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.MOTION_WORKERS, thread_name_prefix='motion')
+    return _executor
+
+
+def frame_size():
+    return settings.MOTION_WIDTH * settings.MOTION_HEIGHT
+
+
+def score(previous, frame):
+    """Fraction of pixels that changed noticeably between two gray frames (uint8 arrays)."""
+    changed = np.abs(frame.astype(np.int16) - previous) > PIXEL_DELTA
+    return float(np.count_nonzero(changed)) / changed.size
+
+
+class MotionDetector:
+    """Debounced activity state of one stream."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.active = False
+        self.score = 0.0
+        self.peak = 0.0
+        self.events = 0
+        self.dropped = 0
+        self._above = 0
+        self._below = 0
+
+    def feed(self, value):
+        """Record a score. Returns 'start' or 'end' when the activity state flips, else None."""
+        self.score = value
+        if value >= self.threshold:
+            self._above += 1
+            self._below = 0
+        else:
+            self._below += 1
+            self._above = 0
+        if self.active:
+            self.peak = max(self.peak, value)
+            if self._below >= END_AFTER_SECONDS * settings.MOTION_SAMPLE_FPS:
+                self.active = False
+                return 'end'
+        elif self._above >= START_AFTER:
+            self.active = True
+            self.peak = value
+            self.events += 1
+            return 'start'
+        return None
+
+    def as_dict(self):
+        return {
+            'threshold': self.threshold,
+            'active': self.active,
+            'score': round(self.score, 4),
+            'peak': round(self.peak, 4),
+            'events': self.events,
+            'dropped_frames': self.dropped,
+        }
+
+
+async def analyse(read_fd, detector, on_change):
+    """Read frames from ``read_fd`` until ffmpeg closes it, feeding ``detector``.
+
+    ``on_change(detector)`` is awaited when activity starts or ends, and
+    every ``REPORT_INTERVAL`` seconds while it lasts. Owns (and closes) the fd.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=frame_size() * 4)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                open(read_fd, 'rb', buffering=0))
+    previous = None
+    scoring = None
+    reported_at = 0
+    try:
+        while True:
+            try:
+                data = await reader.readexactly(frame_size())
+            except asyncio.IncompleteReadError:
+                return
+            if scoring is not None and not scoring.done():
+                detector.dropped += 1
+                continue
+            if scoring is not None:
+                change = None
+                try:
+                    change = detector.feed(scoring.result())
+                except Exception as e:
+                    logger.error(f"Motion scoring failed: {str(e)}")
+                now = loop.time()
+                if change or (detector.active and now - reported_at >= REPORT_INTERVAL):
+                    reported_at = now
+                    await on_change(detector)
+            frame = np.frombuffer(data, dtype=np.uint8)
+            scoring = loop.run_in_executor(_get_executor(), score, previous, frame) if previous is not None else None
+            previous = frame
+    finally:
+        transport.close()
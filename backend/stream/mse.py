@@ -0,0 +1,136 @@
+"""Fan-out of fragmented MP4 from ffmpeg's stdout to WebSocket viewers.
+
+ffmpeg runs on the supervisor loop while WebSocket consumers may run on
+another loop (or, behind a standalone supervisor, in another process), so
+each subscriber gets its own bounded queue on its own loop. The same bytes
+object is handed to every subscriber; nothing is copied per viewer.
+"""
+import struct
+import asyncio
+import threading
+
+# Fragments a viewer may fall behind before its backlog is thrown away.
+# Every fragment starts on a keyframe, so skipping ahead is always safe.
+SUBSCRIBER_BACKLOG = 8
+
+
+async def read_boxes(reader):
+    """Yield ``(box_type, box_bytes)`` for each top-level MP4 box on a StreamReader."""
+    while True:
+        try:
+            header = await reader.readexactly(8)
+            size, box_type = struct.unpack('>I4s', header)
+            if size == 1:
+                extended = await reader.readexactly(8)
+                header += extended
+                size = struct.unpack('>Q', extended)[0]
+            elif size == 0:
+                # Box runs to the end of the stream, only seen in non-fragmented output
+                yield box_type, header + await reader.read()
+                return
+            elif size < 8:
+                raise ValueError(f'Corrupt MP4 box header from ffmpeg: {header!r}')
+            body = await reader.readexactly(size - len(header))
+        except asyncio.IncompleteReadError:
+            return
+        yield box_type, header + body
+
+
+class Subscriber:
+    def __init__(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self.dropped = 0
+
+    def push(self, data):
+        """Queue a fragment (None ends the stream). Safe to call from any thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._put(data)
+        else:
+            self._loop.call_soon_threadsafe(self._put, data)
+
+    def _put(self, data):
+        if data is not None and self._queue.qsize() >= SUBSCRIBER_BACKLOG:
+            # Slow consumer: skip to the live edge instead of buffering without bound
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                self.dropped += 1
+        self._queue.put_nowait(data)
+
+    async def get(self):
+        return await self._queue.get()
+
+
+class FragmentHub:
+    """Latest init segment plus the set of viewers of one stream."""
+
+    def __init__(self):
+        self.init_segment = None
+        # Latest fragment, i.e. the latest GOP, so late joiners get a picture at once
+        self.last_fragment = None
+        self.ready = asyncio.Event()
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._closed = False
+
+    def subscribe(self, loop):
+        subscriber = Subscriber(loop)
+        with self._lock:
+            if self._closed:
+                subscriber.push(None)
+                return subscriber
+            # Late joiners start from the cached init segment and GOP
+            if self.init_segment is not None:
+                subscriber.push(self.init_segment)
+                if self.last_fragment is not None:
+                    subscriber.push(self.last_fragment)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def reset(self):
+        """Forget the init segment while the encoder is suspended."""
+        self.init_segment = None
+        self.last_fragment = None
+        self.ready.clear()
+
+    def publish_init(self, data):
+        # A restarted encoder sends a fresh init segment; MSE accepts it mid-stream
+        self.init_segment = data
+        self.last_fragment = None
+        self.ready.set()
+        self.publish(data)
+
+    def publish(self, data):
+        with self._lock:
+            if data is not self.init_segment:
+                self.last_fragment = data
+            for subscriber in self._subscribers:
+                subscriber.push(data)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for subscriber in self._subscribers:
+                subscriber.push(None)
+            self._subscribers.clear()
+
+
+async def pump_fragments(stdout, hub):
+    """Split ffmpeg's fragmented MP4 into init segment and moof+mdat fragments."""
+    pending = []
+    async for box_type, data in read_boxes(stdout):
+        pending.append(data)
+        if box_type == b'moov':
+            hub.publish_init(b''.join(pending))
+            pending = []
+        elif box_type == b'mdat':
+            hub.publish(b''.join(pending))
+            pending = []
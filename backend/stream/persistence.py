@@ -0,0 +1,51 @@
+"""``Stream`` rows written on behalf of the supervisor's event loop.
+
+The supervisor must never wait for the database, so writes are queued to
+a single background thread, which also keeps each stream's writes in
+order. A failed write is logged and otherwise ignored: the rows only
+matter when recovering after a restart (stream/recovery.py), never for
+serving a running stream.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .models import Stream
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stream-state')
+
+
+def _save(stream_id, fields):
+    Stream.objects.update_or_create(id=stream_id, defaults=fields)
+
+
+def _delete(stream_id):
+    Stream.objects.filter(id=stream_id).delete()
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Could not persist stream state: {str(error)}")
+
+
+def _submit(func, *args):
+    future = _executor.submit(func, *args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def save(stream_id, **fields):
+    """Create or update the row of ``stream_id`` with ``fields``, in the background."""
+    return _submit(_save, stream_id, fields)
+
+
+def delete(stream_id):
+    """Forget ``stream_id``, in the background."""
+    return _submit(_delete, stream_id)
+
+
+def flush():
+    """Wait until the writes queued so far are done."""
+    _submit(lambda: None).result()
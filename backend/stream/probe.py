@@ -0,0 +1,128 @@
+"""Bounded, cached ffprobe runs for RTSP URLs.
+
+Probes run as async subprocesses on the runner loop, at most
+``PROBE_CONCURRENCY`` at a time, so a whole camera inventory can be checked
+in parallel without forking hundreds of ffprobes at once. Results are cached
+per normalized URL; successful ones for ``PROBE_CACHE_TTL`` seconds so a
+stream start right after a test skips the round trip, failures only briefly.
+Concurrent probes of the same URL share one subprocess.
+"""
+import time
+import asyncio
+import logging
+import subprocess
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import encoder, runner
+from .registry import normalize_rtsp_url
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 5
+PROBE_CACHE_TTL = 60
+PROBE_FAILURE_TTL = 10
+PROBE_CACHE_SIZE = 2000
+
+# normalized URL -> (expires_at, result), oldest first
+_cache = OrderedDict()
+# normalized URL -> Future of the probe in flight (runner loop only)
+_in_flight = {}
+_semaphore = None
+
+
+def _result(rtsp_url, reachable, video=None, error='', timed_out=False):
+    return {
+        'rtsp_url': rtsp_url,
+        'reachable': reachable,
+        'video': video,
+        'error': error,
+        'timed_out': timed_out,
+        'probed_at': time.time(),
+    }
+
+
+def cached(rtsp_url):
+    """Cached result for a URL, or None. Safe to call from any thread."""
+    try:
+        key = normalize_rtsp_url(rtsp_url)
+    except ValueError:
+        return None
+    hit = _cache.get(key)
+    if hit is None or hit[0] < time.monotonic():
+        return None
+    return hit[1]
+
+
+def _store(key, result):
+    ttl = PROBE_CACHE_TTL if result['reachable'] else PROBE_FAILURE_TTL
+    _cache.pop(key, None)
+    _cache[key] = (time.monotonic() + ttl, result)
+    while len(_cache) > PROBE_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _run_ffprobe(rtsp_url):
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.PROBE_CONCURRENCY)
+    async with _semaphore:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *encoder.probe_command(rtsp_url),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            return _result(rtsp_url, False, error=f'Failed to run ffprobe: {str(e)}')
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return _result(rtsp_url, False, error='Connection timeout', timed_out=True)
+    if process.returncode != 0:
+        return _result(rtsp_url, False, error=stderr.decode(errors='replace').strip())
+    video = encoder.parse_probe(stdout.decode(errors='replace'))
+    if video is None:
+        return _result(rtsp_url, False, error='No video stream found')
+    return _result(rtsp_url, True, video)
+
+
+async def probe(rtsp_url, refresh=False):
+    """Probe one URL, answering from the cache unless ``refresh``. Runs on the runner loop."""
+    try:
+        key = normalize_rtsp_url(rtsp_url)
+    except ValueError as e:
+        return _result(rtsp_url, False, error=f'Invalid RTSP URL: {str(e)}')
+    if not refresh:
+        hit = cached(rtsp_url)
+        if hit is not None:
+            return hit
+    future = _in_flight.get(key)
+    if future is None:
+        future = _in_flight[key] = asyncio.ensure_future(_run_ffprobe(rtsp_url))
+        future.add_done_callback(lambda f: _in_flight.pop(key, None))
+    try:
+        result = await asyncio.shield(future)
+    except Exception as e:
+        logger.error(f"Probe of {rtsp_url} failed: {str(e)}")
+        return _result(rtsp_url, False, error=str(e))
+    _store(key, result)
+    return result
+
+
+async def probe_many(rtsp_urls, refresh=False):
+    return await asyncio.gather(*(probe(rtsp_url, refresh) for rtsp_url in rtsp_urls))
+
+
+def probe_url(rtsp_url, refresh=False):
+    """Synchronous ``probe`` for views."""
+    return runner.run(probe(rtsp_url, refresh))
+
+
+def probe_urls(rtsp_urls, refresh=False):
+    """Synchronous ``probe_many`` for views; results keep the order of ``rtsp_urls``."""
+    return runner.run(probe_many(rtsp_urls, refresh))
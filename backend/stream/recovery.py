@@ -0,0 +1,198 @@
+"""Bring persisted streams back after the server restarts.
+
+Every stream viewers asked for has a ``Stream`` row (stream/models.py)
+until its last viewer releases it. After a crash or a restart, rows whose
+stream the supervisor no longer runs are recovered:
+
+1. ffmpeg processes that outlived the old server are reaped. A PID is only
+   signalled when the process still runs in that stream's directory, so a
+   reused PID is left alone. These processes are not our children, which
+   leaves no stderr, exit status or fragment pipe to reattach to.
+2. Directories under ``MEDIA_ROOT/streams/`` without a row are deleted.
+3. The streams that were running (not those that had failed) are
+   registered again under their old IDs and launched,
+   ``STREAM_RECOVERY_CONCURRENCY`` at a time, so players holding a stream
+   URL pick up where they left off.
+4. Rows of streams that failed more than ``FAILED_RETENTION`` seconds ago
+   are deleted. Their viewers had the time to see the error, and no
+   supervisor knows them any more to release them.
+
+Streams the supervisor already runs are skipped, so recovery is safe in
+web workers restarted while a standalone supervisor kept its encoders.
+
+Rows carry the node that ran them. With ``STREAM_NODES`` every
+``stream_supervisor`` node recovers its own rows, and the web tier only
+collects orphans; streams of a node that stays down are moved by the
+coordinator (stream/coordinator.py) with ``restart``.
+"""
+import os
+import time
+import signal
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import runner
+from .models import Stream
+from .supervisor import get_supervisor, SupervisorError
+
+logger = logging.getLogger(__name__)
+
+# Stream directories younger than this may belong to a start in flight
+ORPHAN_MIN_AGE = 60
+REAP_POLL_INTERVAL = 0.1
+# Rows in these states were running, or about to, when the server went down.
+# A 'failed' stream stays failed: restarting it on every boot would only fail again.
+RECOVERABLE_STATUSES = ('starting', 'queued', 'connected', 'restarting', 'suspending', 'suspended')
+FAILED_RETENTION = 3600
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _streams_root():
+    return os.path.join(settings.MEDIA_ROOT, 'streams')
+
+
+def _running_in(pid, stream_dir):
+    """Whether ``pid`` is alive with ``stream_dir`` as its working directory, as ffmpeg is started."""
+    try:
+        return os.readlink(f'/proc/{pid}/cwd') == stream_dir
+    except OSError:
+        return False
+
+
+def _gone(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def reap(row):
+    """Stop the ffmpeg a crashed server left running for ``row``. Returns whether there was one."""
+    stream_dir = os.path.abspath(os.path.join(_streams_root(), str(row.id)))
+    if not row.pid or not _running_in(row.pid, stream_dir):
+        return False
+    logger.info(f"Reaping ffmpeg {row.pid} left over from stream {row.id}")
+    try:
+        os.kill(row.pid, signal.SIGTERM)
+        deadline = time.monotonic() + runner.STOP_GRACE
+        while not _gone(row.pid):
+            if time.monotonic() > deadline:
+                os.kill(row.pid, signal.SIGKILL)
+                break
+            time.sleep(REAP_POLL_INTERVAL)
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not reap ffmpeg {row.pid} of stream {row.id}: {str(e)}")
+    return True
+
+
+def collect_orphans(keep):
+    """Delete stream directories not in ``keep`` (stream IDs). Returns how many went."""
+    root = _streams_root()
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    removed = 0
+    for entry in entries:
+        if entry.name in keep or not entry.is_dir(follow_symlinks=False):
+            continue
+        try:
+            if now - entry.stat(follow_symlinks=False).st_mtime < ORPHAN_MIN_AGE:
+                continue
+        except OSError:
+            continue
+        runner.remove_stream_dir(entry.path)
+        removed += 1
+    return removed
+
+
+def restart(row, supervisor=None):
+    """Register ``row`` again under its ID and launch it. Returns whether it is running again."""
+    # Imported here: views import the whole stream stack
+    from .views import StreamView
+    supervisor = supervisor or get_supervisor()
+    stream_id = str(row.id)
+    try:
+        if not supervisor.restore(stream_id, row.rtsp_url, row.profile, row.viewers, row.warm):
+            return False
+    except SupervisorError as e:
+        logger.error(f"Could not restore stream {stream_id}: {str(e)}")
+        return False
+    response = StreamView().launch(supervisor, stream_id, row.rtsp_url, row.profile, row.warm, row.record,
+                                   row.motion_threshold)
+    if response.status_code >= 400:
+        logger.error(f"Could not recover stream {stream_id}: {response.data.get('error')}")
+        return False
+    return True
+
+
+def recover(supervisor=None, node=None):
+    """Reap, clean up and restart the persisted streams the supervisor does not run. Returns a summary.
+
+    A ``stream_supervisor`` passes a client of itself and its ``node``
+    address, and restarts only the rows it wrote.
+    """
+    started_at = time.monotonic()
+    supervisor = supervisor or get_supervisor()
+    if node is None and not settings.STREAM_NODES:
+        node = settings.STREAM_SUPERVISOR_ADDRESS
+    rows = list(Stream.objects.all())
+    running = {stream['stream_id'] for stream in supervisor.list(brief=True)}
+    # Nothing to restart for the web tier of several nodes, which recover their own
+    lost = [row for row in rows if row.node == node and row.status in RECOVERABLE_STATUSES
+            and str(row.id) not in running]
+    failed_before = timezone.now() - timedelta(seconds=FAILED_RETENTION)
+    expired = [row.id for row in rows if row.node == node and row.status == 'failed'
+               and row.updated_at < failed_before and str(row.id) not in running]
+    Stream.objects.filter(id__in=expired).delete()
+    rows = [row for row in rows if row.id not in expired]
+    with ThreadPoolExecutor(max_workers=settings.STREAM_RECOVERY_CONCURRENCY,
+                            thread_name_prefix='stream-recovery') as pool:
+        reaped = sum(pool.map(reap, lost))
+        removed = collect_orphans(running | {str(row.id) for row in rows})
+        restarted = sum(pool.map(lambda row: restart(row, supervisor), lost))
+    summary = {
+        'streams': len(lost),
+        'restarted': restarted,
+        'reaped': reaped,
+        'orphans_removed': removed,
+        'failed_removed': len(expired),
+        'seconds': round(time.monotonic() - started_at, 2),
+    }
+    if lost or removed or expired:
+        logger.info(f"Recovered {restarted} of {len(lost)} streams in {summary['seconds']}s, reaped {reaped} "
+                    f"leftover encoders, removed {removed} orphan directories and {len(expired)} failed streams")
+    return summary
+
+
+def _recover(after, supervisor, node):
+    try:
+        if settings.STREAM_RECOVERY:
+            recover(supervisor, node)
+    except Exception as e:
+        logger.error(f"Stream recovery failed: {str(e)}", exc_info=True)
+    if after is not None:
+        after()
+
+
+def start(after=None, supervisor=None, node=None):
+    """Recover in the background at boot, then call ``after`` (e.g. to warm the pool onto recovered streams)."""
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_recover, args=(after, supervisor, node), name='stream-recovery',
+                                       daemon=True)
+            _thread.start()
@@ -0,0 +1,121 @@
+import uuid
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PROFILE = 'transcode'
+# 'remux' copies the camera's H.264 into HLS when possible instead of re-encoding,
+# 'abr' encodes every settings.HLS_RENDITIONS entry from a single decode,
+# 'llhls' serves Low-Latency HLS through the llhls view, 'mse' pushes
+# fragmented MP4 over ws/streams/<id>/media/ without touching disk
+PROFILES = (DEFAULT_PROFILE, 'remux', 'abr', 'llhls', 'mse')
+
+DEFAULT_PORTS = {'rtsp': 554, 'rtsps': 322}
+
+
+def normalize_rtsp_url(rtsp_url):
+    """Canonical form of an RTSP URL so equivalent spellings share one transcode.
+
+    Lowercases scheme and host, drops the scheme's default port and treats an
+    empty path as '/'. Credentials, path and query are kept as-is because
+    cameras treat them case-sensitively. Raises ValueError for a scheme other
+    than rtsp/rtsps, which ffmpeg could read as an option or a local file,
+    and for a bad port.
+    """
+    parts = urlsplit(rtsp_url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError(f"Unsupported scheme '{parts.scheme}', expected rtsp or rtsps")
+    host = parts.hostname or ''
+    netloc = f'[{host}]' if ':' in host else host
+    port = parts.port
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo = f'{userinfo}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class StreamEntry:
+    def __init__(self, stream_id, key, rtsp_url, profile):
+        self.stream_id = stream_id
+        self.key = key
+        self.rtsp_url = rtsp_url
+        self.profile = profile
+        self.viewers = 0
+        # Held open by the warm pool: never released to 0 or suspended
+        self.warm = False
+
+
+class StreamRegistry:
+    """Reference-counted map of (normalized RTSP URL, profile) to a running stream."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_id = {}
+
+    def acquire(self, rtsp_url, profile=DEFAULT_PROFILE):
+        """Register a viewer. Returns ``(entry, created)``; the caller launches ffmpeg when created."""
+        key = (normalize_rtsp_url(rtsp_url), profile)
+        with self._lock:
+            entry = self._by_key.get(key)
+            created = entry is None
+            if created:
+                entry = StreamEntry(str(uuid.uuid4()), key, rtsp_url, profile)
+                self._by_key[key] = entry
+                self._by_id[entry.stream_id] = entry
+            entry.viewers += 1
+            return entry, created
+
+    def restore(self, stream_id, rtsp_url, profile, viewers, warm=False):
+        """Register a stream persisted before a restart under its old ID.
+
+        Returns the entry, or None when ``stream_id`` or its camera and
+        profile are registered already.
+        """
+        key = (normalize_rtsp_url(rtsp_url), profile)
+        with self._lock:
+            if stream_id in self._by_id or key in self._by_key:
+                return None
+            entry = StreamEntry(stream_id, key, rtsp_url, profile)
+            entry.viewers = max(viewers, 1)
+            entry.warm = warm
+            self._by_key[key] = entry
+            self._by_id[stream_id] = entry
+            return entry
+
+    def release(self, stream_id):
+        """Drop one viewer. Returns the remaining count, or None if the stream is unknown.
+
+        The entry is forgotten when the count reaches zero and the caller must
+        then stop ffmpeg.
+        """
+        with self._lock:
+            entry = self._by_id.get(stream_id)
+            if entry is None:
+                return None
+            entry.viewers -= 1
+            if entry.viewers <= 0:
+                self._forget(entry)
+            return max(entry.viewers, 0)
+
+    def discard(self, stream_id):
+        """Forget a stream regardless of viewers, e.g. after it failed to start."""
+        with self._lock:
+            entry = self._by_id.get(stream_id)
+            if entry is not None:
+                self._forget(entry)
+            return entry
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._by_id.get(stream_id)
+
+    def _forget(self, entry):
+        self._by_id.pop(entry.stream_id, None)
+        if self._by_key.get(entry.key) is entry:
+            del self._by_key[entry.key]
+
@@ -0,0 +1,109 @@
+import os
+import shutil
+import asyncio
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+STOP_GRACE = 5
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Return the process-wide asyncio loop that owns ffmpeg children, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='stream-runner', daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the runner loop and wait for its result from synchronous code."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def remove_stream_dir(stream_dir):
+    try:
+        shutil.rmtree(stream_dir)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Error cleaning up stream directory {stream_dir}: {str(e)}")
+
+
+def clear_stream_dir(stream_dir):
+    """Delete a stream's files but keep the directory the views look for."""
+    try:
+        names = os.listdir(stream_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(stream_dir, name)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Error cleaning up {path}: {str(e)}")
+
+
+async def spawn(cmd, cwd, stdout=subprocess.DEVNULL, pass_fds=()):
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        pass_fds=pass_fds,
+    )
+
+
+async def drain_stderr(process, tail, on_line=None, log=None):
+    """Consume ffmpeg's stderr until EOF, keeping the last lines in ``tail`` (a bounded deque).
+
+    ffmpeg blocks once an unread stderr pipe fills up, so this must run for
+    the whole life of the process. Lines for which ``on_line`` returns True
+    are left out of ``tail``; the others are also passed to ``log``.
+    """
+    pending = b''
+    while True:
+        chunk = await process.stderr.read(4096)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).replace(b'\r', b'\n').split(b'\n')
+        for line in lines:
+            if line.strip():
+                _keep(line.decode(errors='replace'), tail, on_line, log)
+        pending = pending[-4096:]
+    if pending.strip():
+        _keep(pending.decode(errors='replace'), tail, on_line, log)
+
+
+def _keep(line, tail, on_line, log):
+    if on_line is not None and on_line(line):
+        return
+    tail.append(line)
+    if log is not None:
+        log(line)
+
+
+async def terminate(process, grace=STOP_GRACE):
+    """Stop a child, escalating to SIGKILL after ``grace`` seconds, and reap it."""
+    if process.returncode is None:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            process.kill()
+    await process.wait()
@@ -0,0 +1,246 @@
+"""CPU admission control for encoders.
+
+Each encoder is charged a CPU cost in cores: a per-profile estimate until its
+own usage has been measured from ``/proc/<pid>/stat``. A start is admitted
+while the charged total stays within ``ENCODER_CPU_BUDGET``; otherwise it
+waits in a FIFO queue of at most ``ENCODER_QUEUE_LIMIT`` streams and is
+refused beyond that. Admitted encoders get a ``-threads`` count sized to the
+headroom left and, where the OS allows it, are pinned to that many of the
+least loaded cores so they stop competing with every other encoder.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Starting guesses in cores, replaced by measurements as encoders run
+COST_ESTIMATES = {
+    'copy': 0.1,
+    'transcode': 1.0,
+    'remux': 1.0,
+    'abr': 2.0,
+    'llhls': 1.0,
+    'mse': 1.0,
+}
+MAX_THREADS = 4
+SAMPLE_INTERVAL = 5
+# Weight of the newest sample in the moving averages
+SMOOTHING = 0.3
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class SchedulerSaturated(Exception):
+    pass
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a process, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of stat(5); 3 is the first after ')'
+    return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+
+
+def _available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _pin(pid, cores):
+    """Restrict every thread of a process to ``cores``. Threads ffmpeg starts later inherit it."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        tids = [int(tid) for tid in os.listdir(f'/proc/{pid}/task')]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except OSError:
+            pass
+
+
+def with_threads(cmd, threads):
+    """Copy of an ffmpeg command with every ``-threads`` value replaced."""
+    cmd = list(cmd)
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == '-threads':
+            cmd[i + 1] = str(threads)
+    return cmd
+
+
+def cost_key(profile, cmd):
+    return 'copy' if 'copy' in cmd and profile == 'remux' else profile
+
+
+class Allocation:
+    def __init__(self, key, estimate):
+        self.key = key
+        self.estimate = estimate
+        self.measured = None
+        self.threads = MAX_THREADS
+        self.cores = []
+        self.pid = None
+        self.started = time.monotonic()
+        self._last = None
+
+    @property
+    def cost(self):
+        return self.measured if self.measured is not None else self.estimate
+
+    def as_dict(self):
+        return {
+            'cpu': round(self.measured, 2) if self.measured is not None else None,
+            'cpu_estimate': round(self.estimate, 2),
+            'threads': self.threads,
+            'cores': self.cores,
+        }
+
+
+class Scheduler:
+    """Admission queue and core placement. Runs on the supervisor's loop."""
+
+    def __init__(self, budget=None, queue_limit=None, pin=None):
+        self.budget = budget if budget is not None else settings.ENCODER_CPU_BUDGET
+        self.queue_limit = queue_limit if queue_limit is not None else settings.ENCODER_QUEUE_LIMIT
+        self.pin = pin if pin is not None else settings.ENCODER_PIN_CORES
+        self.cores = _available_cores()
+        self.estimates = dict(COST_ESTIMATES)
+        self._running = {}
+        # [(stream_id, allocation, future)], oldest first
+        self._queue = []
+        self._sampler = None
+
+    @property
+    def used(self):
+        return sum(allocation.cost for allocation in self._running.values())
+
+    def _fits(self, allocation):
+        # An idle node always admits one encoder, however expensive
+        return not self._running or self.used + allocation.cost <= self.budget
+
+    def request(self, stream_id, profile, cmd):
+        """Ask to run an encoder.
+
+        Returns an Allocation when it may start now, or a Future that resolves
+        to one once queued streams ahead of it are through. Raises
+        SchedulerSaturated when the queue is full too.
+        """
+        key = cost_key(profile, cmd)
+        allocation = Allocation(key, self.estimates.get(key, 1.0))
+        if not self._queue and self._fits(allocation):
+            self._place(stream_id, allocation)
+            return allocation
+        if len(self._queue) >= self.queue_limit:
+            raise SchedulerSaturated(
+                f'Encoder capacity exhausted: {self.used:.1f} of {self.budget:.1f} cores in use '
+                f'and {len(self._queue)} streams already queued')
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((stream_id, allocation, future))
+        logger.info(f"Queued stream {stream_id} for encoder capacity ({len(self._queue)} waiting)")
+        return future
+
+    def _place(self, stream_id, allocation):
+        headroom = self.budget - self.used
+        allocation.threads = max(1, min(MAX_THREADS, math.floor(headroom)))
+        if self.pin and len(self.cores) > 1:
+            load = {core: 0.0 for core in self.cores}
+            for other in self._running.values():
+                for core in other.cores:
+                    load[core] += other.cost / len(other.cores)
+            count = min(allocation.threads, len(self.cores))
+            allocation.cores = sorted(sorted(self.cores, key=lambda core: load[core])[:count])
+        self._running[stream_id] = allocation
+        if self._sampler is None:
+            self._sampler = asyncio.ensure_future(self._sample_forever())
+
+    def started(self, stream_id, pid):
+        """Record a (re)spawned encoder and pin it."""
+        allocation = self._running.get(stream_id)
+        if allocation is None:
+            return
+        allocation.pid = pid
+        allocation._last = None
+        if allocation.cores:
+            _pin(pid, allocation.cores)
+
+    def release(self, stream_id):
+        """Give back a stream's cores, or take it out of the queue."""
+        for item in self._queue:
+            if item[0] == stream_id:
+                self._queue.remove(item)
+                item[2].cancel()
+                break
+        if self._running.pop(stream_id, None) is not None:
+            self._wake()
+
+    def allocation(self, stream_id):
+        return self._running.get(stream_id)
+
+    def _wake(self):
+        while self._queue:
+            stream_id, allocation, future = self._queue[0]
+            if future.done():
+                self._queue.pop(0)
+                continue
+            if not self._fits(allocation):
+                break
+            self._queue.pop(0)
+            self._place(stream_id, allocation)
+            future.set_result(allocation)
+
+    def as_dict(self):
+        return {
+            'budget': self.budget,
+            'used': round(self.used, 2),
+            'running': len(self._running),
+            'queued': len(self._queue),
+            'estimates': {key: round(cost, 2) for key, cost in self.estimates.items()},
+        }
+
+    def close(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+
+    async def _sample_forever(self):
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.sample()
+
+    def sample(self):
+        """Update measured costs from /proc and let queued streams in if they now fit."""
+        now = time.monotonic()
+        for allocation in self._running.values():
+            if allocation.pid is None:
+                continue
+            cpu = cpu_seconds(allocation.pid)
+            if cpu is None:
+                continue
+            if allocation._last is not None:
+                elapsed = now - allocation._last[0]
+                cores = max(0.0, (cpu - allocation._last[1]) / elapsed) if elapsed > 0 else 0.0
+                if allocation.measured is None:
+                    allocation.measured = cores
+                else:
+                    allocation.measured += SMOOTHING * (cores - allocation.measured)
+                # Past the startup burst, teach the estimate for the next start
+                if now - allocation.started > 30:
+                    estimate = self.estimates.get(allocation.key, allocation.estimate)
+                    self.estimates[allocation.key] = estimate + SMOOTHING * (allocation.measured - estimate)
+            allocation._last = (now, cpu)
+            if allocation.cores:
+                # Threads started since the last pass
+                _pin(allocation.pid, allocation.cores)
+        self._wake()
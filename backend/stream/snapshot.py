@@ -0,0 +1,250 @@
+"""Camera snapshots and mosaic grids for camera-wall overviews.
+
+A snapshot is one keyframe as a JPEG. It is taken from the cheapest source
+available: the keyframe JPEG a warm stream keeps up to date, the newest
+segment of a running stream's directory, or a short RTSP session of its
+own. In every case only keyframes are decoded. Snapshots are cached per
+normalized URL for ``SNAPSHOT_TTL`` seconds (failures only briefly), grabs
+run at most ``SNAPSHOT_CONCURRENCY`` at a time on the runner loop and
+concurrent requests for one camera share a grab, as probes do.
+
+``mosaic`` composites up to ``SNAPSHOT_MOSAIC_LIMIT`` snapshots into a
+single JPEG, so an overview of many cameras is one image request.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import subprocess
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import encoder, runner
+from .registry import normalize_rtsp_url
+from .supervisor import get_supervisor, SupervisorError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_TIMEOUT = 8
+SNAPSHOT_FAILURE_TTL = 5
+SNAPSHOT_CACHE_SIZE = 1000
+SNAPSHOT_WIDTH = 640
+MOSAIC_TIMEOUT = 30
+
+# normalized URL -> (expires_at, result), oldest first
+_cache = OrderedDict()
+# normalized URL -> Future of the grab in flight (runner loop only)
+_in_flight = {}
+# (tile_width, tile_height) -> placeholder JPEG
+_blank_tiles = {}
+_semaphore = None
+
+
+def _result(rtsp_url, image=None, source='', error=''):
+    return {
+        'rtsp_url': rtsp_url,
+        'image': image,
+        'source': source,
+        'error': error,
+        'taken_at': time.time(),
+    }
+
+
+def _store(key, result):
+    ttl = settings.SNAPSHOT_TTL if result['image'] else SNAPSHOT_FAILURE_TTL
+    _cache.pop(key, None)
+    _cache[key] = (time.monotonic() + ttl, result)
+    while len(_cache) > SNAPSHOT_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _run(cmd, stdin_data=None, timeout=SNAPSHOT_TIMEOUT):
+    """Run an ffmpeg that writes its result to stdout. Returns ``(stdout, error)``."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        return None, f'Failed to run ffmpeg: {str(e)}'
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(stdin_data), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None, 'Connection timeout'
+    if process.returncode != 0 or not stdout:
+        return None, stderr.decode(errors='replace').strip() or 'No frame decoded'
+    return stdout, ''
+
+
+def _running_sources(streams):
+    """Local files of running streams to snapshot from, best first, as ``(source, path)``."""
+    now = time.time()
+    sources = []
+    for stream in streams:
+        if stream['status'] not in ('connected', 'restarting'):
+            continue
+        stream_dir = os.path.join(settings.MEDIA_ROOT, 'streams', stream['stream_id'])
+        keyframe = os.path.join(stream_dir, encoder.KEYFRAME_IMAGE)
+        try:
+            if now - os.path.getmtime(keyframe) < settings.SNAPSHOT_TTL:
+                sources.insert(0, ('keyframe', keyframe))
+        except OSError:
+            pass
+        if stream['output'] != 'files':
+            continue
+        segment = _newest_segment(stream_dir)
+        if segment is not None:
+            sources.append(('segment', segment))
+    return sources
+
+
+def _newest_segment(stream_dir):
+    # Segments open on a keyframe, so the newest one has a recent frame at its start
+    try:
+        segments = [entry for entry in os.scandir(stream_dir) if entry.name.endswith('.ts')]
+    except OSError:
+        return None
+    if not segments:
+        return None
+    return max(segments, key=lambda entry: entry.stat().st_mtime).path
+
+
+def _limit():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.SNAPSHOT_CONCURRENCY)
+    return _semaphore
+
+
+async def stream_keyframe(stream_dir):
+    """Latest keyframe of a running stream as a JPEG, or None. Runs on the runner loop.
+
+    A warm stream that transcodes keeps ``KEYFRAME_IMAGE`` current itself.
+    One that copies the camera's video never decodes it, so the image is
+    taken from its newest segment here instead, at most once per
+    ``SNAPSHOT_TTL``, and kept in the same file.
+    """
+    path = os.path.join(stream_dir, encoder.KEYFRAME_IMAGE)
+    try:
+        fresh = time.time() - os.path.getmtime(path) < settings.SNAPSHOT_TTL
+    except OSError:
+        fresh = False
+    segment = None if fresh else _newest_segment(stream_dir)
+    if segment is not None:
+        async with _limit():
+            image, error = await _run(encoder.snapshot_command(segment, SNAPSHOT_WIDTH))
+        if image:
+            try:
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(image)
+                os.replace(f'{path}.tmp', path)
+            except OSError as e:
+                logger.warning(f"Could not keep the keyframe of {stream_dir}: {str(e)}")
+            return image
+        logger.info(f"Could not take a keyframe from {segment}: {error}")
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def _grab(rtsp_url):
+    loop = asyncio.get_running_loop()
+    try:
+        # Off the loop: creating the local supervisor on first use waits on it
+        streams = await loop.run_in_executor(None, lambda: get_supervisor().find(rtsp_url))
+    except SupervisorError as e:
+        logger.warning(f"Could not look up running streams for a snapshot: {str(e)}")
+        streams = []
+    for source, path in _running_sources(streams):
+        if source == 'keyframe':
+            try:
+                with open(path, 'rb') as f:
+                    return _result(rtsp_url, f.read(), source)
+            except OSError:
+                continue
+        async with _limit():
+            image, error = await _run(encoder.snapshot_command(path, SNAPSHOT_WIDTH))
+        if image:
+            return _result(rtsp_url, image, source)
+        logger.info(f"Could not snapshot {path}, connecting to the camera: {error}")
+    async with _limit():
+        image, error = await _run(encoder.snapshot_command(rtsp_url, SNAPSHOT_WIDTH))
+    if image is None:
+        return _result(rtsp_url, error=error)
+    return _result(rtsp_url, image, 'camera')
+
+
+async def snapshot(rtsp_url, refresh=False):
+    """Snapshot one camera, answering from the cache unless ``refresh``. Runs on the runner loop."""
+    try:
+        key = normalize_rtsp_url(rtsp_url)
+    except ValueError as e:
+        return _result(rtsp_url, error=f'Invalid RTSP URL: {str(e)}')
+    if not refresh:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] >= time.monotonic():
+            return hit[1]
+    future = _in_flight.get(key)
+    if future is None:
+        future = _in_flight[key] = asyncio.ensure_future(_grab(rtsp_url))
+        future.add_done_callback(lambda f: _in_flight.pop(key, None))
+    try:
+        result = await asyncio.shield(future)
+    except Exception as e:
+        logger.error(f"Snapshot of {rtsp_url} failed: {str(e)}")
+        return _result(rtsp_url, error=str(e))
+    _store(key, result)
+    return result
+
+
+async def _blank_tile(tile_width, tile_height):
+    size = (tile_width, tile_height)
+    if size not in _blank_tiles:
+        image, error = await _run(encoder.blank_tile_command(tile_width, tile_height))
+        if image is None:
+            logger.error(f"Could not render a blank {tile_width}x{tile_height} tile: {error}")
+            return None
+        _blank_tiles[size] = image
+    return _blank_tiles[size]
+
+
+async def mosaic(rtsp_urls, columns=None, tile_width=320, refresh=False):
+    """Tile snapshots of ``rtsp_urls`` into one JPEG. Returns ``(image, results)``.
+
+    ``columns`` defaults to the smallest square grid; cameras without a
+    snapshot get a blank tile so the others keep their positions.
+    ``image`` is None when compositing fails.
+    """
+    columns = columns or math.ceil(math.sqrt(len(rtsp_urls)))
+    rows = math.ceil(len(rtsp_urls) / columns)
+    # 16:9 cells with even dimensions, as the encoder needs
+    tile_height = tile_width * 9 // 16 // 2 * 2
+    results = await asyncio.gather(*(snapshot(rtsp_url, refresh) for rtsp_url in rtsp_urls))
+    blank = await _blank_tile(tile_width, tile_height)
+    if blank is None:
+        return None, results
+    images = [result['image'] or blank for result in results]
+    images += [blank] * (columns * rows - len(images))
+    image, error = await _run(encoder.mosaic_command(columns, rows, tile_width, tile_height),
+                              stdin_data=b''.join(images), timeout=MOSAIC_TIMEOUT)
+    if image is None:
+        logger.error(f"Mosaic of {len(rtsp_urls)} cameras failed: {error}")
+    return image, results
+
+
+def snapshot_url(rtsp_url, refresh=False):
+    """Synchronous ``snapshot`` for views."""
+    return runner.run(snapshot(rtsp_url, refresh))
+
+
+def mosaic_urls(rtsp_urls, columns=None, tile_width=320, refresh=False):
+    """Synchronous ``mosaic`` for views."""
+    return runner.run(mosaic(rtsp_urls, columns, tile_width, refresh))
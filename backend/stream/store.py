@@ -0,0 +1,115 @@
+"""In-memory HLS segment store.
+
+When ``SEGMENT_STORE_ENABLED`` is set, ffmpeg PUTs its playlists and
+segments to the store view over a persistent HTTP connection instead of
+writing them under ``MEDIA_ROOT``. Each stream keeps only its last
+``SEGMENT_STORE_MAX_SEGMENTS`` segments, and the oldest segments of any
+stream are evicted once the store holds ``SEGMENT_STORE_MAX_BYTES``.
+
+The store lives in the process that receives the PUTs, so it is meant for a
+single ASGI process serving both ingest and playback.
+"""
+import zlib
+import time
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+}
+
+
+def content_type_for(name):
+    for suffix, content_type in CONTENT_TYPES.items():
+        if name.endswith(suffix):
+            return content_type
+    return 'application/octet-stream'
+
+
+class StoredObject:
+    __slots__ = ('data', 'etag', 'content_type', 'modified')
+
+    def __init__(self, name, data):
+        self.data = data
+        self.etag = f'"{zlib.crc32(data):08x}-{len(data)}"'
+        self.content_type = content_type_for(name)
+        self.modified = time.time()
+
+
+class SegmentStore:
+    def __init__(self, max_segments, max_bytes):
+        self.max_segments = max_segments
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        # (stream_id, name) -> StoredObject, oldest first across all streams
+        self._segments = OrderedDict()
+        self._rings = {}
+        # Playlists are rewritten in place and never count against the ring
+        self._playlists = {}
+        # stream_id -> the encoder run that PUT its last index.m3u8
+        self._runs = {}
+
+    def put(self, stream_id, name, data, run=None):
+        """Store an object PUT by the encoder run ``run``.
+
+        Returns True for the first ``index.m3u8`` of each run, i.e. once a
+        started, resumed or restarted encoder is producing output.
+        """
+        stored = StoredObject(name, data)
+        with self._lock:
+            if name.endswith('.m3u8'):
+                self._playlists[(stream_id, name)] = stored
+                if name != 'index.m3u8' or (stream_id in self._runs and self._runs[stream_id] == run):
+                    return False
+                self._runs[stream_id] = run
+                return True
+            self._remove((stream_id, name))
+            self._segments[(stream_id, name)] = stored
+            self.size += len(data)
+            ring = self._rings.setdefault(stream_id, deque())
+            ring.append(name)
+            while len(ring) > self.max_segments:
+                self._remove((stream_id, ring[0]))
+            while self.size > self.max_bytes and self._segments:
+                self._remove(next(iter(self._segments)))
+            return False
+
+    def get(self, stream_id, name):
+        key = (stream_id, name)
+        with self._lock:
+            return self._playlists.get(key) or self._segments.get(key)
+
+    def delete(self, stream_id, name):
+        with self._lock:
+            self._playlists.pop((stream_id, name), None)
+            self._remove((stream_id, name))
+
+    def drop(self, stream_id):
+        with self._lock:
+            for name in list(self._rings.get(stream_id, ())):
+                self._remove((stream_id, name))
+            self._rings.pop(stream_id, None)
+            self._runs.pop(stream_id, None)
+            for key in [key for key in self._playlists if key[0] == stream_id]:
+                del self._playlists[key]
+
+    def _remove(self, key):
+        stored = self._segments.pop(key, None)
+        if stored is None:
+            return
+        self.size -= len(stored.data)
+        ring = self._rings.get(key[0])
+        if ring is not None:
+            try:
+                ring.remove(key[1])
+            except ValueError:
+                pass
+
+
+segment_store = SegmentStore(settings.SEGMENT_STORE_MAX_SEGMENTS, settings.SEGMENT_STORE_MAX_BYTES)
@@ -0,0 +1,920 @@
+"""Owner of every ffmpeg child process.
+
+The supervisor keeps the stream registry and the running encoders together so
+that starts, stops and status lookups agree no matter which web worker serves
+the request. It restarts encoders that crash after having produced output,
+with exponential backoff, and always reaps the children it terminates.
+
+By default it runs inside the web process on the runner loop. Setting
+``STREAM_SUPERVISOR_ADDRESS`` (``host:port``) makes the web tier talk to a
+standalone ``manage.py stream_supervisor`` instead, using newline-delimited
+JSON over a local TCP socket, so web workers can be scaled or reloaded
+without touching running encoders. With ``STREAM_NODE_TOKEN`` set, every
+request must carry that token; clients only ever send stream parameters,
+never commands to run.
+"""
+import os
+import abc
+import uuid
+import hmac
+import json
+import time
+import atexit
+import socket
+import struct
+import functools
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from django.conf import settings
+
+from . import archive, encoder, events, logs, motion, persistence, runner
+from .metrics import StreamMetrics
+from .mse import FragmentHub, pump_fragments
+from .registry import StreamRegistry, normalize_rtsp_url
+from .scheduler import Allocation, Scheduler, SchedulerSaturated, with_threads
+from .watcher import wait_until_ready
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 45
+STDERR_TAIL_LINES = 20
+RESTART_BACKOFF_MIN = 1
+RESTART_BACKOFF_MAX = 30
+# A run that stayed up this long resets the backoff
+STABLE_AFTER = 60
+CLIENT_TIMEOUT = 10
+# How long a start may wait for encoder capacity before it fails
+QUEUE_TIMEOUT = 120
+IDLE_CHECK_INTERVAL = 5
+RETENTION_CHECK_INTERVAL = 600
+OUTPUTS = ('files', 'pipe', 'push')
+
+
+class SupervisorError(Exception):
+    pass
+
+
+class SupervisorUnavailable(SupervisorError):
+    pass
+
+
+class SupervisorSaturated(SupervisorError):
+    """No encoder capacity left, not even a place in the queue."""
+
+
+class SupervisedStream:
+    def __init__(self, entry, cmd, stream_dir, playlist, output='files'):
+        self.entry = entry
+        self.cmd = cmd
+        self.stream_dir = stream_dir
+        self.playlist = playlist
+        self.output = output
+        self.video_mode = None
+        # Set when ffmpeg writes fragmented MP4 to stdout instead of HLS files
+        self.hub = FragmentHub() if output == 'pipe' else None
+        # Set by the segment store once the current run has PUT its first playlist.
+        # Each run PUTs under push_url/<push_run>/ so the store can tell runs apart.
+        self.pushed = asyncio.Event()
+        self.push_url = None
+        self.push_run = None
+        self.process = None
+        self.state = 'starting'
+        self.error = ''
+        self.restarts = 0
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self.metrics = StreamMetrics()
+        self.allocation = None
+        self.last_active = None
+        self.stop_requested = asyncio.Event()
+        self.task = None
+        # Archiving segments while set, see stream/archive.py
+        self.recording = None
+        # MotionDetector when the stream is analysed, see stream/motion.py
+        self.motion = None
+        self.analysis = None
+
+    @property
+    def stream_id(self):
+        return self.entry.stream_id
+
+    def as_dict(self, history=False):
+        return {
+            'stream_id': self.stream_id,
+            'profile': self.entry.profile,
+            'status': self.state,
+            'error': self.error,
+            'pid': self.process.pid if self.process else None,
+            'viewers': self.entry.viewers,
+            'restarts': self.restarts,
+            'video_mode': self.video_mode,
+            'metrics': self.metrics.as_dict(history),
+            'encoder': self.allocation.as_dict() if self.allocation is not None else None,
+            'recording': self.recording is not None,
+            'motion': self.motion.as_dict() if self.motion is not None else None,
+        }
+
+    def summary(self):
+        """``as_dict`` without metrics and encoder details, for listings of many streams."""
+        return {
+            'stream_id': self.stream_id,
+            'profile': self.entry.profile,
+            'status': self.state,
+            'error': self.error,
+            'pid': self.process.pid if self.process else None,
+            'viewers': self.entry.viewers,
+            'restarts': self.restarts,
+            'recording': self.recording is not None,
+            'motion_active': self.motion.active if self.motion is not None else None,
+        }
+
+
+class Supervisor:
+    """Registry plus encoder lifecycle. All methods must run on one event loop."""
+
+    def __init__(self, node=''):
+        # Recorded with persisted streams, so each node recovers only its own
+        self.node = node
+        self.registry = StreamRegistry()
+        self.scheduler = Scheduler()
+        self._streams = {}
+        self._idle_task = None
+        self._retention_task = None
+
+    async def acquire(self, rtsp_url, profile, warm=False):
+        """Register a viewer. ``warm`` pins the stream for the warm pool, once."""
+        entry, created = self.registry.acquire(rtsp_url, profile)
+        stream = self._streams.get(entry.stream_id)
+        if not created and stream is not None and stream.state == 'failed':
+            # Don't hand out a dead transcode, start a fresh one instead
+            self.registry.discard(entry.stream_id)
+            self._streams.pop(entry.stream_id, None)
+            persistence.delete(entry.stream_id)
+            entry, created = self.registry.acquire(rtsp_url, profile)
+            stream = None
+        if warm:
+            if entry.warm:
+                # Already pinned (e.g. by another web worker), don't count the pool twice
+                self.registry.release(entry.stream_id)
+            entry.warm = True
+        if stream is not None:
+            await self.touch([stream.stream_id])
+            self._save(stream)
+        else:
+            persistence.save(entry.stream_id, rtsp_url=entry.rtsp_url, profile=profile, warm=entry.warm,
+                             viewers=entry.viewers, node=self.node)
+        return {
+            'stream_id': entry.stream_id,
+            'created': created,
+            'status': stream.state if stream is not None else 'starting',
+            'viewers': entry.viewers,
+            'warm': entry.warm,
+        }
+
+    async def launch(self, stream_id, video=None, output='files', record=False, motion_threshold=None):
+        """Start ffmpeg for a registered stream.
+
+        The command is built here from the stream's URL and profile, so
+        clients never send one. ``video`` is the camera's probe result
+        (``encoder.parse_probe``), which tells 'remux' whether it can copy.
+        ``output`` is 'files' (HLS written to the stream directory), 'pipe'
+        (fragmented MP4 on stdout) or 'push' (HLS PUT to the segment store).
+        ``record`` archives its segments, which needs 'files'. With
+        ``motion_threshold`` ffmpeg also feeds the motion detector.
+        """
+        if output not in OUTPUTS:
+            raise SupervisorError(f'Unknown output: {output}')
+        if record and output != 'files':
+            raise SupervisorError('Only streams written to files can be recorded')
+        if video is not None and not isinstance(video, dict):
+            raise SupervisorError('video must be a probe result')
+        entry = self.registry.get(stream_id)
+        if entry is None:
+            raise SupervisorError(f'Stream {stream_id} is not registered')
+        if entry.profile == 'llhls':
+            playlist, segment_pattern = encoder.LLHLS_PLAYLIST, encoder.LLHLS_PART_PATTERN
+        else:
+            playlist, segment_pattern = 'index.m3u8', '%03d.ts'
+        push_url = f'{settings.SEGMENT_STORE_URL}{stream_id}/' if output == 'push' else None
+        cmd, video_mode = encoder.build_hls_command(
+            entry.rtsp_url, entry.profile, video, playlist, segment_pattern, push_url,
+            keyframe_image=encoder.KEYFRAME_IMAGE if entry.warm else None,
+        )
+        stream_dir = os.path.abspath(self._stream_dir(stream_id))
+        # Left over from an earlier run under this ID, e.g. before a restart
+        runner.clear_stream_dir(stream_dir)
+        os.makedirs(stream_dir, exist_ok=True)
+        logger.debug(f"FFmpeg command for stream {stream_id}: {' '.join(cmd)}")
+        stream = SupervisedStream(entry, cmd, stream_dir, playlist, output)
+        stream.video_mode = video_mode
+        stream.push_url = push_url
+        if motion_threshold is not None:
+            stream.motion = motion.MotionDetector(motion_threshold)
+        stream.last_active = asyncio.get_running_loop().time()
+        await self._admit(stream)
+        self._streams[stream_id] = stream
+        if self._idle_task is None:
+            self._idle_task = asyncio.ensure_future(self._suspend_idle())
+        if record:
+            self._record(stream)
+        self._save(stream)
+        return stream.as_dict()
+
+    async def restore(self, stream_id, rtsp_url, profile, viewers, warm=False):
+        """Register a stream persisted before a restart under its old ID, for the caller to launch.
+
+        Returns False when there is nothing to restore: another recovery
+        got to it first, or its camera was started afresh under a new ID,
+        whose row then replaces this one.
+        """
+        if self.registry.restore(stream_id, rtsp_url, profile, viewers, warm) is not None:
+            return True
+        if self.registry.get(stream_id) is None:
+            persistence.delete(stream_id)
+        return False
+
+    async def record(self, stream_id):
+        """Start archiving an already running stream, e.g. when a recording viewer joins it."""
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise SupervisorError(f'Stream {stream_id} is not running')
+        if stream.output != 'files':
+            raise SupervisorError('Only streams written to files can be recorded')
+        self._record(stream)
+        self._save(stream)
+        return stream.as_dict()
+
+    def _record(self, stream):
+        if stream.recording is not None:
+            return
+        recorder = archive.Recorder(archive.camera_id(stream.entry.rtsp_url), stream.stream_dir, stream.playlist)
+        stream.recording = asyncio.ensure_future(recorder.run())
+        logger.info(f"Recording stream {stream.stream_id} as camera {recorder.camera}")
+        if self._retention_task is None:
+            self._retention_task = asyncio.ensure_future(self._enforce_retention())
+
+    async def set_motion_threshold(self, stream_id, threshold):
+        """Change the activity threshold of a stream launched with motion detection."""
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise SupervisorError(f'Stream {stream_id} is not running')
+        if stream.motion is None:
+            raise SupervisorError('Motion detection is off for this stream, start it with a motion threshold')
+        stream.motion.threshold = threshold
+        self._save(stream)
+        return stream.motion.as_dict()
+
+    def _save(self, stream):
+        """Persist a stream's definition and state, see stream/persistence.py."""
+        process = stream.process
+        persistence.save(
+            stream.stream_id,
+            rtsp_url=stream.entry.rtsp_url,
+            profile=stream.entry.profile,
+            output=stream.output,
+            warm=stream.entry.warm,
+            record=stream.recording is not None,
+            motion_threshold=stream.motion.threshold if stream.motion is not None else None,
+            viewers=stream.entry.viewers,
+            status=stream.state,
+            error=stream.error,
+            pid=process.pid if process is not None and process.returncode is None else None,
+            node=self.node,
+        )
+
+    async def _publish_motion(self, stream, detector):
+        await events.publish(stream.stream_id, stream.state, stream.error, motion=detector.as_dict())
+
+    def _stop_recording(self, stream):
+        if stream.recording is not None:
+            stream.recording.cancel()
+            stream.recording = None
+
+    async def _enforce_retention(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, archive.get_archive().evict)
+            except Exception as e:
+                logger.error(f"Recording retention failed: {str(e)}")
+            await asyncio.sleep(RETENTION_CHECK_INTERVAL)
+
+    async def _admit(self, stream):
+        """Start a stream's encoder now, or queue it until there is CPU for it."""
+        try:
+            admission = self.scheduler.request(stream.stream_id, stream.entry.profile, stream.cmd)
+        except SchedulerSaturated as e:
+            raise SupervisorSaturated(str(e))
+        if isinstance(admission, Allocation):
+            try:
+                await self._start(stream, admission)
+            except OSError:
+                self.scheduler.release(stream.stream_id)
+                raise
+            stream.task = asyncio.ensure_future(self._supervise(stream))
+        else:
+            stream.state = 'queued'
+            stream.task = asyncio.ensure_future(self._run_queued(stream, admission))
+            self._save(stream)
+            await events.publish(stream.stream_id, 'queued')
+
+    async def _start(self, stream, allocation):
+        stream.allocation = allocation
+        stream.cmd = with_threads(stream.cmd, allocation.threads)
+        stream.process = await self._spawn(stream)
+        self._save(stream)
+        logger.info(f"Launched ffmpeg for stream {stream.stream_id} with PID {stream.process.pid} "
+                    f"({allocation.threads} threads, cores {allocation.cores or 'any'})")
+
+    async def _run_queued(self, stream, admission):
+        logs.bind(stream_id=stream.stream_id)
+        stopped = asyncio.ensure_future(stream.stop_requested.wait())
+        await asyncio.wait({admission, stopped}, timeout=QUEUE_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if stream.stop_requested.is_set():
+            return
+        if not admission.done():
+            await self._fail(stream, 'Timed out waiting for encoder capacity')
+            return
+        stream.state = 'starting'
+        try:
+            await self._start(stream, admission.result())
+        except OSError as e:
+            await self._fail(stream, f'Failed to start FFmpeg: {str(e)}')
+            return
+        await self._supervise(stream)
+
+    async def abandon(self, stream_id, error=''):
+        """Give up on a stream whose launch failed before ffmpeg was started."""
+        self.registry.discard(stream_id)
+        persistence.delete(stream_id)
+        stream = self._streams.get(stream_id)
+        if stream is not None:
+            await self._stop(stream)
+        else:
+            runner.remove_stream_dir(self._stream_dir(stream_id))
+        await events.publish(stream_id, 'failed', error)
+
+    async def release(self, stream_id):
+        """Drop a viewer; stops ffmpeg with the last one. Returns None for unknown streams."""
+        viewers = self.registry.release(stream_id)
+        stream = self._streams.get(stream_id)
+        if viewers is None and stream is None:
+            return None
+        if viewers:
+            persistence.save(stream_id, viewers=viewers)
+            return {'stream_id': stream_id, 'viewers': viewers, 'status': stream.state if stream else 'starting'}
+        persistence.delete(stream_id)
+        if stream is not None:
+            await self._stop(stream)
+        else:
+            runner.remove_stream_dir(self._stream_dir(stream_id))
+        await events.publish(stream_id, 'stopped')
+        return {'stream_id': stream_id, 'viewers': 0, 'status': 'stopped'}
+
+    async def drop(self, stream_id):
+        """Stop a copy of a stream that was moved to another node while this one was unreachable.
+
+        Viewers don't count, and the row and stream directory are left to
+        the node now running the stream, as both may be shared.
+        """
+        self.registry.discard(stream_id)
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return False
+        await self._stop(stream, remove_dir=False)
+        return True
+
+    async def touch(self, stream_ids):
+        """Viewer activity reported by the web tier. Resumes suspended streams."""
+        now = asyncio.get_running_loop().time()
+        for stream_id in stream_ids:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                continue
+            stream.last_active = now
+            if stream.state == 'suspended':
+                try:
+                    await self._resume(stream)
+                except (SupervisorError, OSError) as e:
+                    logger.warning(f"Could not resume stream {stream_id}: {str(e)}")
+
+    async def _suspend_idle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            timeout = settings.STREAM_IDLE_TIMEOUT
+            if not timeout:
+                continue
+            for stream in list(self._streams.values()):
+                # Warm, recording and analysed streams keep encoding without viewers
+                if stream.state in ('starting', 'connected', 'restarting') and not stream.entry.warm and \
+                        stream.recording is None and stream.motion is None and \
+                        loop.time() - stream.last_active > timeout:
+                    await self._suspend(stream)
+
+    async def _suspend(self, stream):
+        """Stop an unwatched stream's encoder but keep its stream_id, URL and viewers."""
+        logger.info(f"Suspending stream {stream.stream_id}, no viewer activity for "
+                    f"{settings.STREAM_IDLE_TIMEOUT}s")
+        stream.state = 'suspending'
+        stream.stop_requested.set()
+        if stream.process is not None:
+            await runner.terminate(stream.process)
+        if stream.task is not None:
+            await stream.task
+        if self._streams.get(stream.stream_id) is not stream:
+            # Stopped for good meanwhile
+            return
+        stream.stop_requested = asyncio.Event()
+        stream.task = None
+        self.scheduler.release(stream.stream_id)
+        stream.allocation = None
+        # Players must not be handed the old playlist when the stream resumes
+        runner.clear_stream_dir(stream.stream_dir)
+        stream.pushed.clear()
+        if stream.hub is not None:
+            stream.hub.reset()
+        stream.state = 'suspended'
+        self._save(stream)
+        await events.publish(stream.stream_id, 'suspended')
+
+    async def _resume(self, stream):
+        logger.info(f"Resuming stream {stream.stream_id}")
+        stream.state = 'starting'
+        stream.error = ''
+        try:
+            await self._admit(stream)
+        except (SupervisorError, OSError):
+            stream.state = 'suspended'
+            raise
+        if stream.state == 'starting':
+            await events.publish(stream.stream_id, 'starting')
+        self._save(stream)
+
+    async def mark_ready(self, stream_id, run=None):
+        """Readiness report for a 'push' stream, whose output this process cannot see.
+
+        ``run`` is the token of the run that PUT the playlist; a report for an
+        earlier run is ignored.
+        """
+        stream = self._streams.get(stream_id)
+        if stream is None or (run is not None and run != stream.push_run):
+            return False
+        stream.pushed.set()
+        return True
+
+    async def status(self, stream_id, history=False):
+        stream = self._streams.get(stream_id)
+        if stream is not None:
+            return stream.as_dict(history)
+        entry = self.registry.get(stream_id)
+        if entry is not None:
+            return {'stream_id': stream_id, 'profile': entry.profile, 'status': 'starting', 'error': '',
+                    'pid': None, 'viewers': entry.viewers, 'restarts': 0, 'metrics': {}}
+        return None
+
+    async def list(self, stream_ids=None, brief=False):
+        """Supervised streams, or just the known ones of ``stream_ids``. ``brief`` leaves metrics out."""
+        if stream_ids is None:
+            return [stream.summary() if brief else stream.as_dict() for stream in self._streams.values()]
+        found = []
+        for stream_id in stream_ids:
+            stream = self._streams.get(stream_id)
+            if stream is not None:
+                found.append(stream.summary() if brief else stream.as_dict())
+                continue
+            # Registered but not launched yet
+            stream_status = await self.status(stream_id)
+            if stream_status is not None:
+                found.append(stream_status)
+        return found
+
+    async def find(self, rtsp_url):
+        """Streams of one camera under any profile, as ``{stream_id, profile, status, output}``."""
+        key = normalize_rtsp_url(rtsp_url)
+        return [
+            {'stream_id': stream.stream_id, 'profile': stream.entry.profile, 'status': stream.state,
+             'output': stream.output}
+            for stream in self._streams.values() if stream.entry.key[0] == key
+        ]
+
+    async def capacity(self):
+        return self.scheduler.as_dict()
+
+    def fragment_hub(self, stream_id):
+        """FragmentHub of a piped stream, or None. Safe to call from other threads."""
+        stream = self._streams.get(stream_id)
+        return stream.hub if stream is not None else None
+
+    async def shutdown(self):
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+        if self._retention_task is not None:
+            self._retention_task.cancel()
+        await asyncio.gather(*(self._stop(stream) for stream in list(self._streams.values())))
+        self.scheduler.close()
+
+    async def dispatch(self, command, args):
+        handler = {
+            'acquire': self.acquire,
+            'launch': self.launch,
+            'record': self.record,
+            'restore': self.restore,
+            'set_motion_threshold': self.set_motion_threshold,
+            'abandon': self.abandon,
+            'release': self.release,
+            'drop': self.drop,
+            'mark_ready': self.mark_ready,
+            'touch': self.touch,
+            'status': self.status,
+            'list': self.list,
+            'find': self.find,
+            'capacity': self.capacity,
+        }.get(command)
+        if handler is None:
+            raise SupervisorError(f'Unknown command: {command}')
+        return await handler(**args)
+
+    def _stream_dir(self, stream_id):
+        return os.path.join(settings.MEDIA_ROOT, 'streams', stream_id)
+
+    async def _spawn(self, stream):
+        stdout = subprocess.PIPE if stream.hub is not None else subprocess.DEVNULL
+        cmd = stream.cmd
+        if stream.push_url:
+            stream.push_run = uuid.uuid4().hex
+            cmd = _push_run_command(cmd, stream.push_url, stream.push_run)
+        if stream.motion is None:
+            process = await runner.spawn(cmd, stream.stream_dir, stdout=stdout)
+        else:
+            # Each run gets a fresh pipe; the analysis ends when ffmpeg closes it
+            read_fd, write_fd = os.pipe()
+            try:
+                process = await runner.spawn(cmd + encoder.motion_args(write_fd), stream.stream_dir,
+                                             stdout=stdout, pass_fds=(write_fd,))
+            except OSError:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
+            stream.analysis = asyncio.ensure_future(motion.analyse(
+                read_fd, stream.motion, lambda detector: self._publish_motion(stream, detector)
+            ))
+        self.scheduler.started(stream.stream_id, process.pid)
+        return process
+
+    async def _stop(self, stream, remove_dir=True):
+        self._streams.pop(stream.stream_id, None)
+        stream.state = 'stopping'
+        self._stop_recording(stream)
+        stream.stop_requested.set()
+        if stream.process is not None:
+            await runner.terminate(stream.process)
+        if stream.task is not None:
+            await stream.task
+        if stream.analysis is not None:
+            stream.analysis.cancel()
+        self.scheduler.release(stream.stream_id)
+        if stream.hub is not None:
+            stream.hub.close()
+        stream.state = 'stopped'
+        if remove_dir:
+            runner.remove_stream_dir(stream.stream_dir)
+        logger.info(f"Stopped stream {stream.stream_id}")
+
+    async def _fail(self, stream, error):
+        stream.state = 'failed'
+        stream.error = error
+        self._stop_recording(stream)
+        self._save(stream)
+        self.scheduler.release(stream.stream_id)
+        logger.error(f"Stream {stream.stream_id} failed: {error}")
+        runner.remove_stream_dir(stream.stream_dir)
+        if stream.hub is not None:
+            stream.hub.close()
+        await events.publish(stream.stream_id, 'failed', error)
+
+    async def _supervise(self, stream):
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        # Wall time of the last respawn; the old run's playlist is still on disk
+        respawned_at = None
+        while True:
+            if stream.stop_requested.is_set():
+                # Stopped while this ffmpeg was being spawned, after _stop looked for it
+                await runner.terminate(stream.process)
+                return
+            started_at = loop.time()
+            stream.metrics.reset()
+            logs.bind(stream_id=stream.stream_id, pid=stream.process.pid)
+            drain = asyncio.ensure_future(runner.drain_stderr(
+                stream.process, stream.stderr_tail, stream.metrics.feed,
+                functools.partial(logs.ffmpeg_line, stream.stream_id, stream.process.pid),
+            ))
+            if stream.hub is not None:
+                drain = asyncio.gather(drain, pump_fragments(stream.process.stdout, stream.hub))
+                ready = asyncio.ensure_future(stream.hub.ready.wait())
+            elif stream.output == 'push':
+                ready = asyncio.ensure_future(stream.pushed.wait())
+            else:
+                ready = asyncio.ensure_future(wait_until_ready(stream.stream_dir, stream.playlist, respawned_at))
+            exited = asyncio.ensure_future(stream.process.wait())
+            await asyncio.wait({ready, exited}, timeout=READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+
+            if ready.done():
+                if stream.state in ('starting', 'restarting'):
+                    stream.state = 'connected'
+                    stream.error = ''
+                    self._save(stream)
+                    logger.info(f"Stream {stream.stream_id} is producing output (PID {stream.process.pid})")
+                    await events.publish(stream.stream_id, 'connected')
+                await exited
+                error = f"FFmpeg exited with code {stream.process.returncode}"
+            else:
+                ready.cancel()
+                if exited.done():
+                    error = 'FFmpeg process failed'
+                else:
+                    await runner.terminate(stream.process)
+                    error = 'FFmpeg failed to generate HLS playlist or segments within timeout'
+            await drain
+
+            if stream.stop_requested.is_set():
+                return
+            error = f"{error}: {' | '.join(stream.stderr_tail)}"
+            if stream.restarts == 0 and stream.state == 'starting':
+                # Never produced output: a bad URL or codec, not worth retrying
+                await self._fail(stream, error)
+                return
+
+            if loop.time() - started_at > STABLE_AFTER:
+                attempt = 0
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_MIN * 2 ** attempt)
+            attempt += 1
+            stream.restarts += 1
+            stream.state = 'restarting'
+            stream.error = error
+            self._save(stream)
+            logger.warning(f"Stream {stream.stream_id} encoder died, restarting in {delay}s: {error}")
+            await events.publish(stream.stream_id, 'restarting', error)
+            try:
+                await asyncio.wait_for(stream.stop_requested.wait(), delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+            # A readiness report for the ffmpeg that died must not count for the new one
+            stream.pushed.clear()
+            respawned_at = time.time()
+            try:
+                stream.process = await self._spawn(stream)
+            except OSError as e:
+                await self._fail(stream, f'Failed to restart FFmpeg: {str(e)}')
+                return
+            self._save(stream)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self._handle_client, host, port)
+        logger.info(f"Stream supervisor listening on {host}:{port}")
+        return server
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not _authorized(request):
+                        logger.warning(f"Rejected a supervisor request with a bad token from "
+                                       f"{writer.get_extra_info('peername')}")
+                        writer.write(json.dumps({'ok': False, 'error': 'Not authorized'}).encode() + b'\n')
+                        await writer.drain()
+                        break
+                    if request['command'] == 'subscribe':
+                        await self._stream_fragments(request['args']['stream_id'], writer)
+                        break
+                    reply = {'ok': True, 'result': await self.dispatch(request['command'], request.get('args', {}))}
+                except SupervisorSaturated as e:
+                    reply = {'ok': False, 'error': str(e), 'saturated': True}
+                except (SupervisorError, ValueError, KeyError, TypeError) as e:
+                    reply = {'ok': False, 'error': str(e)}
+                except Exception as e:
+                    logger.error(f"Supervisor command failed: {str(e)}", exc_info=True)
+                    reply = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _stream_fragments(self, stream_id, writer):
+        # Dedicates the connection to one stream: a JSON reply, then frames
+        # of a 4-byte big-endian length and the fragment, 0 marking the end.
+        hub = self.fragment_hub(stream_id)
+        if hub is None:
+            raise SupervisorError(f'Stream {stream_id} has no fragment output')
+        writer.write(json.dumps({'ok': True, 'result': None}).encode() + b'\n')
+        subscriber = hub.subscribe(asyncio.get_running_loop())
+        try:
+            while True:
+                data = await subscriber.get()
+                if data is None:
+                    writer.write(struct.pack('>I', 0))
+                    break
+                writer.write(struct.pack('>I', len(data)))
+                writer.write(data)
+                # Backpressure from a slow viewer fills this subscriber's queue,
+                # which then skips ahead instead of growing
+                await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            hub.unsubscribe(subscriber)
+
+
+def _push_run_command(cmd, push_url, run):
+    """``cmd`` with the outputs under ``push_url`` moved to ``push_url/<run>/``."""
+    run_url = f'{push_url}{run}/'
+    return [run_url + arg[len(push_url):] if arg.startswith(push_url) else arg for arg in cmd]
+
+
+def _authorized(request):
+    token = settings.STREAM_NODE_TOKEN
+    if not token:
+        return True
+    sent = request.get('token')
+    return isinstance(sent, str) and hmac.compare_digest(sent.encode(), token.encode())
+
+
+def _request(command, args):
+    """One line of the socket protocol."""
+    request = {'command': command, 'args': args}
+    if settings.STREAM_NODE_TOKEN:
+        request['token'] = settings.STREAM_NODE_TOKEN
+    return json.dumps(request).encode() + b'\n'
+
+
+class SupervisorClient(abc.ABC):
+    """Synchronous facade used by the views."""
+
+    @abc.abstractmethod
+    def call(self, command, **args):
+        """Run a supervisor command and return its result."""
+
+    def acquire(self, rtsp_url, profile, warm=False):
+        return self.call('acquire', rtsp_url=rtsp_url, profile=profile, warm=warm)
+
+    def launch(self, stream_id, video=None, output='files', record=False, motion_threshold=None):
+        return self.call('launch', stream_id=stream_id, video=video, output=output, record=record,
+                         motion_threshold=motion_threshold)
+
+    def record(self, stream_id):
+        return self.call('record', stream_id=stream_id)
+
+    def restore(self, stream_id, rtsp_url, profile, viewers, warm=False):
+        return self.call('restore', stream_id=stream_id, rtsp_url=rtsp_url, profile=profile, viewers=viewers,
+                         warm=warm)
+
+    def set_motion_threshold(self, stream_id, threshold):
+        return self.call('set_motion_threshold', stream_id=stream_id, threshold=threshold)
+
+    def abandon(self, stream_id, error=''):
+        return self.call('abandon', stream_id=stream_id, error=error)
+
+    def release(self, stream_id):
+        return self.call('release', stream_id=stream_id)
+
+    def drop(self, stream_id):
+        return self.call('drop', stream_id=stream_id)
+
+    def mark_ready(self, stream_id, run=None):
+        return self.call('mark_ready', stream_id=stream_id, run=run)
+
+    def touch(self, stream_ids):
+        return self.call('touch', stream_ids=stream_ids)
+
+    def status(self, stream_id, history=False):
+        return self.call('status', stream_id=stream_id, history=history)
+
+    def list(self, stream_ids=None, brief=False):
+        return self.call('list', stream_ids=stream_ids, brief=brief)
+
+    def find(self, rtsp_url):
+        return self.call('find', rtsp_url=rtsp_url)
+
+    def capacity(self):
+        return self.call('capacity')
+
+    @abc.abstractmethod
+    async def fragments(self, stream_id):
+        """Async iterator over a piped stream's init segment and fMP4 fragments."""
+
+
+class LocalSupervisorClient(SupervisorClient):
+    """Runs the supervisor in this process on the runner loop."""
+
+    def __init__(self):
+        self.supervisor = runner.run(self._create())
+        atexit.register(self._shutdown)
+
+    @staticmethod
+    async def _create():
+        # Created on the runner loop so its asyncio primitives bind there
+        return Supervisor()
+
+    def call(self, command, **args):
+        try:
+            return runner.run(self.supervisor.dispatch(command, args))
+        except (ValueError, KeyError, TypeError) as e:
+            raise SupervisorError(str(e))
+
+    async def fragments(self, stream_id):
+        hub = self.supervisor.fragment_hub(stream_id)
+        if hub is None:
+            raise SupervisorError(f'Stream {stream_id} has no fragment output')
+        subscriber = hub.subscribe(asyncio.get_running_loop())
+        try:
+            while True:
+                data = await subscriber.get()
+                if data is None:
+                    return
+                yield data
+        finally:
+            hub.unsubscribe(subscriber)
+
+    def _shutdown(self):
+        try:
+            runner.run(self.supervisor.shutdown(), timeout=runner.STOP_GRACE + 1)
+        except Exception as e:
+            logger.error(f"Error stopping streams on exit: {str(e)}")
+
+
+class SocketSupervisorClient(SupervisorClient):
+    """Talks to ``manage.py stream_supervisor`` over its local socket."""
+
+    def __init__(self, address, timeout=CLIENT_TIMEOUT):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self.timeout = timeout
+
+    def call(self, command, **args):
+        payload = _request(command, args)
+        try:
+            with socket.create_connection(self.address, timeout=self.timeout) as sock:
+                sock.sendall(payload)
+                with sock.makefile('rb') as reply_file:
+                    line = reply_file.readline()
+        except OSError as e:
+            raise SupervisorUnavailable(f'Stream supervisor unreachable at {self.address[0]}:{self.address[1]}: {str(e)}')
+        if not line:
+            raise SupervisorUnavailable('Stream supervisor closed the connection')
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise (SupervisorSaturated if reply.get('saturated') else SupervisorError)(reply['error'])
+        return reply['result']
+
+    async def fragments(self, stream_id):
+        try:
+            reader, writer = await asyncio.open_connection(*self.address)
+        except OSError as e:
+            raise SupervisorUnavailable(f'Stream supervisor unreachable at {self.address[0]}:{self.address[1]}: {str(e)}')
+        try:
+            writer.write(_request('subscribe', {'stream_id': stream_id}))
+            await writer.drain()
+            reply = json.loads(await reader.readline() or b'{"ok": false, "error": "Connection closed"}')
+            if not reply['ok']:
+                raise SupervisorError(reply['error'])
+            while True:
+                size = struct.unpack('>I', await reader.readexactly(4))[0]
+                if size == 0:
+                    return
+                yield await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            return
+        finally:
+            writer.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_supervisor():
+    global _client
+    with _client_lock:
+        if _client is None:
+            address = settings.STREAM_SUPERVISOR_ADDRESS
+            if settings.STREAM_NODES:
+                # Imported here: the coordinator builds on the clients above
+                from .coordinator import CoordinatorClient
+                _client = CoordinatorClient(settings.STREAM_NODES)
+            elif address:
+                _client = SocketSupervisorClient(address)
+            else:
+                _client = LocalSupervisorClient()
+    return _client
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import asyncio
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from stream import activity, events, runner, supervisor
+from stream.supervisor import SupervisedStream, Supervisor, SupervisorError
+
+FIRST = str(uuid.uuid4())
+SECOND = str(uuid.uuid4())
+# Publishes a playlist and keeps encoding
+ENCODER = '''
+import time
+with open('index.m3u8', 'w') as f:
+    f.write('#EXTM3U\\n')
+time.sleep(60)
+'''
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+class ActivityTests(SimpleTestCase):
+    def setUp(self):
+        with activity._lock:
+            activity._seen.clear()
+            activity._held.clear()
+        for patcher in (mock.patch.object(activity, 'FLUSH_INTERVAL', 0.05),
+                        mock.patch.object(activity, 'get_supervisor')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.touch = activity.get_supervisor.return_value.touch
+        # A flusher left sleeping by an earlier test wakes up on its old interval
+        time.sleep(activity.FLUSH_INTERVAL if activity._flusher is None else 1.1)
+        self.touch.reset_mock()
+
+    def _touched(self):
+        _wait(lambda: self.touch.called)
+        return [sorted(call.args[0]) for call in self.touch.call_args_list]
+
+    def test_requests_are_reported_together(self):
+        for stream_id in (FIRST, SECOND, FIRST):
+            activity.note(stream_id)
+
+        self.assertEqual(self._touched(), [sorted([FIRST, SECOND])])
+        time.sleep(0.2)
+        # Nothing new was seen
+        self.assertEqual(self.touch.call_count, 1)
+
+    def test_held_stream_is_reported_until_released(self):
+        activity.hold(FIRST)
+        self.assertTrue(_wait(lambda: self.touch.call_count >= 2))
+        activity.unhold(FIRST)
+        calls = self.touch.call_count
+        time.sleep(0.3)
+
+        # Once more for the release, then no longer
+        self.assertLessEqual(self.touch.call_count, calls + 1)
+        self.assertEqual(self.touch.call_args.args[0], [FIRST])
+
+    def test_supervisor_errors_do_not_stop_the_flusher(self):
+        self.touch.side_effect = SupervisorError('unreachable')
+        with self.assertLogs('stream.activity', 'WARNING'):
+            activity.note(FIRST)
+            self.assertTrue(_wait(lambda: self.touch.called))
+        self.touch.side_effect = None
+        self.touch.reset_mock()
+        activity.note(SECOND)
+        self.assertEqual(self._touched(), [[SECOND]])
+
+    def test_supervisor_is_looked_up_off_the_runner_loop(self):
+        client = activity.get_supervisor.return_value
+
+        def get_supervisor():
+            # As the first call does when it creates the local supervisor
+            runner.run(asyncio.sleep(0), timeout=1)
+            return client
+        activity.get_supervisor.side_effect = get_supervisor
+
+        activity.note(FIRST)
+
+        self.assertEqual(self._touched(), [[FIRST]])
+
+    def test_only_player_fetches_count(self):
+        with mock.patch.object(activity, 'note') as note:
+            self.client.get(f'/media/streams/{FIRST}/index.m3u8')
+            self.client.get(f'/api/stream/store/{SECOND}/000.ts')
+            self.client.put(f'/api/stream/store/{SECOND}/run/000.ts', b'', content_type='video/mp2t')
+            self.client.get('/media/recordings/x.ts')
+
+        self.assertEqual(note.call_args_list, [mock.call(FIRST), mock.call(SECOND)])
+
+
+class IdleSuspendTests(SimpleTestCase):
+    """An unwatched stream is suspended after ``STREAM_IDLE_TIMEOUT`` and a player fetch resumes it."""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media, STREAM_IDLE_TIMEOUT=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for patcher in (mock.patch('stream.supervisor.persistence'),
+                        mock.patch.object(events, 'publish', mock.AsyncMock()),
+                        mock.patch.object(supervisor, 'IDLE_CHECK_INTERVAL', 0.05),
+                        mock.patch.object(activity, 'FLUSH_INTERVAL', 0.05),
+                        mock.patch.object(activity, 'get_supervisor')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.supervisor = Supervisor()
+        # What the web tier's client does with the activity it reports
+        activity.get_supervisor.return_value.touch = lambda stream_ids: runner.run(self.supervisor.touch(stream_ids))
+
+    def _launch(self):
+        stream_id = runner.run(self.supervisor.acquire('rtsp://camera.test/live', 'transcode'))['stream_id']
+        entry = self.supervisor.registry.get(stream_id)
+        stream_dir = self.supervisor._stream_dir(stream_id)
+        os.makedirs(stream_dir)
+        stream = SupervisedStream(entry, [sys.executable, '-c', ENCODER], stream_dir, 'index.m3u8')
+
+        async def launch():
+            stream.last_active = asyncio.get_running_loop().time()
+            await self.supervisor._admit(stream)
+            self.supervisor._streams[stream_id] = stream
+            self.supervisor._idle_task = asyncio.ensure_future(self.supervisor._suspend_idle())
+
+        runner.run(launch())
+        self.addCleanup(runner.run, self._stop(stream))
+        self.assertTrue(_wait(lambda: stream.state == 'connected'))
+        return stream
+
+    async def _stop(self, stream):
+        self.supervisor._idle_task.cancel()
+        await self.supervisor._stop(stream)
+
+    def test_idle_stream_is_suspended_and_resumed_by_a_player(self):
+        stream = self._launch()
+        first_process = stream.process
+        # Still watched: not suspended
+        time.sleep(0.2)
+        self.assertEqual(stream.state, 'connected')
+
+        stream.last_active -= 61
+        self.assertTrue(_wait(lambda: stream.state == 'suspended'))
+        self.assertIsNotNone(first_process.returncode)
+        self.assertFalse(os.path.exists(os.path.join(stream.stream_dir, 'index.m3u8')))
+
+        # The player keeps polling the playlist, 404 while suspended
+        response = self.client.get(f'/media/streams/{stream.stream_id}/index.m3u8')
+        self.assertEqual(response.status_code, 404)
+
+        self.assertTrue(_wait(lambda: stream.state == 'connected'))
+        self.assertIsNot(stream.process, first_process)
+        self.assertIsNone(stream.process.returncode)
@@ -0,0 +1,277 @@
+import io
+import os
+import array
+import shutil
+import calendar
+import tempfile
+from unittest import mock
+
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+from django.test import SimpleTestCase, override_settings
+
+from stream import archive
+from stream.archive import Archive, ArchiveIndex, LocalArchiveStore, S3ArchiveStore
+
+CAMERA = 'c0ffee'
+# 2024-05-01T00:00:00Z
+DAY_START = calendar.timegm((2024, 5, 1, 0, 0, 0)) * 1000
+HOUR = archive.HOUR_MS
+
+
+def _records(path):
+    records = array.array('q')
+    with open(path, 'rb') as f:
+        records.frombytes(f.read())
+    return list(zip(records[0::2], records[1::2]))
+
+
+class TempDirTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+
+class ArchiveIndexTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = ArchiveIndex(self.root)
+
+    def test_records_are_fixed_size_pairs_in_a_file_per_utc_day(self):
+        self.index.append(CAMERA, DAY_START + 1000, 2000)
+        self.index.append(CAMERA, DAY_START + 3000, 2500)
+        self.index.append(CAMERA, DAY_START + archive.DAY_MS, 2000)
+
+        path = os.path.join(self.root, CAMERA, '20240501.idx')
+        self.assertEqual(os.path.getsize(path), 2 * archive.INDEX_RECORD_SIZE)
+        self.assertEqual(_records(path), [(DAY_START + 1000, 2000), (DAY_START + 3000, 2500)])
+        self.assertEqual(self.index.days(CAMERA), ['20240501', '20240502'])
+        self.assertEqual(self.index.cameras(), [CAMERA])
+
+    def test_load_picks_up_appended_records_and_ignores_a_torn_tail(self):
+        self.index.append(CAMERA, DAY_START, 2000)
+        starts, durations = self.index.load(CAMERA, '20240501')
+        self.assertEqual((list(starts), list(durations)), ([DAY_START], [2000]))
+
+        self.index.append(CAMERA, DAY_START + 2000, 2000)
+        with open(os.path.join(self.root, CAMERA, '20240501.idx'), 'ab') as f:
+            # Half a record, as left by a write in progress
+            f.write(b'\0' * 8)
+        starts, durations = self.index.load(CAMERA, '20240501')
+        self.assertEqual(list(starts), [DAY_START, DAY_START + 2000])
+
+    def test_out_of_order_records_are_sorted(self):
+        for start in (DAY_START + 4000, DAY_START + 2000, DAY_START + 6000, DAY_START):
+            self.index.append(CAMERA, start, 2000)
+        starts, durations = self.index.load(CAMERA, '20240501')
+        self.assertEqual(list(starts), [DAY_START, DAY_START + 2000, DAY_START + 4000, DAY_START + 6000])
+
+    def test_missing_day_is_empty(self):
+        self.assertEqual(list(self.index.load(CAMERA, '20240501')[0]), [])
+        self.assertEqual(self.index.segments(CAMERA, DAY_START, DAY_START + HOUR), [])
+        self.assertIsNone(self.index.seek(CAMERA, DAY_START))
+        self.assertEqual(self.index.days(CAMERA), [])
+
+    def test_segments_returns_those_overlapping_the_range(self):
+        for start in range(DAY_START, DAY_START + 10000, 2000):
+            self.index.append(CAMERA, start, 2000)
+
+        # A segment ending exactly at the start and one starting exactly at the end are left out
+        self.assertEqual(self.index.segments(CAMERA, DAY_START + 2000, DAY_START + 6000),
+                         [(DAY_START + 2000, 2000), (DAY_START + 4000, 2000)])
+        # A start inside a segment includes it
+        self.assertEqual(self.index.segments(CAMERA, DAY_START + 2500, DAY_START + 4001),
+                         [(DAY_START + 2000, 2000), (DAY_START + 4000, 2000)])
+        self.assertEqual(self.index.segments(CAMERA, DAY_START + 20000, DAY_START + 30000), [])
+
+    def test_segments_span_midnight(self):
+        midnight = DAY_START + archive.DAY_MS
+        self.index.append(CAMERA, midnight - 2000, 2000)
+        self.index.append(CAMERA, midnight, 2000)
+
+        self.assertEqual(self.index.segments(CAMERA, midnight - 1000, midnight + 1000),
+                         [(midnight - 2000, 2000), (midnight, 2000)])
+
+    def test_seek(self):
+        self.index.append(CAMERA, DAY_START + 1000, 2000)
+        self.index.append(CAMERA, DAY_START + 10000, 2000)
+
+        self.assertEqual(self.index.seek(CAMERA, DAY_START + 2999), (DAY_START + 1000, 2000))
+        # Before or between segments, the next one
+        self.assertEqual(self.index.seek(CAMERA, DAY_START), (DAY_START + 1000, 2000))
+        self.assertEqual(self.index.seek(CAMERA, DAY_START + 3000), (DAY_START + 10000, 2000))
+        self.assertIsNone(self.index.seek(CAMERA, DAY_START + 12000))
+        # Only the day of the time asked for is searched
+        self.assertIsNone(self.index.seek(CAMERA, DAY_START - 1))
+
+    def test_trim_rewrites_the_day_and_removes_it_once_empty(self):
+        for start in range(DAY_START, DAY_START + 4 * HOUR, HOUR):
+            self.index.append(CAMERA, start, 2000)
+        self.index.load(CAMERA, '20240501')
+
+        self.index.trim(CAMERA, '20240501', DAY_START + 2 * HOUR)
+        path = os.path.join(self.root, CAMERA, '20240501.idx')
+        self.assertEqual(_records(path), [(DAY_START + 2 * HOUR, 2000), (DAY_START + 3 * HOUR, 2000)])
+        self.assertEqual(list(self.index.load(CAMERA, '20240501')[0]), [DAY_START + 2 * HOUR, DAY_START + 3 * HOUR])
+
+        self.index.trim(CAMERA, '20240501', DAY_START + 4 * HOUR)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(list(self.index.load(CAMERA, '20240501')[0]), [])
+
+
+class ParsePlaylistTests(SimpleTestCase):
+    def test_dated_and_following_segments(self):
+        text = '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-PROGRAM-DATE-TIME:2024-05-01T00:00:01.500+0000',
+            '#EXTINF:2.000000,',
+            '001.ts',
+            '#EXTINF:1.900000,',
+            '002.ts',
+            '#EXTINF:2.0,',
+        ])
+        self.assertEqual(archive.parse_playlist(text), [
+            ('001.ts', DAY_START + 1500, 2000),
+            ('002.ts', DAY_START + 3500, 1900),
+        ])
+
+    def test_undated_first_segment_is_skipped(self):
+        self.assertEqual(archive.parse_playlist('#EXTM3U\n#EXTINF:2.0,\n000.ts\n'), [])
+
+
+class ArchiveTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = LocalArchiveStore(os.path.join(self.root, 'segments'))
+        self.archive = Archive(self.store, ArchiveIndex(os.path.join(self.root, 'index')))
+        self.segment = os.path.join(self.root, 'segment.ts')
+        with open(self.segment, 'wb') as f:
+            f.write(b'G' * 188)
+
+    def _record(self, *starts, duration=2000):
+        for start in starts:
+            self.archive.record(CAMERA, start, duration, self.segment)
+
+    def test_record_stores_the_segment_under_its_hour(self):
+        self._record(DAY_START + HOUR + 500)
+        self.assertEqual(self.store.read(f'{CAMERA}/2024/05/01/01/{DAY_START + HOUR + 500}.ts'), b'G' * 188)
+
+    def test_playlist_covers_the_time_range(self):
+        self._record(DAY_START, DAY_START + 2000, DAY_START + 4000, DAY_START + 6000)
+
+        playlist = self.archive.playlist(CAMERA, DAY_START + 2500, DAY_START + 6000, 'http://host/rec/')
+
+        self.assertEqual(playlist.splitlines(), [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXT-X-PROGRAM-DATE-TIME:2024-05-01T00:00:02.000Z',
+            '#EXTINF:2.000,',
+            f'http://host/rec/{CAMERA}/{DAY_START + 2000}.ts',
+            '#EXT-X-PROGRAM-DATE-TIME:2024-05-01T00:00:04.000Z',
+            '#EXTINF:2.000,',
+            f'http://host/rec/{CAMERA}/{DAY_START + 4000}.ts',
+            '#EXT-X-ENDLIST',
+        ])
+
+    def test_playlist_marks_gaps_and_rounds_the_target_duration_up(self):
+        self._record(DAY_START, DAY_START + 2000)
+        self._record(DAY_START + 60000, duration=2500)
+
+        lines = self.archive.playlist(CAMERA, DAY_START, DAY_START + HOUR, '/').splitlines()
+
+        self.assertIn('#EXT-X-TARGETDURATION:3', lines)
+        self.assertEqual(lines.count('#EXT-X-DISCONTINUITY'), 1)
+        self.assertEqual(lines[lines.index('#EXT-X-DISCONTINUITY') + 1], '#EXT-X-PROGRAM-DATE-TIME:2024-05-01T00:01:00.000Z')
+
+    def test_playlist_of_nothing_recorded_is_none(self):
+        self._record(DAY_START)
+        self.assertIsNone(self.archive.playlist(CAMERA, DAY_START + HOUR, DAY_START + 2 * HOUR, '/'))
+
+    @override_settings(RECORDING_RETENTION_HOURS=2)
+    def test_evict_drops_whole_hours_before_the_retention_window(self):
+        self._record(DAY_START + 10, DAY_START + HOUR + 10, DAY_START + 2 * HOUR + 10, DAY_START + 3 * HOUR + 10)
+        segments = os.path.join(self.root, 'segments', CAMERA, '2024', '05', '01')
+
+        # Keeps from 01:00 on, the hour the window starts in
+        dropped = self.archive.evict(now_ms=DAY_START + 3 * HOUR + 30 * 60 * 1000)
+
+        self.assertEqual(dropped, 1)
+        self.assertEqual(sorted(os.listdir(segments)), ['01', '02', '03'])
+        self.assertEqual([start for start, _ in self.archive.index.segments(CAMERA, DAY_START, DAY_START + 4 * HOUR)],
+                         [DAY_START + HOUR + 10, DAY_START + 2 * HOUR + 10, DAY_START + 3 * HOUR + 10])
+        self.assertEqual(self.archive.evict(now_ms=DAY_START + 3 * HOUR + 30 * 60 * 1000), 0)
+
+    @override_settings(RECORDING_RETENTION_HOURS=1)
+    def test_evict_removes_emptied_days(self):
+        self._record(DAY_START + 10, DAY_START + archive.DAY_MS + 10)
+
+        self.assertEqual(self.archive.evict(now_ms=DAY_START + archive.DAY_MS + 2 * HOUR), 2)
+
+        self.assertEqual(self.archive.index.days(CAMERA), [])
+        # The directories left empty go too, up to the store's root
+        self.assertEqual(os.listdir(os.path.join(self.root, 'segments')), [])
+
+
+@mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test',
+                              'AWS_DEFAULT_REGION': 'us-east-1'})
+class S3ArchiveStoreTests(SimpleTestCase):
+    def _store(self):
+        store = S3ArchiveStore('recordings', 'archive/', 'http://minio.test:9000')
+        stubber = Stubber(store.client)
+        stubber.activate()
+        self.addCleanup(stubber.deactivate)
+        return store, stubber
+
+    def test_put_file_uploads_with_the_segment_content_type(self):
+        store, stubber = self._store()
+        with tempfile.NamedTemporaryFile(suffix='.ts') as f:
+            f.write(b'G' * 188)
+            f.flush()
+            stubber.add_response('put_object', {}, {
+                'Bucket': 'recordings', 'Key': f'archive/{CAMERA}/1.ts', 'Body': ANY,
+                'ContentType': archive.SEGMENT_CONTENT_TYPE, 'ChecksumAlgorithm': ANY,
+            })
+            store.put_file(f'{CAMERA}/1.ts', f.name)
+        stubber.assert_no_pending_responses()
+
+    def test_read(self):
+        store, stubber = self._store()
+        stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(b'data'), 4)},
+                             {'Bucket': 'recordings', 'Key': f'archive/{CAMERA}/1.ts'})
+        self.assertEqual(store.read(f'{CAMERA}/1.ts'), b'data')
+
+    def test_url_is_presigned_for_the_prefixed_key(self):
+        store, _ = self._store()
+        with mock.patch('time.time', return_value=1000):
+            url = store.url(f'{CAMERA}/1.ts')
+        self.assertTrue(url.startswith(f'http://minio.test:9000/recordings/archive/{CAMERA}/1.ts?'))
+        self.assertIn(f'Expires={1000 + S3ArchiveStore.URL_EXPIRY}', url)
+
+    def test_delete_prefix_deletes_every_page(self):
+        store, stubber = self._store()
+        prefix = archive.hour_prefix(CAMERA, DAY_START)
+        stubber.add_response('list_objects_v2', {
+            'Contents': [{'Key': f'archive/{prefix}1.ts'}, {'Key': f'archive/{prefix}2.ts'}],
+            'IsTruncated': True, 'NextContinuationToken': 'next',
+        }, {'Bucket': 'recordings', 'Prefix': f'archive/{prefix}'})
+        stubber.add_response('delete_objects', {}, {'Bucket': 'recordings', 'Delete': {
+            'Objects': [{'Key': f'archive/{prefix}1.ts'}, {'Key': f'archive/{prefix}2.ts'}], 'Quiet': True}})
+        stubber.add_response('list_objects_v2', {
+            'Contents': [{'Key': f'archive/{prefix}3.ts'}], 'IsTruncated': False,
+        }, {'Bucket': 'recordings', 'Prefix': f'archive/{prefix}', 'ContinuationToken': 'next'})
+        stubber.add_response('delete_objects', {}, {'Bucket': 'recordings', 'Delete': {
+            'Objects': [{'Key': f'archive/{prefix}3.ts'}], 'Quiet': True}})
+
+        store.delete_prefix(prefix)
+
+        stubber.assert_no_pending_responses()
+
+    def test_delete_prefix_of_nothing(self):
+        store, stubber = self._store()
+        stubber.add_response('list_objects_v2', {'IsTruncated': False}, {'Bucket': 'recordings', 'Prefix': 'archive/x/'})
+        store.delete_prefix('x/')
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,69 @@
+import os
+import sys
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from stream import benchmark
+
+
+def _report(response_p90=1.0, requests_per_second=100.0):
+    return {
+        'start': {'response': {'p90': response_p90}},
+        'serve': {'requests_per_second': requests_per_second},
+    }
+
+
+class PercentileTests(SimpleTestCase):
+    def test_no_values(self):
+        self.assertEqual(benchmark.percentiles([]), {'count': 0})
+
+    def test_percentiles_of_unsorted_values(self):
+        values = list(range(100, 0, -1))
+
+        self.assertEqual(benchmark.percentiles(values), {
+            'count': 100, 'mean': 50.5, 'p50': 51, 'p90': 91, 'p99': 100, 'max': 100,
+        })
+
+    def test_one_value_is_every_percentile(self):
+        self.assertEqual(benchmark.percentiles([0.12345]), {
+            'count': 1, 'mean': 0.123, 'p50': 0.123, 'p90': 0.123, 'p99': 0.123, 'max': 0.123,
+        })
+
+
+class RegressionTests(SimpleTestCase):
+    def test_slower_response_beyond_tolerance_is_reported(self):
+        found = benchmark.regressions(_report(response_p90=1.5), _report(), tolerance=0.2)
+        self.assertEqual(found, ['start.response.p90: 1.0 -> 1.5 (+50%)'])
+
+    def test_change_within_tolerance_is_not_reported(self):
+        self.assertEqual(benchmark.regressions(_report(response_p90=1.1), _report(), tolerance=0.2), [])
+
+    def test_higher_is_better_metrics_regress_when_they_drop(self):
+        self.assertEqual(benchmark.regressions(_report(requests_per_second=150), _report(), tolerance=0.2), [])
+        found = benchmark.regressions(_report(requests_per_second=50), _report(), tolerance=0.2)
+        self.assertEqual(found, ['serve.requests_per_second: 100.0 -> 50 (-50%)'])
+
+    def test_improvements_are_not_reported(self):
+        self.assertEqual(benchmark.regressions(_report(response_p90=0.5), _report(), tolerance=0.2), [])
+
+    def test_metrics_missing_from_either_report_are_skipped(self):
+        # e.g. encoders not visible in /proc, or a zero baseline
+        baseline = _report(response_p90=0)
+        baseline['encoders'] = {'available': False}
+        report = _report(response_p90=1.0)
+        report['encoders'] = {'cpu_percent': {'mean': 50}}
+
+        self.assertEqual(benchmark.regressions(report, baseline, tolerance=0.2), [])
+
+
+@skipUnless(sys.platform.startswith('linux'), 'needs /proc')
+class ProcSampleTests(SimpleTestCase):
+    def test_own_process(self):
+        cpu, rss = benchmark._proc_sample(os.getpid())
+        self.assertGreater(cpu, 0)
+        self.assertGreater(rss, 0)
+
+    def test_missing_process(self):
+        with open('/proc/sys/kernel/pid_max') as f:
+            self.assertIsNone(benchmark._proc_sample(int(f.read()) + 1))
@@ -0,0 +1,99 @@
+import uuid
+import asyncio
+from unittest import mock
+
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, override_settings
+from fakeredis import FakeServer
+
+from stream import events
+from stream.consumers import StreamConsumer
+
+from .test_events import close_layer, redis_layers, reset_events
+
+FIRST = str(uuid.uuid4())
+SECOND = str(uuid.uuid4())
+
+
+class StreamConsumerTests(SimpleTestCase):
+    def setUp(self):
+        reset_events()
+        layers = override_settings(CHANNEL_LAYERS=redis_layers(FakeServer()))
+        layers.enable()
+        self.addCleanup(layers.disable)
+        patcher = mock.patch('stream.consumers.activity')
+        self.activity = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _connect(self, query=''):
+        communicator = WebsocketCommunicator(StreamConsumer.as_asgi(), f'/ws/streams/{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _disconnect(self, communicator):
+        await communicator.disconnect()
+        await close_layer()
+
+    async def _publish(self, *updates):
+        for update in updates:
+            await events.publish(*update)
+        await events.flush()
+
+    def _update(self, stream_id, status, error=''):
+        return {'stream_id': stream_id, 'status': status, 'error': error}
+
+    async def test_filtered_connection_gets_single_updates_of_its_streams(self):
+        communicator = await self._connect(f'?stream_id={FIRST},{SECOND}&stream_id=not-a-uuid')
+        try:
+            await self._publish((FIRST, 'connected'), (str(uuid.uuid4()), 'connected'))
+
+            self.assertEqual(await communicator.receive_json_from(), self._update(FIRST, 'connected'))
+            self.assertTrue(await communicator.receive_nothing())
+        finally:
+            await self._disconnect(communicator)
+        # Watching a stream's status does not keep its encoder awake
+        self.activity.hold.assert_not_called()
+
+    async def test_unsubscribe_stops_a_streams_updates(self):
+        communicator = await self._connect(f'?stream_id={FIRST}&stream_id={SECOND}')
+        try:
+            await communicator.send_json_to({'unsubscribe': [FIRST]})
+            await asyncio.sleep(0.05)
+
+            await self._publish((FIRST, 'connected'), (SECOND, 'failed', 'boom'))
+
+            self.assertEqual(await communicator.receive_json_from(), self._update(SECOND, 'failed', 'boom'))
+            self.assertTrue(await communicator.receive_nothing())
+        finally:
+            await self._disconnect(communicator)
+
+    async def test_unfiltered_connection_gets_batches_and_can_subscribe(self):
+        communicator = await self._connect()
+        try:
+            await self._publish((FIRST, 'starting'), (SECOND, 'connected'))
+            self.assertEqual(await communicator.receive_json_from(), {
+                'updates': [self._update(FIRST, 'starting'), self._update(SECOND, 'connected')],
+            })
+
+            await communicator.send_json_to({'subscribe': [FIRST, 'not-a-uuid'], 'unsubscribe': ['*']})
+            await asyncio.sleep(0.05)
+
+            await self._publish((FIRST, 'connected'), (SECOND, 'failed'))
+            self.assertEqual(await communicator.receive_json_from(), self._update(FIRST, 'connected'))
+            self.assertTrue(await communicator.receive_nothing())
+        finally:
+            await self._disconnect(communicator)
+
+    async def test_invalid_messages_are_ignored(self):
+        communicator = await self._connect(f'?stream_id={FIRST}')
+        try:
+            await communicator.send_to(text_data='not json')
+            await communicator.send_json_to(['subscribe'])
+            await communicator.send_json_to({'subscribe': FIRST})
+            self.assertTrue(await communicator.receive_nothing())
+
+            await self._publish((FIRST, 'connected'))
+            self.assertEqual(await communicator.receive_json_from(), self._update(FIRST, 'connected'))
+        finally:
+            await self._disconnect(communicator)
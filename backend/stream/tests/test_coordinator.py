@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import subprocess
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from stream import probe
+from stream.coordinator import CoordinatorClient
+from stream.models import Stream
+from stream.supervisor import SocketSupervisorClient, SupervisorError
+
+# Writes a playlist and a segment like ffmpeg's HLS muxer, then idles until
+# stopped or until its node goes away
+FAKE_FFMPEG = '''#!{python}
+import os, sys, time
+parent = os.getppid()
+playlist = next(arg for arg in sys.argv if arg.endswith('.m3u8'))
+with open('000.ts', 'wb') as f:
+    f.write(b'G' * 188 * 100)
+with open(playlist, 'w') as f:
+    f.write('#EXTM3U\\n#EXTINF:2.0,\\n000.ts\\n')
+while os.getppid() == parent:
+    time.sleep(0.2)
+'''
+
+# Runs stream_supervisor against the test database and a scratch MEDIA_ROOT
+NODE = '''
+import os, sys
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsp_viewer.settings')
+database, media, address = sys.argv[1:]
+settings.DATABASES['default']['NAME'] = database
+settings.MEDIA_ROOT = media
+django.setup()
+call_command('stream_supervisor', '--address', address)
+'''
+
+REACHABLE = probe._result('', True)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@override_settings(STREAM_NODE_CHECK_INTERVAL=0.2, STREAM_NODE_FAILURE_LIMIT=2)
+class CoordinatorTests(TransactionTestCase):
+    """Placement, failover and reconciliation over two real ``stream_supervisor`` processes."""
+
+    @classmethod
+    def setUpClass(cls):
+        # The nodes must share the database with the test, which an in-memory
+        # test database cannot do: switch to a scratch file for this class
+        cls.database_dir = tempfile.mkdtemp()
+        cls.memory_database = (connection.settings_dict['NAME'], connection.connection)
+        connection.connection = None
+        connection.settings_dict['NAME'] = os.path.join(cls.database_dir, 'db.sqlite3')
+        call_command('migrate', verbosity=0, interactive=False)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connection.close()
+        connection.settings_dict['NAME'], connection.connection = cls.memory_database
+        shutil.rmtree(cls.database_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.scratch, 'bin')
+        os.makedirs(bin_dir)
+        ffmpeg = os.path.join(bin_dir, 'ffmpeg')
+        with open(ffmpeg, 'w') as f:
+            f.write(FAKE_FFMPEG.format(python=sys.executable))
+        os.chmod(ffmpeg, 0o755)
+        env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+                   LOG_DIR=os.path.join(self.scratch, 'logs'), ENCODER_CPU_BUDGET='4')
+        env.pop('STREAM_NODES', None)
+        self.nodes = {}
+        for _ in range(2):
+            address = f'127.0.0.1:{_free_port()}'
+            self.nodes[address] = subprocess.Popen(
+                [sys.executable, '-c', NODE, str(connection.settings_dict['NAME']),
+                 os.path.join(self.scratch, 'media'), address],
+                cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for address in self.nodes:
+            self.assertTrue(_wait(lambda: self._answers(address)), f'Node {address} did not start')
+        self.coordinator = CoordinatorClient(list(self.nodes))
+        patcher = mock.patch.object(probe, 'probe_url', return_value=REACHABLE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.coordinator.close()
+        for process in self.nodes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in self.nodes.values():
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def _answers(self, address):
+        try:
+            SocketSupervisorClient(address, timeout=1).capacity()
+            return True
+        except SupervisorError:
+            return False
+
+    def _start(self, count):
+        stream_ids = []
+        for index in range(count):
+            result = self.coordinator.acquire(f'rtsp://camera-{index}.test/live', 'transcode')
+            self.coordinator.launch(result['stream_id'])
+            stream_ids.append(result['stream_id'])
+        # Nodes write their rows in the background
+        self.assertTrue(_wait(lambda: Stream.objects.filter(id__in=stream_ids).exclude(node='').count() == count))
+        return stream_ids
+
+    def _placement(self):
+        return {stream['stream_id']: stream['node'] for stream in self.coordinator.list(brief=True)}
+
+    def test_streams_spread_and_move_off_a_dead_node(self):
+        stream_ids = self._start(4)
+        placement = self._placement()
+        self.assertEqual(set(placement), set(stream_ids))
+        self.assertEqual(sorted(list(placement.values()).count(address) for address in self.nodes), [2, 2])
+
+        dead, survivor = list(self.nodes)
+        self.nodes[dead].kill()
+        self.nodes[dead].wait()
+        moved = _wait(lambda: set(Stream.objects.values_list('node', flat=True)) == {survivor}
+                      and set(self._placement()) == set(stream_ids))
+
+        self.assertTrue(moved, f'Streams did not move: {self._placement()}')
+        self.assertEqual(set(self._placement().values()), {survivor})
+        self.assertFalse(self.coordinator.capacity()['nodes'][0]['healthy'])
+        # Moved streams keep their IDs and answer on the survivor
+        for stream_id in stream_ids:
+            self.assertEqual(self.coordinator.status(stream_id)['node'], survivor)
+
+    def test_returning_node_stops_streams_that_moved_away(self):
+        stream_ids = self._start(4)
+        placement = self._placement()
+        stream_id = stream_ids[0]
+        returning = self.coordinator.nodes[list(self.nodes).index(placement[stream_id])]
+        other = next(address for address in self.nodes if address != returning.address)
+        kept = [stream for stream in stream_ids if placement[stream] == returning.address and stream != stream_id]
+        # As if the stream had been moved to the other node while this one was away
+        Stream.objects.filter(id=stream_id).update(node=other)
+
+        self.coordinator.reconcile(returning)
+
+        self.assertIsNone(returning.client.status(stream_id))
+        self.assertTrue(Stream.objects.filter(id=stream_id, node=other).exists())
+        for stream in kept:
+            self.assertIsNotNone(returning.client.status(stream))
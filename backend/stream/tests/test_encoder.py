@@ -0,0 +1,118 @@
+import json
+
+from django.test import SimpleTestCase, override_settings
+
+from stream import encoder
+
+URL = 'rtsp://camera.test/live'
+
+
+def _probe(codec='h264', pix_fmt='yuv420p'):
+    return json.dumps({'streams': [{
+        'codec_name': codec, 'profile': 'Main', 'pix_fmt': pix_fmt,
+        'width': 1920, 'height': 1080, 'avg_frame_rate': '25/1',
+    }]})
+
+
+def _option(cmd, name):
+    return cmd[cmd.index(name) + 1]
+
+
+def _options(cmd, name):
+    return [cmd[i + 1] for i, arg in enumerate(cmd) if arg == name]
+
+
+class ProbeTests(SimpleTestCase):
+    def test_parse_probe(self):
+        self.assertEqual(encoder.parse_probe(_probe()), {
+            'codec': 'h264', 'profile': 'Main', 'pix_fmt': 'yuv420p', 'width': 1920, 'height': 1080, 'fps': 25,
+        })
+
+    def test_malformed_or_empty_output_has_no_video(self):
+        for output in ('{"streams": [', 'not json', '', None, '{"streams": []}', '{}'):
+            self.assertIsNone(encoder.parse_probe(output), output)
+
+    def test_url_is_an_input_not_an_option(self):
+        cmd = encoder.probe_command(URL)
+        self.assertEqual(cmd[-2:], ['-i', URL])
+
+
+class RemuxTests(SimpleTestCase):
+    def test_h264_yuv420p_is_copied(self):
+        video = encoder.parse_probe(_probe())
+        self.assertTrue(encoder.can_copy(video))
+
+        cmd, video_mode = encoder.build_hls_command(URL, 'remux', video)
+
+        self.assertEqual(video_mode, 'copy')
+        self.assertEqual(_option(cmd, '-c:v'), 'copy')
+        self.assertNotIn('-s', cmd)
+
+    def test_incompatible_video_is_transcoded(self):
+        for codec, pix_fmt in (('hevc', 'yuv420p'), ('h264', 'yuv422p')):
+            video = encoder.parse_probe(_probe(codec, pix_fmt))
+            self.assertFalse(encoder.can_copy(video))
+
+            cmd, video_mode = encoder.build_hls_command(URL, 'remux', video)
+
+            self.assertEqual(video_mode, 'transcode', codec)
+            self.assertEqual(_option(cmd, '-c:v'), 'libx264')
+
+    def test_unprobed_camera_is_transcoded(self):
+        self.assertFalse(encoder.can_copy(None))
+        self.assertEqual(encoder.build_hls_command(URL, 'remux', None)[1], 'transcode')
+
+    def test_transcode_profile_never_copies(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'transcode', encoder.parse_probe(_probe()))
+        self.assertEqual(video_mode, 'transcode')
+        self.assertEqual(_option(cmd, '-i'), URL)
+
+
+@override_settings(HLS_RENDITIONS=[
+    {'name': 'low', 'width': 426, 'height': 240, 'bitrate': 300},
+    {'name': 'mid', 'width': 640, 'height': 360, 'bitrate': 500},
+    {'name': 'high', 'width': 1280, 'height': 720, 'bitrate': 2000},
+])
+class AbrTests(SimpleTestCase):
+    def test_one_encode_per_rendition(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'abr')
+
+        self.assertEqual(video_mode, 'abr')
+        self.assertEqual(_option(cmd, '-filter_complex'),
+                         '[0:v]split=3[v0][v1][v2];[v0]scale=426:240[v0out];'
+                         '[v1]scale=640:360[v1out];[v2]scale=1280:720[v2out]')
+        self.assertEqual(_options(cmd, '-map'), ['[v0out]', '[v1out]', '[v2out]'])
+        self.assertEqual([_option(cmd, f'-b:v:{i}') for i in range(3)], ['300k', '500k', '2000k'])
+        self.assertIn('-an', cmd)
+
+    def test_variants_are_named_in_map_order(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'abr')
+
+        self.assertEqual(_option(cmd, '-var_stream_map'), 'v:0,name:low v:1,name:mid v:2,name:high')
+        self.assertEqual(_option(cmd, '-hls_segment_filename'), '%v_%03d.ts')
+        self.assertEqual(cmd[-1], 'index_%v.m3u8')
+
+    def test_master_playlist_takes_the_stream_playlist_name(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'abr')
+        self.assertEqual(_option(cmd, '-master_pl_name'), 'index.m3u8')
+
+    def test_pushed_master_playlist_stays_relative(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'abr', push_url='http://store.test/id/')
+
+        self.assertEqual(_option(cmd, '-master_pl_name'), 'index.m3u8')
+        self.assertEqual(_option(cmd, '-hls_segment_filename'), 'http://store.test/id/%v_%03d.ts')
+        self.assertEqual(cmd[-1], 'http://store.test/id/index_%v.m3u8')
+
+
+class KeyframeTests(SimpleTestCase):
+    def test_transcoded_stream_writes_its_keyframe(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'transcode', keyframe_image='keyframe.jpg')
+        self.assertEqual(video_mode, 'transcode')
+        self.assertEqual(cmd[-1], 'keyframe.jpg')
+
+    def test_copied_stream_is_not_decoded_for_its_keyframe(self):
+        cmd, video_mode = encoder.build_hls_command(URL, 'remux', encoder.parse_probe(_probe()),
+                                                    keyframe_image='keyframe.jpg')
+        self.assertEqual(video_mode, 'copy')
+        self.assertNotIn('keyframe.jpg', cmd)
+        self.assertNotIn('-vf', cmd)
@@ -0,0 +1,137 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, override_settings
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeConnection
+
+from stream import events
+
+
+def redis_layers(server):
+    """CHANNEL_LAYERS for the Redis pub/sub layer on a fakeredis ``server``."""
+    return {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {'hosts': [{'connection_class': FakeConnection, 'server': server}]},
+        }
+    }
+
+
+async def close_layer():
+    """Close the channel layer's connections once the receives cancelled so far have unsubscribed.
+
+    Their unsubscribe replies must be read first: a cancellation landing
+    while the receiver wakes up for one is lost and the flush waits forever.
+    """
+    await asyncio.sleep(0.3)
+    await get_channel_layer().flush()
+
+
+def reset_events():
+    with events._pending_lock:
+        events._pending.clear()
+        events._flush_scheduled = False
+    events.bind_consumer_loop(None)
+
+
+class Inbox:
+    """Collects what arrives on a new channel in ``groups``.
+
+    A single receive is kept waiting for the whole test: the pub/sub layer
+    unsubscribes a channel whose receive gets cancelled.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.messages = []
+
+    async def open(self, *groups):
+        self.channel = await self.layer.new_channel()
+        for group in groups:
+            await self.layer.group_add(group, self.channel)
+        self.task = asyncio.ensure_future(self._collect())
+        return self
+
+    async def _collect(self):
+        while True:
+            self.messages.append(await self.layer.receive(self.channel))
+
+    async def wait(self, count, timeout=1):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while len(self.messages) < count and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        return self.messages
+
+
+class EventsTests(SimpleTestCase):
+    def setUp(self):
+        reset_events()
+        layers = override_settings(CHANNEL_LAYERS=redis_layers(FakeServer()))
+        layers.enable()
+        self.addCleanup(layers.disable)
+
+    async def _inboxes(self, *groups):
+        layer = get_channel_layer()
+        return [await Inbox(layer).open(group) for group in groups]
+
+    async def _close(self, inboxes):
+        for inbox in inboxes:
+            inbox.task.cancel()
+        await asyncio.gather(*[inbox.task for inbox in inboxes], return_exceptions=True)
+        await close_layer()
+
+    async def test_updates_fan_out_to_their_stream_group_and_the_batch_group(self):
+        inboxes = await self._inboxes(events.stream_group('a'), events.stream_group('b'), events.STREAMS_GROUP)
+        first, second, everything = inboxes
+        try:
+            await events.publish('a', 'connected')
+            await events.publish('b', 'failed', 'boom')
+            await events.flush()
+
+            self.assertEqual(await first.wait(1), [events._message('a', 'connected')])
+            self.assertEqual(await second.wait(1), [events._message('b', 'failed', 'boom')])
+            self.assertEqual(await everything.wait(1), [{
+                'type': 'stream_batch',
+                'updates': [events._message('a', 'connected'), events._message('b', 'failed', 'boom')],
+            }])
+            # Each stream group only gets its own stream's update
+            await asyncio.sleep(0.1)
+            self.assertEqual(len(first.messages), 1)
+            self.assertEqual(len(second.messages), 1)
+        finally:
+            await self._close(inboxes)
+
+    async def test_changes_within_the_batch_interval_are_coalesced(self):
+        inboxes = await self._inboxes(events.STREAMS_GROUP)
+        everything, = inboxes
+        motion = {'active': True, 'score': 0.4}
+        try:
+            await events.publish('a', 'starting')
+            await events.publish('b', 'starting')
+            await events.publish('a', 'connected', motion=motion)
+            await events.publish('a', 'connected')
+            # Nothing goes out before the batch interval has passed
+            await asyncio.sleep(events.BATCH_INTERVAL / 2)
+            self.assertEqual(everything.messages, [])
+
+            await everything.wait(1)
+            # Latest status per stream, in order of last change, keeping the motion state
+            self.assertEqual([message['updates'] for message in everything.messages], [[
+                events._message('b', 'starting'),
+                events._message('a', 'connected', motion=motion),
+            ]])
+            await asyncio.sleep(events.BATCH_INTERVAL * 2)
+            self.assertEqual(len(everything.messages), 1)
+            self.assertFalse(events._flush_scheduled)
+        finally:
+            await self._close(inboxes)
+
+    async def test_flush_without_pending_updates_sends_nothing(self):
+        inboxes = await self._inboxes(events.STREAMS_GROUP)
+        try:
+            await events.flush()
+            await asyncio.sleep(0.1)
+            self.assertEqual(inboxes[0].messages, [])
+        finally:
+            await self._close(inboxes)
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from stream import encoder, llhls
+
+PART = 1 / 3
+
+
+def _parts(first, last, duration=PART):
+    return [(part, duration) for part in range(first, last + 1)]
+
+
+class ReadPartsTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.stream_dir, ignore_errors=True)
+
+    def _write(self, text):
+        with open(os.path.join(self.stream_dir, encoder.LLHLS_PLAYLIST), 'w') as f:
+            f.write(text)
+
+    def test_parts_of_ffmpegs_playlist(self):
+        self._write('\n'.join([
+            '#EXTM3U',
+            '#EXT-X-MAP:URI="init.mp4"',
+            '#EXTINF:0.333333,',
+            'part7.m4s',
+            '#EXTINF:bad,',
+            'part8.m4s',
+            '#EXTINF:0.4,',
+            'other.m4s',
+            'part9.m4s',
+            '#EXTINF:0.3,',
+            'part10.m4s',
+        ]))
+        self.assertEqual(llhls.read_parts(self.stream_dir), [(7, 0.333333), (10, 0.3)])
+        self.assertEqual(llhls.last_part(self.stream_dir), 10)
+
+    def test_no_playlist_yet(self):
+        self.assertEqual(llhls.read_parts(self.stream_dir), [])
+        self.assertIsNone(llhls.last_part(self.stream_dir))
+
+
+class RenderPlaylistTests(SimpleTestCase):
+    def test_nothing_before_the_first_part(self):
+        self.assertIsNone(llhls.render_playlist([]))
+
+    def test_parts_are_grouped_into_segments(self):
+        # Six parts per segment: segments 0-4 complete, 5 in progress with parts 30 and 31
+        lines = llhls.render_playlist(_parts(0, 31)).splitlines()
+
+        self.assertEqual(lines[:7], [
+            '#EXTM3U',
+            '#EXT-X-VERSION:9',
+            '#EXT-X-TARGETDURATION:2',
+            '#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK=1.000',
+            '#EXT-X-PART-INF:PART-TARGET=0.333',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-MAP:URI="init.mp4"',
+        ])
+        self.assertEqual([line for line in lines if line.startswith('seg')],
+                         ['seg0.m4s', 'seg1.m4s', 'seg2.m4s', 'seg3.m4s', 'seg4.m4s'])
+        self.assertEqual(lines.count('#EXTINF:2.000,'), 5)
+        # Parts are listed for the two latest complete segments and the one in progress
+        listed = [line.split('URI="')[1].split('"')[0] for line in lines if line.startswith('#EXT-X-PART:')]
+        self.assertEqual(listed, [llhls.part_name(part) for part in range(18, 32)])
+        self.assertEqual(lines[-1], '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part32.m4s"')
+        # A segment's parts come before it
+        self.assertLess(lines.index('#EXT-X-PART:DURATION=0.333,URI="part23.m4s",INDEPENDENT=YES'),
+                        lines.index('seg3.m4s'))
+
+    def test_segment_completed_by_its_last_part(self):
+        lines = llhls.render_playlist(_parts(0, 11)).splitlines()
+        self.assertEqual([line for line in lines if line.startswith('seg')], ['seg0.m4s', 'seg1.m4s'])
+        self.assertEqual(lines[-1], '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part12.m4s"')
+
+    def test_segment_that_lost_parts_at_the_head_is_skipped(self):
+        lines = llhls.render_playlist(_parts(3, 17)).splitlines()
+        self.assertIn('#EXT-X-MEDIA-SEQUENCE:1', lines)
+        self.assertEqual([line for line in lines if line.startswith('seg')], ['seg1.m4s', 'seg2.m4s'])
+        self.assertNotIn('#EXT-X-PART:DURATION=0.333,URI="part3.m4s",INDEPENDENT=YES', lines)
+
+    def test_target_durations_follow_the_longest_part(self):
+        parts = _parts(0, 5) + [(6, 0.5)]
+        lines = llhls.render_playlist(parts).splitlines()
+        self.assertIn('#EXT-X-TARGETDURATION:3', lines)
+        self.assertIn('#EXT-X-PART-INF:PART-TARGET=0.500', lines)
+        self.assertIn('#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK=1.500', lines)
+
+
+class BlockingReloadTests(SimpleTestCase):
+    def test_blocking_target(self):
+        # A whole segment needs its last part, a part just itself
+        self.assertEqual(llhls.blocking_target(2), 17)
+        self.assertEqual(llhls.blocking_target(2, 0), 12)
+        self.assertEqual(llhls.blocking_target(2, 5), 17)
+
+    def test_segment_parts(self):
+        self.assertEqual(llhls.segment_parts(1), [f'part{part}.m4s' for part in range(6, 12)])
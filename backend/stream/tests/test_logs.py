@@ -0,0 +1,128 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from stream import logs
+
+
+def _record(msg='hello', lineno=1, created=1000.0, **extra):
+    record = logging.makeLogRecord({'name': 'stream.test', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                    'pathname': 'views.py', 'lineno': lineno, 'msg': msg, **extra})
+    record.created = created
+    return record
+
+
+class RateLimitFilterTests(SimpleTestCase):
+    def test_call_site_is_muted_for_the_rest_of_the_window(self):
+        limit = logs.RateLimitFilter(limit=2, window=10)
+
+        passed = [limit.filter(_record(created=1000 + i)) for i in range(5)]
+        # Another call site has its own budget
+        self.assertTrue(limit.filter(_record(lineno=2, created=1004)))
+
+        self.assertEqual(passed, [True, True, False, False, False])
+        record = _record('again', created=1010)
+        self.assertTrue(limit.filter(record))
+        self.assertEqual(record.getMessage(), 'again (3 similar messages suppressed)')
+
+    def test_zero_limit_lets_everything_through(self):
+        limit = logs.RateLimitFilter(limit=0, window=10)
+        self.assertTrue(all(limit.filter(_record()) for _ in range(100)))
+
+
+class DroppingQueueHandlerTests(SimpleTestCase):
+    def test_full_queue_drops_and_reports_how_many(self):
+        handler = logs.DroppingQueueHandler(queue.Queue(2))
+        for i in range(5):
+            handler.enqueue(_record(f'record {i}'))
+        self.assertEqual(handler.dropped, 3)
+
+        handler.queue.get_nowait()
+        handler.queue.get_nowait()
+        handler.enqueue(_record('after'))
+
+        self.assertEqual(handler.dropped, 0)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), 'after')
+        notice = handler.queue.get_nowait()
+        self.assertEqual(notice.levelno, logging.WARNING)
+        self.assertEqual(notice.getMessage(), 'Dropped 3 log records, the log queue was full')
+
+    def test_notice_waits_for_room(self):
+        handler = logs.DroppingQueueHandler(queue.Queue(1))
+        handler.enqueue(_record('first'))
+        handler.enqueue(_record('dropped'))
+        handler.queue.get_nowait()
+
+        handler.enqueue(_record('second'))
+
+        # No room left for the notice, the count is kept for the next record
+        self.assertEqual(handler.dropped, 1)
+
+
+class StreamStderrHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'streams')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.directory), ignore_errors=True)
+
+    def _handler(self, max_bytes=1000, backups=1, retention_hours=0):
+        handler = logs.StreamStderrHandler(self.directory, max_bytes, backups, retention_hours)
+        self.addCleanup(handler.close)
+        return handler
+
+    def _line(self, stream_id, msg='frame dropped'):
+        return _record(msg, stream_id=stream_id, pid=42)
+
+    def test_lines_go_to_the_streams_own_file(self):
+        handler = self._handler()
+        self.assertFalse(os.path.exists(self.directory))
+
+        handler.emit(self._line('a', 'from a'))
+        handler.emit(self._line('b', 'from b'))
+        handler.emit(_record('no stream'))
+        handler.flush()
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a.log', 'b.log'])
+        with open(os.path.join(self.directory, 'a.log')) as f:
+            content = f.read()
+        self.assertIn('[42] from a', content)
+        self.assertNotIn('from b', content)
+
+    def test_files_rotate_at_max_bytes(self):
+        handler = self._handler(max_bytes=200, backups=2)
+        for i in range(20):
+            handler.emit(self._line('a', f'line {i:02d} ' + 'x' * 40))
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a.log', 'a.log.1', 'a.log.2'])
+        for name in os.listdir(self.directory):
+            self.assertLessEqual(os.path.getsize(os.path.join(self.directory, name)), 200)
+
+    def test_least_recently_written_files_are_closed(self):
+        handler = self._handler()
+        with mock.patch.object(logs, 'STREAM_LOG_OPEN_FILES', 2):
+            for stream_id in ('a', 'b', 'a', 'c'):
+                handler.emit(self._line(stream_id))
+
+        self.assertEqual(list(handler._files), ['a', 'c'])
+
+    def test_logs_of_idle_streams_are_deleted(self):
+        handler = self._handler(retention_hours=1)
+        handler.emit(self._line('old'))
+        handler.emit(self._line('open'))
+        handler.close()
+        handler = self._handler(retention_hours=1)
+        handler.emit(self._line('open'))
+        stale = time.time() - 2 * 3600
+        for name in ('old.log', 'open.log'):
+            os.utime(os.path.join(self.directory, name), (stale, stale))
+        handler._pruned_at = 0
+
+        handler.emit(self._line('new'))
+
+        # 'open' is still being written to by this handler
+        self.assertEqual(sorted(os.listdir(self.directory)), ['new.log', 'open.log'])
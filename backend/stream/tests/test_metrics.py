@@ -0,0 +1,134 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from stream import metrics
+from stream.metrics import StreamMetrics, render_prometheus
+
+
+def _block(out_time_us, fps='15.00', bitrate='480.5kbits/s', speed='0.98x', drop='2', dup='1'):
+    return [
+        'frame=30', f'fps={fps}', f'bitrate={bitrate}', 'total_size=1024', f'out_time_us={out_time_us}',
+        'out_time=00:00:02.000000', f'dup_frames={dup}', f'drop_frames={drop}', f'speed={speed}',
+        'progress=continue',
+    ]
+
+
+class StreamMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.metrics = StreamMetrics()
+        self.clock = 100.0
+        patcher = mock.patch.object(metrics.time, 'monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _feed(self, lines):
+        return [self.metrics.feed(line) for line in lines]
+
+    def test_progress_block_becomes_a_sample(self):
+        self.assertEqual(self._feed(_block(2000000)), [True] * 10)
+        result = self.metrics.as_dict()
+        self.assertEqual(result['fps'], 15.0)
+        self.assertEqual(result['bitrate'], 480500.0)
+        self.assertEqual(result['speed'], 0.98)
+        self.assertEqual((result['drop_frames'], result['dup_frames']), (2, 1))
+        self.assertEqual(result['lag'], 0)
+
+    def test_log_lines_are_not_progress(self):
+        self.assertEqual(self._feed(['[hls @ 0x1] Opening \'000.ts\' for writing', 'Stream mapping:',
+                                     'Input #0, rtsp, from ...']), [False] * 3)
+        self.assertEqual(self.metrics.as_dict(), {'segment_interval': None})
+
+    def test_lag_is_wall_time_beyond_output_time_since_the_first_report(self):
+        self._feed(_block(5000000))
+        self.clock += 2
+        # Only 1.5 s of output in 2 s of wall time
+        self._feed(_block(6500000))
+        self.assertEqual(self.metrics.as_dict()['lag'], 0.5)
+
+    def test_unknown_values_before_output(self):
+        self._feed(_block('N/A', fps='0.00', bitrate='N/A', speed='N/A', drop='N/A', dup='0'))
+        result = self.metrics.as_dict()
+        self.assertEqual((result['bitrate'], result['speed'], result['lag'], result['drop_frames']),
+                         (None, None, None, 0))
+
+    def test_min_speed_and_history(self):
+        for speed in ('1.0x', '0.5x', '0.9x'):
+            self._feed(_block(1000000, speed=speed))
+        result = self.metrics.as_dict(history=True)
+        self.assertEqual((result['speed'], result['min_speed']), (0.9, 0.5))
+        self.assertEqual(len(result['history']), 3)
+        self.assertNotIn('history', self.metrics.as_dict())
+
+    def test_samples_are_capped(self):
+        for _ in range(metrics.SAMPLES + 10):
+            self._feed(_block(1000000))
+        self.assertEqual(len(self.metrics.samples), metrics.SAMPLES)
+
+    def test_segment_interval_times_segment_openings_not_playlists(self):
+        self.metrics.feed("[hls @ 0x1] Opening '/s/000.ts' for writing")
+        self.clock += 1
+        self.metrics.feed("[hls @ 0x1] Opening '/s/index.m3u8.tmp' for writing")
+        self.clock += 1
+        self.metrics.feed("[hls @ 0x1] Opening '/s/001.ts' for writing")
+        self.assertEqual(self.metrics.as_dict()['segment_interval'], 2)
+
+    def test_reset_starts_a_new_encoders_baselines(self):
+        self._feed(_block(5000000))
+        self.metrics.feed("Opening '000.ts' for writing")
+        self.metrics.reset()
+        self.clock += 10
+        self._feed(_block(0))
+        self.metrics.feed("Opening '000.ts' for writing")
+        result = self.metrics.as_dict()
+        self.assertEqual(result['lag'], 0)
+        # Kept from the previous encoder until the new one has written two segments
+        self.assertIsNone(result['segment_interval'])
+
+
+class RenderPrometheusTests(SimpleTestCase):
+    def _stream(self, **fields):
+        stream = {'stream_id': 'a', 'profile': 'transcode', 'status': 'connected', 'viewers': 2, 'restarts': 1,
+                  'encoder': {'cpu': 0.75}, 'metrics': {'fps': 15.0, 'drop_frames': 3, 'lag': None}}
+        stream.update(fields)
+        return stream
+
+    def test_stream_families(self):
+        text = render_prometheus([self._stream(), self._stream(stream_id='b', status='failed', encoder=None,
+                                                               metrics={})])
+        lines = text.splitlines()
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('# TYPE rtsp_stream_up gauge', lines)
+        self.assertIn('rtsp_stream_up{stream_id="a",profile="transcode"} 1', lines)
+        self.assertIn('rtsp_stream_up{stream_id="b",profile="transcode"} 0', lines)
+        self.assertIn('rtsp_stream_viewers{stream_id="a",profile="transcode"} 2', lines)
+        self.assertIn('# TYPE rtsp_stream_restarts_total counter', lines)
+        self.assertIn('rtsp_stream_cpu_cores{stream_id="a",profile="transcode"} 0.75', lines)
+        self.assertIn('rtsp_stream_fps{stream_id="a",profile="transcode"} 15.0', lines)
+        self.assertIn('rtsp_stream_dropped_frames_total{stream_id="a",profile="transcode"} 3', lines)
+        # Unknown values are left out rather than reported as zero
+        self.assertFalse(any(line.startswith('rtsp_stream_lag_seconds{') for line in lines))
+        self.assertFalse(any(line.startswith('rtsp_stream_cpu_cores{stream_id="b"') for line in lines))
+        self.assertNotIn('rtsp_encoder_cpu_budget_cores', text)
+
+    def test_labels_are_escaped(self):
+        text = render_prometheus([self._stream(stream_id='a"b\\c\nd')])
+        self.assertIn('rtsp_stream_up{stream_id="a\\"b\\\\c\\nd",profile="transcode"} 1', text.splitlines())
+
+    def test_capacity_and_nodes(self):
+        capacity = {'budget': 8.0, 'used': 2.5, 'queued': 1, 'nodes': [
+            {'address': '10.0.0.1:8765', 'healthy': True, 'load': 0.25, 'running': 2},
+            {'address': '10.0.0.2:8765', 'healthy': False, 'load': None, 'running': None},
+        ]}
+        lines = render_prometheus([], capacity).splitlines()
+        self.assertIn('rtsp_encoder_cpu_budget_cores 8.0', lines)
+        self.assertIn('rtsp_encoder_cpu_used_cores 2.5', lines)
+        self.assertIn('rtsp_encoder_queued 1', lines)
+        self.assertIn('rtsp_node_up{node="10.0.0.1:8765"} 1', lines)
+        self.assertIn('rtsp_node_up{node="10.0.0.2:8765"} 0', lines)
+        self.assertIn('rtsp_node_load{node="10.0.0.1:8765"} 0.25', lines)
+        self.assertFalse(any(line.startswith('rtsp_node_load{node="10.0.0.2') for line in lines))
+
+    def test_single_node_capacity_has_no_node_gauges(self):
+        text = render_prometheus([], {'budget': 4.0, 'used': 0, 'queued': 0})
+        self.assertNotIn('rtsp_node_up', text)
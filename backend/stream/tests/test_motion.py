@@ -0,0 +1,82 @@
+import os
+import asyncio
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from stream import motion
+from stream.motion import MotionDetector
+
+
+def _frame(value, changed=1.0):
+    """A 16x8 gray frame, ``changed`` of it at ``value`` and the rest black."""
+    frame = np.zeros(16 * 8, dtype=np.uint8)
+    frame[:int(frame.size * changed)] = value
+    return frame
+
+
+class ScoreTests(SimpleTestCase):
+    def test_fraction_of_changed_pixels(self):
+        self.assertEqual(motion.score(_frame(0), _frame(0)), 0.0)
+        self.assertEqual(motion.score(_frame(0), _frame(255)), 1.0)
+        self.assertEqual(motion.score(_frame(0), _frame(200, changed=0.25)), 0.25)
+
+    def test_noise_below_the_pixel_delta_is_ignored(self):
+        self.assertEqual(motion.score(_frame(100), _frame(100 + motion.PIXEL_DELTA)), 0.0)
+        self.assertEqual(motion.score(_frame(100), _frame(100 - motion.PIXEL_DELTA - 1)), 1.0)
+        # No wrap-around on uint8
+        self.assertEqual(motion.score(_frame(250), _frame(5)), 1.0)
+
+
+@override_settings(MOTION_SAMPLE_FPS=2)
+class MotionDetectorTests(SimpleTestCase):
+    def test_activity_needs_consecutive_scores_above_the_threshold(self):
+        detector = MotionDetector(0.1)
+        self.assertIsNone(detector.feed(0.5))
+        self.assertIsNone(detector.feed(0.05))
+        self.assertIsNone(detector.feed(0.5))
+        self.assertEqual(detector.feed(0.3), 'start')
+        self.assertTrue(detector.active)
+        self.assertEqual((detector.events, detector.peak), (1, 0.3))
+        self.assertIsNone(detector.feed(0.9))
+        self.assertEqual(detector.peak, 0.9)
+
+    def test_activity_ends_after_quiet_seconds(self):
+        detector = MotionDetector(0.1)
+        detector.feed(0.5)
+        detector.feed(0.5)
+        quiet = motion.END_AFTER_SECONDS * 2
+        self.assertEqual([detector.feed(0.0) for _ in range(quiet - 1)], [None] * (quiet - 1))
+        # One busy sample resets the count
+        detector.feed(0.5)
+        self.assertEqual([detector.feed(0.0) for _ in range(quiet)], [None] * (quiet - 1) + ['end'])
+        self.assertFalse(detector.active)
+        self.assertEqual(detector.as_dict(), {
+            'threshold': 0.1, 'active': False, 'score': 0.0, 'peak': 0.5, 'events': 1, 'dropped_frames': 0,
+        })
+
+
+@override_settings(MOTION_WIDTH=16, MOTION_HEIGHT=8, MOTION_WORKERS=1)
+class AnalyseTests(SimpleTestCase):
+    async def test_frames_from_the_pipe_drive_the_detector(self):
+        read_fd, write_fd = os.pipe()
+        detector = MotionDetector(0.5)
+        changes = []
+
+        async def on_change(state):
+            changes.append(state.active)
+
+        task = asyncio.ensure_future(motion.analyse(read_fd, detector, on_change))
+        # Still, then moving on every frame, paced so each is scored before the next
+        for value in [0, 0, 0] + [255, 0] * 3:
+            os.write(write_fd, _frame(value).tobytes())
+            await asyncio.sleep(0.05)
+        # A torn last frame ends the analysis with the pipe
+        os.write(write_fd, b'\0' * 10)
+        os.close(write_fd)
+        await asyncio.wait_for(task, 5)
+
+        self.assertEqual(detector.events, 1)
+        self.assertTrue(detector.active)
+        self.assertEqual(changes[0], True)
+        self.assertEqual(detector.score, 1.0)
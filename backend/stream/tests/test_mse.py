@@ -0,0 +1,126 @@
+import struct
+import asyncio
+import threading
+
+from django.test import SimpleTestCase
+
+from stream import mse
+from stream.mse import FragmentHub, Subscriber
+
+
+def _box(box_type, body=b''):
+    return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+
+def _reader(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def _drain(subscriber):
+    items = []
+    while not subscriber._queue.empty():
+        items.append(subscriber._queue.get_nowait())
+    return items
+
+
+class SubscriberTests(SimpleTestCase):
+    async def test_slow_subscriber_drops_its_backlog_for_the_live_edge(self):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        for i in range(mse.SUBSCRIBER_BACKLOG):
+            subscriber.push(b'%d' % i)
+        self.assertEqual(subscriber.dropped, 0)
+
+        subscriber.push(b'live')
+
+        self.assertEqual(subscriber.dropped, mse.SUBSCRIBER_BACKLOG)
+        self.assertEqual(await subscriber.get(), b'live')
+
+    async def test_end_of_stream_is_never_dropped_or_dropping(self):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        for i in range(mse.SUBSCRIBER_BACKLOG):
+            subscriber.push(b'%d' % i)
+        subscriber.push(None)
+        self.assertEqual(subscriber.dropped, 0)
+        self.assertEqual(_drain(subscriber)[-1], None)
+
+    async def test_push_from_another_thread_lands_on_the_subscribers_loop(self):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        thread = threading.Thread(target=lambda: [subscriber.push(data) for data in (b'a', b'b', None)])
+        thread.start()
+        received = [await asyncio.wait_for(subscriber.get(), 1) for _ in range(3)]
+        thread.join()
+        self.assertEqual(received, [b'a', b'b', None])
+
+
+class FragmentHubTests(SimpleTestCase):
+    async def test_late_joiner_starts_from_the_init_segment_and_latest_fragment(self):
+        hub = FragmentHub()
+        loop = asyncio.get_running_loop()
+        early = hub.subscribe(loop)
+        hub.publish_init(b'init')
+        hub.publish(b'gop1')
+        hub.publish(b'gop2')
+
+        late = hub.subscribe(loop)
+
+        self.assertEqual(_drain(early), [b'init', b'gop1', b'gop2'])
+        self.assertEqual(_drain(late), [b'init', b'gop2'])
+        self.assertTrue(hub.ready.is_set())
+
+    async def test_new_init_segment_forgets_the_old_fragment(self):
+        hub = FragmentHub()
+        hub.publish_init(b'init')
+        hub.publish(b'gop1')
+        hub.publish_init(b'init2')
+        self.assertEqual(_drain(hub.subscribe(asyncio.get_running_loop())), [b'init2'])
+
+    async def test_reset_unsubscribe_and_close(self):
+        hub = FragmentHub()
+        loop = asyncio.get_running_loop()
+        hub.publish_init(b'init')
+        hub.reset()
+        self.assertFalse(hub.ready.is_set())
+        gone = hub.subscribe(loop)
+        staying = hub.subscribe(loop)
+        self.assertEqual(_drain(staying), [])
+        hub.unsubscribe(gone)
+
+        hub.publish(b'gop')
+        hub.close()
+
+        self.assertEqual(_drain(gone), [])
+        self.assertEqual(_drain(staying), [b'gop', None])
+        self.assertEqual(_drain(hub.subscribe(loop)), [None])
+
+    async def test_pump_splits_init_segment_and_fragments(self):
+        hub = FragmentHub()
+        subscriber = hub.subscribe(asyncio.get_running_loop())
+        ftyp, moov = _box(b'ftyp', b'isom'), _box(b'moov', b'M' * 20)
+        fragments = [_box(b'moof', b'F%d' % i) + _box(b'mdat', b'D' * 100) for i in range(2)]
+
+        await mse.pump_fragments(_reader(ftyp + moov + b''.join(fragments)), hub)
+
+        self.assertEqual(_drain(subscriber), [ftyp + moov] + fragments)
+        self.assertEqual(hub.init_segment, ftyp + moov)
+
+
+class ReadBoxesTests(SimpleTestCase):
+    async def _boxes(self, data):
+        return [box async for box in mse.read_boxes(_reader(data))]
+
+    async def test_box_sizes(self):
+        large = struct.pack('>I4sQ', 1, b'mdat', 16 + 4) + b'DATA'
+        rest = struct.pack('>I4s', 0, b'free') + b'tail'
+        self.assertEqual(await self._boxes(_box(b'moof', b'x') + large + rest),
+                         [(b'moof', _box(b'moof', b'x')), (b'mdat', large), (b'free', rest)])
+
+    async def test_truncated_box_ends_the_stream(self):
+        self.assertEqual(await self._boxes(_box(b'moof', b'x') + _box(b'mdat', b'DATA')[:10]),
+                         [(b'moof', _box(b'moof', b'x'))])
+
+    async def test_corrupt_header_raises(self):
+        with self.assertRaises(ValueError):
+            await self._boxes(struct.pack('>I4s', 4, b'moof'))
@@ -0,0 +1,93 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from stream import probe
+
+# Counts its runs in $PROBE_RUNS and fails for hosts named "down"
+FAKE_FFPROBE = '''#!{python}
+import os, sys, time
+with open(os.environ['PROBE_RUNS'], 'a') as f:
+    f.write(sys.argv[-1] + '\\n')
+time.sleep(0.3)
+if '//down' in sys.argv[-1]:
+    sys.stderr.write('Connection refused\\n')
+    sys.exit(1)
+print('{{"streams": [{{"codec_name": "h264", "pix_fmt": "yuv420p", "width": 640, "height": 360}}]}}')
+'''
+URL = 'rtsp://camera.test/live'
+DOWN = 'rtsp://down.test/live'
+
+
+class ProbeCacheTests(SimpleTestCase):
+    def setUp(self):
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch, ignore_errors=True)
+        ffprobe = os.path.join(scratch, 'ffprobe')
+        with open(ffprobe, 'w') as f:
+            f.write(FAKE_FFPROBE.format(python=sys.executable))
+        os.chmod(ffprobe, 0o755)
+        self.runs = os.path.join(scratch, 'runs')
+        patcher = mock.patch.dict(os.environ, {'PATH': f"{scratch}{os.pathsep}{os.environ['PATH']}",
+                                               'PROBE_RUNS': self.runs})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        probe._cache.clear()
+        self.addCleanup(probe._cache.clear)
+        self.now = 1000.0
+        patcher = mock.patch.object(probe.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _runs(self):
+        try:
+            with open(self.runs) as f:
+                return f.read().split()
+        except FileNotFoundError:
+            return []
+
+    def test_concurrent_probes_share_one_ffprobe(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(probe.probe_url(URL))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self._runs(), [URL])
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(result['reachable'] for result in results))
+        self.assertEqual(results[0]['video']['codec'], 'h264')
+
+    def test_success_is_cached_for_the_ttl(self):
+        first = probe.probe_url(URL)
+        self.now += probe.PROBE_CACHE_TTL - 1
+        # Another spelling of the same camera
+        self.assertIs(probe.probe_url('RTSP://Camera.test:554/live'), first)
+        self.assertEqual(len(self._runs()), 1)
+
+        self.now += 2
+        self.assertIsNone(probe.cached(URL))
+        self.assertIsNot(probe.probe_url(URL), first)
+        self.assertEqual(len(self._runs()), 2)
+
+    def test_failures_expire_sooner(self):
+        failed = probe.probe_url(DOWN)
+        self.assertFalse(failed['reachable'])
+        self.assertIn('Connection refused', failed['error'])
+        self.now += probe.PROBE_FAILURE_TTL - 1
+        self.assertIs(probe.probe_url(DOWN), failed)
+
+        self.now += 2
+        probe.probe_url(DOWN)
+        self.assertEqual(self._runs(), [DOWN, DOWN])
+
+    def test_refresh_skips_the_cache(self):
+        probe.probe_url(URL)
+        probe.probe_url(URL, refresh=True)
+        self.assertEqual(len(self._runs()), 2)
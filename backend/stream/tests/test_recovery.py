@@ -0,0 +1,55 @@
+import uuid
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from stream import recovery
+from stream.models import Stream
+
+
+class RecoverTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media, STREAM_NODES=[], STREAM_SUPERVISOR_ADDRESS='')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.supervisor = mock.Mock()
+        self.supervisor.list.return_value = []
+
+    def _row(self, status, node=''):
+        return Stream.objects.create(id=uuid.uuid4(), rtsp_url=f'rtsp://{status}.test/live', profile='transcode',
+                                     viewers=1, status=status, node=node)
+
+    def test_only_streams_that_were_running_are_restarted(self):
+        rows = {status: self._row(status) for status in recovery.RECOVERABLE_STATUSES}
+        failed = self._row('failed')
+        self._row('connected', node='127.0.0.1:8766')
+        running = self._row('connected')
+        self.supervisor.list.return_value = [{'stream_id': str(running.id)}]
+
+        with mock.patch.object(recovery, 'restart', return_value=True) as restart:
+            summary = recovery.recover(self.supervisor)
+
+        self.assertEqual(sorted(call.args[0].id for call in restart.call_args_list),
+                         sorted(row.id for row in rows.values()))
+        self.assertEqual(summary['streams'], len(rows))
+        self.assertEqual(summary['restarted'], len(rows))
+        # A failed stream keeps its row, for its viewers to release
+        self.assertTrue(Stream.objects.filter(id=failed.id).exists())
+
+    def test_long_failed_streams_are_deleted(self):
+        old = self._row('failed')
+        recent = self._row('failed')
+        other_node = self._row('failed', node='127.0.0.1:8766')
+        Stream.objects.filter(id__in=[old.id, other_node.id]).update(
+            updated_at=timezone.now() - timedelta(seconds=recovery.FAILED_RETENTION + 1))
+
+        summary = recovery.recover(self.supervisor)
+
+        self.assertEqual(summary['failed_removed'], 1)
+        self.assertEqual(set(Stream.objects.values_list('id', flat=True)), {recent.id, other_node.id})
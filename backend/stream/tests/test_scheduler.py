@@ -0,0 +1,113 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from stream import scheduler
+from stream.scheduler import Allocation, Scheduler, SchedulerSaturated, cost_key, with_threads
+
+CMD = ['ffmpeg', '-threads', '4', '-i', 'rtsp://cam/', '-c:v', 'libx264', 'index.m3u8']
+
+
+class SchedulerTests(SimpleTestCase):
+    def _scheduler(self, budget=2.0, queue_limit=2, cores=4):
+        sched = Scheduler(budget=budget, queue_limit=queue_limit, pin=True)
+        sched.cores = list(range(cores))
+        self.addCleanup(sched.close)
+        return sched
+
+    async def test_admits_within_the_budget_then_queues_then_refuses(self):
+        sched = self._scheduler()
+        first = sched.request('a', 'transcode', CMD)
+        second = sched.request('b', 'transcode', CMD)
+        self.assertIsInstance(first, Allocation)
+        self.assertIsInstance(second, Allocation)
+
+        queued = [sched.request(stream_id, 'transcode', CMD) for stream_id in ('c', 'd')]
+        self.assertTrue(all(isinstance(future, asyncio.Future) for future in queued))
+        with self.assertRaises(SchedulerSaturated):
+            sched.request('e', 'transcode', CMD)
+        self.assertEqual(sched.as_dict()['running'], 2)
+        self.assertEqual(sched.as_dict()['queued'], 2)
+
+        # Queued streams start in order as capacity frees up
+        sched.release('a')
+        self.assertTrue(queued[0].done())
+        self.assertFalse(queued[1].done())
+        self.assertIs(sched.allocation('c'), queued[0].result())
+        sched.release('b')
+        self.assertTrue(queued[1].done())
+
+    async def test_idle_node_admits_an_encoder_over_budget(self):
+        sched = self._scheduler(budget=1.0)
+        self.assertIsInstance(sched.request('a', 'abr', CMD), Allocation)
+        self.assertIsInstance(sched.request('b', 'transcode', CMD), asyncio.Future)
+
+    async def test_queue_keeps_its_order_even_when_a_cheaper_stream_fits(self):
+        sched = self._scheduler(budget=2.0)
+        sched.request('a', 'transcode', CMD)
+        waiting = sched.request('b', 'abr', CMD)
+        # 'remux' copying fits the core left, but must wait behind the queue
+        copy = sched.request('c', 'remux', ['ffmpeg', '-i', 'rtsp://cam/', '-c:v', 'copy', 'index.m3u8'])
+        self.assertIsInstance(waiting, asyncio.Future)
+        self.assertIsInstance(copy, asyncio.Future)
+
+        sched.release('a')
+        self.assertTrue(waiting.done())
+        self.assertFalse(copy.done())
+
+    async def test_releasing_a_queued_stream_cancels_its_wait(self):
+        sched = self._scheduler(budget=1.0)
+        sched.request('a', 'transcode', CMD)
+        future = sched.request('b', 'transcode', CMD)
+        sched.release('b')
+        self.assertTrue(future.cancelled())
+        self.assertEqual(sched.as_dict()['queued'], 0)
+        sched.release('a')
+        self.assertEqual(sched.as_dict()['running'], 0)
+
+    async def test_threads_and_cores_follow_the_headroom(self):
+        sched = self._scheduler(budget=4.0)
+        first = sched.request('a', 'transcode', CMD)
+        self.assertEqual((first.threads, first.cores), (4, [0, 1, 2, 3]))
+        second = sched.request('b', 'transcode', CMD)
+        self.assertEqual(second.threads, 3)
+        third = sched.request('c', 'transcode', CMD)
+        self.assertEqual(third.threads, 2)
+        # The least loaded cores, where the earlier encoders' charges are spread thinnest
+        self.assertEqual(len(third.cores), 2)
+        load = {core: 0.0 for core in range(4)}
+        for allocation in (first, second):
+            for core in allocation.cores:
+                load[core] += allocation.cost / len(allocation.cores)
+        self.assertEqual(sorted(third.cores), sorted(sorted(load, key=load.get)[:2]))
+
+    async def test_sample_measures_cost_and_admits_what_now_fits(self):
+        sched = self._scheduler(budget=2.0, queue_limit=1)
+        sched.request('a', 'abr', CMD)
+        sched.started('a', 1234)
+        waiting = sched.request('b', 'transcode', CMD)
+        clock = iter([100.0, 110.0])
+        cpu = iter([50.0, 55.0])
+        with mock.patch.object(scheduler.time, 'monotonic', side_effect=lambda: next(clock)), \
+                mock.patch.object(scheduler, 'cpu_seconds', side_effect=lambda pid: next(cpu)), \
+                mock.patch.object(scheduler, '_pin') as pin:
+            sched.sample()
+            self.assertFalse(waiting.done())
+            sched.sample()
+        # 5 CPU seconds in 10 s is half a core, which leaves room for the queued stream
+        self.assertEqual(sched.allocation('a').measured, 0.5)
+        self.assertTrue(waiting.done())
+        pin.assert_called_with(1234, sched.allocation('a').cores)
+
+
+class CommandTests(SimpleTestCase):
+    def test_with_threads_replaces_every_value(self):
+        cmd = ['ffmpeg', '-threads', '4', '-i', 'x', '-threads', '4', 'out']
+        self.assertEqual(with_threads(cmd, 2), ['ffmpeg', '-threads', '2', '-i', 'x', '-threads', '2', 'out'])
+        self.assertEqual(cmd[2], '4')
+
+    def test_cost_key(self):
+        self.assertEqual(cost_key('remux', ['-c:v', 'copy']), 'copy')
+        self.assertEqual(cost_key('remux', CMD), 'remux')
+        self.assertEqual(cost_key('transcode', ['-c:v', 'copy']), 'transcode')
@@ -0,0 +1,148 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from stream import encoder, runner, snapshot
+
+
+def _jpeg(width, height, color='white'):
+    return subprocess.run(
+        [encoder.ffmpeg_path(), '-v', 'error', '-f', 'lavfi', '-i', f'color=c={color}:s={width}x{height}',
+         '-frames:v', '1', '-f', 'image2', '-c:v', 'mjpeg', 'pipe:1'],
+        capture_output=True, check=True,
+    ).stdout
+
+
+def _gray(image, width, height):
+    raw = subprocess.run(
+        [encoder.ffmpeg_path(), '-v', 'error', '-f', 'image2pipe', '-c:v', 'mjpeg', '-i', 'pipe:0',
+         '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'],
+        input=image, capture_output=True, check=True,
+    ).stdout
+    return np.frombuffer(raw, np.uint8).reshape(height, width)
+
+
+@skipUnless(shutil.which(encoder.ffmpeg_path()), 'needs ffmpeg')
+class MosaicTests(SimpleTestCase):
+    def setUp(self):
+        snapshot._blank_tiles.clear()
+
+    def test_tiles_of_mixed_sizes_keep_their_cells(self):
+        # Snapshots are 640 wide while the blank tile is tile sized, and one camera is 4:3
+        images = {
+            'rtsp://cam/wide': _jpeg(640, 360),
+            'rtsp://cam/missing': None,
+            'rtsp://cam/wide2': _jpeg(640, 360),
+            'rtsp://cam/square': _jpeg(640, 480),
+        }
+
+        async def fake_snapshot(rtsp_url, refresh=False):
+            return snapshot._result(rtsp_url, images[rtsp_url], 'camera' if images[rtsp_url] else '')
+
+        with mock.patch.object(snapshot, 'snapshot', fake_snapshot):
+            image, results = runner.run(snapshot.mosaic(list(images), columns=2, tile_width=320))
+
+        self.assertIsNotNone(image)
+        self.assertEqual([result['image'] is None for result in results], [False, True, False, False])
+        gray = _gray(image, 640, 360)
+        cells = [[gray[row * 180:(row + 1) * 180, column * 320:(column + 1) * 320] for column in range(2)]
+                 for row in range(2)]
+        self.assertGreater(cells[0][0].mean(), 240)
+        # The blank tile is dark grey, not the black of a missing cell
+        self.assertTrue(20 < cells[0][1].mean() < 50)
+        self.assertGreater(cells[1][0].mean(), 240)
+        # 4:3 is pillarboxed into the 16:9 cell: white in the middle, black at the sides
+        square = cells[1][1]
+        self.assertGreater(square[:, 60:260].mean(), 240)
+        self.assertLess(square[:, :30].mean(), 20)
+        self.assertLess(square[:, -30:].mean(), 20)
+
+
+class StreamKeyframeTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.stream_dir, True)
+        self.path = os.path.join(self.stream_dir, encoder.KEYFRAME_IMAGE)
+        patcher = mock.patch.object(snapshot, '_run', side_effect=self._decode)
+        self.addCleanup(patcher.stop)
+        self.run_ffmpeg = patcher.start()
+
+    async def _decode(self, cmd):
+        return b'jpeg of ' + os.path.basename(cmd[cmd.index('-i') + 1]).encode(), ''
+
+    def _write(self, name, data, age=0):
+        path = os.path.join(self.stream_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_copied_stream_takes_its_keyframe_from_the_newest_segment(self):
+        self._write('segment_1.ts', b'', age=4)
+        self._write('segment_2.ts', b'')
+
+        image = runner.run(snapshot.stream_keyframe(self.stream_dir))
+
+        self.assertEqual(image, b'jpeg of segment_2.ts')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+    def test_fresh_keyframe_is_served_without_decoding(self):
+        self._write('segment_1.ts', b'')
+        self._write(encoder.KEYFRAME_IMAGE, b'current')
+
+        self.assertEqual(runner.run(snapshot.stream_keyframe(self.stream_dir)), b'current')
+        self.run_ffmpeg.assert_not_called()
+
+    def test_stale_keyframe_is_replaced(self):
+        self._write('segment_1.ts', b'')
+        self._write(encoder.KEYFRAME_IMAGE, b'stale', age=2 * snapshot.settings.SNAPSHOT_TTL)
+
+        self.assertEqual(runner.run(snapshot.stream_keyframe(self.stream_dir)), b'jpeg of segment_1.ts')
+
+    def test_stale_keyframe_is_kept_when_the_segment_does_not_decode(self):
+        self._write('segment_1.ts', b'')
+        self._write(encoder.KEYFRAME_IMAGE, b'stale', age=2 * snapshot.settings.SNAPSHOT_TTL)
+
+        async def fail(cmd):
+            return None, 'No frame decoded'
+        self.run_ffmpeg.side_effect = fail
+
+        with self.assertLogs('stream.snapshot', 'INFO'):
+            self.assertEqual(runner.run(snapshot.stream_keyframe(self.stream_dir)), b'stale')
+
+    def test_stream_without_segments_or_keyframe_has_none(self):
+        self.assertIsNone(runner.run(snapshot.stream_keyframe(self.stream_dir)))
+
+
+class GrabTests(SimpleTestCase):
+    def test_supervisor_is_looked_up_off_the_runner_loop(self):
+        def get_supervisor():
+            # As the first call does when it creates the local supervisor
+            runner.run(asyncio.sleep(0), timeout=1)
+            client = mock.Mock()
+            client.find.return_value = []
+            return client
+
+        async def camera(cmd):
+            return b'jpeg', ''
+
+        with mock.patch.object(snapshot, 'get_supervisor', side_effect=get_supervisor), \
+                mock.patch.object(snapshot, '_run', side_effect=camera):
+            result = runner.run(snapshot._grab('rtsp://cam/one'), timeout=5)
+
+        self.assertEqual(result['image'], b'jpeg')
+
+
+class MosaicCommandTests(SimpleTestCase):
+    def test_mosaic_command_keeps_one_filtergraph(self):
+        cmd = encoder.mosaic_command(2, 2, 320, 180)
+        self.assertLess(cmd.index('-reinit_filter'), cmd.index('-i'))
+        self.assertEqual(cmd[cmd.index('-reinit_filter') + 1], '0')
@@ -0,0 +1,93 @@
+from django.test import SimpleTestCase
+
+from stream import store
+from stream.store import SegmentStore
+
+
+class SegmentStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = SegmentStore(max_segments=3, max_bytes=1000)
+
+    def _names(self, stream_id):
+        return [name for name in (f'{i:03d}.ts' for i in range(10)) if self.store.get(stream_id, name)]
+
+    def test_each_stream_keeps_its_last_segments(self):
+        for i in range(5):
+            self.store.put('a', f'{i:03d}.ts', b'x' * 10)
+        self.store.put('b', '000.ts', b'y' * 10)
+
+        self.assertEqual(self._names('a'), ['002.ts', '003.ts', '004.ts'])
+        self.assertEqual(self._names('b'), ['000.ts'])
+        self.assertEqual(self.store.size, 40)
+
+    def test_byte_cap_evicts_the_oldest_segments_of_any_stream(self):
+        self.store.put('a', '000.ts', b'x' * 400)
+        self.store.put('b', '000.ts', b'y' * 400)
+        self.store.put('a', '001.ts', b'x' * 400)
+
+        self.assertEqual(self._names('a'), ['001.ts'])
+        self.assertEqual(self._names('b'), ['000.ts'])
+        self.assertEqual(self.store.size, 800)
+
+    def test_rewriting_a_segment_replaces_it(self):
+        self.store.put('a', '000.ts', b'x' * 10)
+        self.store.put('a', '000.ts', b'x' * 30)
+
+        self.assertEqual(self.store.get('a', '000.ts').data, b'x' * 30)
+        self.assertEqual(self.store.size, 30)
+        for i in range(1, 3):
+            self.store.put('a', f'{i:03d}.ts', b'x')
+        # Counted once in the ring
+        self.assertEqual(self._names('a'), ['000.ts', '001.ts', '002.ts'])
+
+    def test_playlists_do_not_count_against_the_caps(self):
+        for i in range(3):
+            self.store.put('a', f'{i:03d}.ts', b'x' * 300)
+        self.store.put('a', 'index.m3u8', b'#EXTM3U\n' * 200)
+
+        self.assertEqual(self._names('a'), ['000.ts', '001.ts', '002.ts'])
+        self.assertEqual(self.store.get('a', 'index.m3u8').content_type, 'application/vnd.apple.mpegurl')
+        self.assertEqual(self.store.size, 900)
+
+    def test_playlist_is_fresh_once_per_run(self):
+        self.assertTrue(self.store.put('a', 'index.m3u8', b'1', run='r1'))
+        self.assertFalse(self.store.put('a', 'index.m3u8', b'2', run='r1'))
+        # Other playlists never report freshness
+        self.assertFalse(self.store.put('a', 'stream_0.m3u8', b'1', run='r2'))
+        # A restarted encoder right after the last one, however soon
+        self.assertTrue(self.store.put('a', 'index.m3u8', b'3', run='r2'))
+        self.assertFalse(self.store.put('a', 'index.m3u8', b'4', run='r2'))
+        self.assertEqual(self.store.get('a', 'index.m3u8').data, b'4')
+
+    def test_drop_forgets_a_stream(self):
+        self.store.put('a', 'index.m3u8', b'1')
+        self.store.put('a', '000.ts', b'x' * 10)
+        self.store.put('b', '000.ts', b'y' * 10)
+
+        self.store.drop('a')
+
+        self.assertIsNone(self.store.get('a', 'index.m3u8'))
+        self.assertEqual(self._names('a'), [])
+        self.assertEqual(self._names('b'), ['000.ts'])
+        self.assertEqual(self.store.size, 10)
+        self.assertTrue(self.store.put('a', 'index.m3u8', b'1'))
+
+    def test_delete(self):
+        self.store.put('a', '000.ts', b'x' * 10)
+        self.store.put('a', 'index.m3u8', b'1')
+
+        self.store.delete('a', '000.ts')
+        self.store.delete('a', 'index.m3u8')
+        self.store.delete('a', 'missing.ts')
+
+        self.assertIsNone(self.store.get('a', '000.ts'))
+        self.assertIsNone(self.store.get('a', 'index.m3u8'))
+        self.assertEqual(self.store.size, 0)
+
+    def test_etag_follows_the_content(self):
+        self.store.put('a', '000.ts', b'one')
+        first = self.store.get('a', '000.ts').etag
+        self.store.put('a', '000.ts', b'two')
+        self.assertNotEqual(self.store.get('a', '000.ts').etag, first)
+        self.assertEqual(store.content_type_for('init.mp4'), 'video/mp4')
+        self.assertEqual(store.content_type_for('x.bin'), 'application/octet-stream')
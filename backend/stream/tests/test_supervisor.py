@@ -0,0 +1,165 @@
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from stream import events, runner, supervisor
+from stream.supervisor import SupervisedStream, Supervisor
+
+URL = 'rtsp://camera.test/live'
+# Appends its output URL (argv[2]) to the file argv[1], then exits on its
+# first run, as an encoder that died, and idles on the next
+FLAKY_ENCODER = '''
+import sys, time
+with open(sys.argv[1], 'a') as f:
+    f.write(sys.argv[2] + '\\n')
+if len(open(sys.argv[1]).read().split()) > 1:
+    time.sleep(60)
+'''
+PUSH_URL = 'http://127.0.0.1:8000/api/stream/store/id/'
+# Writes a playlist and dies on its first run (argv[1] marks it), idles on the next
+FILES_ENCODER = '''
+import os, sys, time
+if os.path.exists(sys.argv[1]):
+    time.sleep(60)
+open(sys.argv[1], 'w').close()
+with open('index.m3u8', 'w') as f:
+    f.write('#EXTM3U\\n')
+time.sleep(0.2)
+'''
+
+
+async def _state_after(stream, expected, timeout=5):
+    """The stream's state once it is ``expected``, or when ``timeout`` runs out."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while stream.state != expected and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.05)
+    return stream.state
+
+
+class SupervisorTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for patcher in (mock.patch('stream.supervisor.persistence'),
+                        mock.patch.object(events, 'publish', mock.AsyncMock())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.supervisor = Supervisor()
+
+    def _failed_stream(self):
+        """A registered stream whose encoder gave up, as ``_supervise`` leaves it."""
+        stream_id = runner.run(self.supervisor.acquire(URL, 'transcode'))['stream_id']
+        entry = self.supervisor.registry.get(stream_id)
+        stream_dir = self.supervisor._stream_dir(stream_id)
+        os.makedirs(stream_dir)
+        stream = SupervisedStream(entry, ['ffmpeg'], stream_dir, 'index.m3u8')
+        self.supervisor._streams[stream_id] = stream
+        runner.run(self.supervisor._fail(stream, 'Connection refused'))
+        return stream_id
+
+    def test_failed_stream_is_listed_until_replaced(self):
+        stream_id = self._failed_stream()
+        self.assertEqual([stream['status'] for stream in runner.run(self.supervisor.list())], ['failed'])
+
+        result = runner.run(self.supervisor.acquire(URL, 'transcode'))
+
+        self.assertTrue(result['created'])
+        self.assertNotEqual(result['stream_id'], stream_id)
+        self.assertEqual(runner.run(self.supervisor.list()), [])
+        self.assertIsNone(runner.run(self.supervisor.status(stream_id)))
+        self.assertEqual(runner.run(self.supervisor.status(result['stream_id']))['status'], 'starting')
+
+    def test_abandon_forgets_a_failed_stream(self):
+        stream_id = self._failed_stream()
+
+        runner.run(self.supervisor.abandon(stream_id, 'Connection refused'))
+
+        self.assertEqual(runner.run(self.supervisor.list()), [])
+        self.assertIsNone(runner.run(self.supervisor.status(stream_id)))
+        self.assertFalse(os.path.exists(self.supervisor._stream_dir(stream_id)))
+
+    def test_last_viewer_releasing_a_failed_stream_deletes_it(self):
+        stream_id = self._failed_stream()
+
+        result = runner.run(self.supervisor.release(stream_id))
+
+        self.assertEqual(result['status'], 'stopped')
+        supervisor.persistence.delete.assert_called_with(stream_id)
+        self.assertIsNone(self.supervisor.registry.get(stream_id))
+        self.assertEqual(runner.run(self.supervisor.list()), [])
+
+    def test_restarted_push_stream_waits_for_its_own_run(self):
+        stream_id = runner.run(self.supervisor.acquire(URL, 'transcode'))['stream_id']
+        entry = self.supervisor.registry.get(stream_id)
+        stream_dir = self.supervisor._stream_dir(stream_id)
+        os.makedirs(stream_dir)
+        runs = os.path.join(tempfile.mkdtemp(), 'runs')
+        self.addCleanup(shutil.rmtree, os.path.dirname(runs), ignore_errors=True)
+        stream = SupervisedStream(entry, [sys.executable, '-c', FLAKY_ENCODER, runs, f'{PUSH_URL}index.m3u8'],
+                                  stream_dir, 'index.m3u8', output='push')
+        stream.push_url = PUSH_URL
+        self.supervisor._streams[stream_id] = stream
+
+        async def scenario():
+            stream.process = await self.supervisor._spawn(stream)
+            first_run = stream.push_run
+            # Reported ready by the segment store for the run that is about to die
+            await self.supervisor.mark_ready(stream_id, first_run)
+            stream.task = asyncio.ensure_future(self.supervisor._supervise(stream))
+            while stream.restarts == 0 or stream.process.returncode is not None:
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.3)
+            # A late report from the dead run does not count either
+            self.assertFalse(await self.supervisor.mark_ready(stream_id, first_run))
+            restarted = stream.state
+            self.assertTrue(await self.supervisor.mark_ready(stream_id, stream.push_run))
+            ready = await _state_after(stream, 'connected')
+            await self.supervisor._stop(stream)
+            return first_run, restarted, ready
+
+        with mock.patch.object(supervisor, 'RESTART_BACKOFF_MIN', 0):
+            first_run, restarted, ready = runner.run(scenario())
+
+        self.assertEqual(restarted, 'restarting')
+        self.assertEqual(ready, 'connected')
+        with open(runs) as f:
+            urls = f.read().split()
+        self.assertEqual(urls, [f'{PUSH_URL}{first_run}/index.m3u8', f'{PUSH_URL}{stream.push_run}/index.m3u8'])
+
+    def test_restart_is_not_ready_on_the_old_runs_playlist(self):
+        stream_id = runner.run(self.supervisor.acquire(URL, 'transcode'))['stream_id']
+        entry = self.supervisor.registry.get(stream_id)
+        stream_dir = self.supervisor._stream_dir(stream_id)
+        os.makedirs(stream_dir)
+        ran = os.path.join(tempfile.mkdtemp(), 'ran')
+        self.addCleanup(shutil.rmtree, os.path.dirname(ran), ignore_errors=True)
+        stream = SupervisedStream(entry, [sys.executable, '-c', FILES_ENCODER, ran], stream_dir, 'index.m3u8')
+        self.supervisor._streams[stream_id] = stream
+
+        async def scenario():
+            stream.process = await self.supervisor._spawn(stream)
+            stream.task = asyncio.ensure_future(self.supervisor._supervise(stream))
+            while stream.restarts == 0 or stream.process.returncode is not None:
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.5)
+            restarted = stream.state
+            # The new run publishes its own playlist
+            with open(os.path.join(stream_dir, 'index.m3u8'), 'w') as f:
+                f.write('#EXTM3U\n')
+            ready = await _state_after(stream, 'connected')
+            await self.supervisor._stop(stream)
+            return restarted, ready
+
+        with mock.patch.object(supervisor, 'RESTART_BACKOFF_MIN', 0):
+            restarted, ready = runner.run(scenario())
+
+        self.assertEqual(restarted, 'restarting')
+        self.assertEqual(ready, 'connected')
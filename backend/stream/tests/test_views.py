@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework.response import Response
+
+from stream import encoder, events, runner
+from stream.store import segment_store
+from stream.supervisor import LocalSupervisorClient
+from stream.views import StopStreamView, StreamView
+
+# Connects slowly: publishes its playlist a second in, then keeps encoding
+SLOW_ENCODER = '''
+import time
+time.sleep(1)
+with open('index.m3u8', 'w') as f:
+    f.write('#EXTM3U\\n')
+time.sleep(60)
+'''
+
+
+@override_settings(SEGMENT_STORE_ENABLED=False)
+class StartViewTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.publish = mock.AsyncMock()
+        video = {'codec': 'h264', 'profile': 'Main', 'pix_fmt': 'yuv420p', 'width': 640, 'height': 360, 'fps': 25}
+        for patcher in (mock.patch('stream.supervisor.persistence'),
+                        mock.patch.object(events, 'publish', self.publish),
+                        mock.patch('stream.views.probe.probe_url',
+                                   return_value={'reachable': True, 'timed_out': False, 'error': '', 'video': video}),
+                        mock.patch.object(encoder, 'build_hls_command',
+                                          return_value=([sys.executable, '-c', SLOW_ENCODER], 'transcode'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch('stream.supervisor.atexit'):
+            self.streams = LocalSupervisorClient()
+        self.addCleanup(self.streams._shutdown)
+        patcher = mock.patch('stream.views.get_supervisor', return_value=self.streams)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _states(self):
+        return [call.args[1] for call in self.publish.call_args_list]
+
+    def test_start_answers_before_the_stream_is_ready(self):
+        started = time.monotonic()
+        response = self.client.post(reverse('stream-start'), {'rtsp_url': 'rtsp://camera.test/live'},
+                                    content_type='application/json')
+        answered = time.monotonic() - started
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'starting')
+        self.assertLess(answered, 1)
+        stream_id = response.json()['stream_id']
+        playlist = os.path.join(self.streams.supervisor._stream_dir(stream_id), 'index.m3u8')
+        self.assertFalse(os.path.exists(playlist))
+        self.assertNotIn('connected', self._states())
+
+        # Readiness reaches the viewer as an event once the playlist is out
+        deadline = time.monotonic() + 5
+        while 'connected' not in self._states() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIn('connected', self._states())
+        self.assertTrue(os.path.exists(playlist))
+        self.assertEqual(self.streams.status(stream_id)['status'], 'connected')
+
+
+class SegmentStoreViewTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_id = str(uuid.uuid4())
+        self.addCleanup(segment_store.drop, self.stream_id)
+        patcher = mock.patch('stream.views.get_supervisor')
+        self.supervisor = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    async def _put(self, run, name, data=b'#EXTM3U\n'):
+        url = reverse('stream-store-ingest', args=[self.stream_id, run, name])
+        return await self.async_client.put(url, data, content_type='application/octet-stream')
+
+    async def test_restarted_encoder_is_reported_ready_on_its_first_playlist(self):
+        await self._put('run1', 'index.m3u8')
+        await self._put('run1', '000.ts', b'G' * 188)
+        await self._put('run1', 'index.m3u8', b'#EXTM3U\n#EXTINF:2.0,\n000.ts\n')
+        # Restarted within a second, long before the old playlist would look stale
+        await self._put('run2', '000.ts', b'G' * 188)
+        response = await self._put('run2', 'index.m3u8', b'#EXTM3U\n#EXTINF:2.0,\n000.ts\n#restarted\n')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.supervisor.mark_ready.call_args_list,
+                         [mock.call(self.stream_id, 'run1'), mock.call(self.stream_id, 'run2')])
+        response = await self.async_client.get(reverse('stream-store', args=[self.stream_id, 'index.m3u8']))
+        self.assertTrue(response.content.endswith(b'#restarted\n'))
+
+    async def test_players_cannot_write(self):
+        response = await self.async_client.put(reverse('stream-store', args=[self.stream_id, 'index.m3u8']),
+                                               b'#EXTM3U\n', content_type='application/octet-stream')
+
+        self.assertEqual(response.status_code, 405)
+        self.assertIsNone(segment_store.get(self.stream_id, 'index.m3u8'))
+        self.supervisor.mark_ready.assert_not_called()
+
+
+@override_settings(STREAM_BULK_CONCURRENCY=2)
+class BulkViewTests(SimpleTestCase):
+    def setUp(self):
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def _start(self, rtsp_url, **options):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            time.sleep(0.05)
+            if 'broken' in rtsp_url:
+                raise RuntimeError('camera exploded')
+            return Response({'stream_id': rtsp_url.rsplit('/', 1)[1], 'status': 'starting'}, status=202)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    async def _lines(self, url, body):
+        response = await self.async_client.post(url, json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    async def test_bulk_start_answers_one_line_per_stream_then_done(self):
+        urls = [f'rtsp://cam.test/{i}' for i in range(5)] + ['http://cam.test/5', 'rtsp://broken.test/6']
+        with mock.patch.object(StreamView, 'start', side_effect=self._start) as start, \
+                self.assertLogs('stream.views', 'ERROR'):
+            lines = await self._lines(reverse('stream-bulk-start'), {'rtsp_urls': urls, 'profile': 'remux'})
+
+        *items, done = lines
+        self.assertEqual(done, {'done': True, 'count': 7, 'failed': 2})
+        by_index = {item['index']: item for item in items}
+        self.assertEqual(sorted(by_index), list(range(7)))
+        for i in range(5):
+            self.assertEqual(by_index[i]['status_code'], 202)
+            self.assertEqual(by_index[i]['stream_id'], str(i))
+            self.assertEqual(by_index[i]['rtsp_url'], urls[i])
+        # A bad URL and a failing start are reported on their own lines
+        self.assertEqual(by_index[5]['status_code'], 400)
+        self.assertIn('Invalid RTSP URL', by_index[5]['error'])
+        self.assertEqual(by_index[6], {'rtsp_url': urls[6], 'error': 'camera exploded', 'status_code': 500,
+                                       'index': 6})
+        self.assertEqual(start.call_count, 6)
+        self.assertEqual(start.call_args.kwargs['profile'], 'remux')
+        self.assertEqual(self.most_running, 2)
+
+    async def test_bulk_start_takes_per_stream_options(self):
+        streams = [{'rtsp_url': 'rtsp://cam.test/a', 'profile': 'llhls'}, {'rtsp_url': 'rtsp://cam.test/b'}]
+        with mock.patch.object(StreamView, 'start', side_effect=self._start) as start:
+            lines = await self._lines(reverse('stream-bulk-start'), {'streams': streams})
+
+        self.assertEqual(lines[-1], {'done': True, 'count': 2, 'failed': 0})
+        profiles = {call.kwargs['rtsp_url']: call.kwargs['profile'] for call in start.call_args_list}
+        self.assertEqual(profiles, {'rtsp://cam.test/a': 'llhls', 'rtsp://cam.test/b': 'transcode'})
+
+    def test_bulk_requests_are_validated_before_streaming(self):
+        for url, body in ((reverse('stream-bulk-start'), {'rtsp_urls': []}),
+                          (reverse('stream-bulk-start'), {'streams': ['rtsp://cam.test/a']}),
+                          (reverse('stream-bulk-stop'), {'stream_ids': [1]}),
+                          (reverse('stream-bulk-status'), {'stream_ids': 'abc'})):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_bulk_stop(self):
+        def stop(stream_id):
+            if stream_id == 'gone':
+                return Response({'error': 'Stream not found'}, status=404)
+            return Response({'message': f'Stream {stream_id} stopped'}, status=200)
+
+        with mock.patch.object(StopStreamView, 'stop', side_effect=stop):
+            lines = await self._lines(reverse('stream-bulk-stop'), {'stream_ids': ['a', 'gone']})
+
+        self.assertEqual(lines[-1], {'done': True, 'count': 2, 'failed': 1})
+        self.assertEqual(sorted((line['stream_id'], line['status_code']) for line in lines[:-1]),
+                         [('a', 200), ('gone', 404)])
+
+    def test_bulk_status_lists_the_streams(self):
+        with mock.patch('stream.views.list_streams', return_value=Response({'streams': [], 'count': 0})) as listing:
+            response = self.client.post(reverse('stream-bulk-status'), {'stream_ids': ['a', 'b'], 'full': True},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        listing.assert_called_once_with(['a', 'b'], brief=False)
@@ -0,0 +1,78 @@
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from stream import warm
+from stream.registry import DEFAULT_PROFILE
+from stream.supervisor import SupervisorError
+
+FIRST = 'rtsp://camera.test/first'
+SECOND = 'rtsp://camera.test/second'
+
+
+class WarmCamerasTests(SimpleTestCase):
+    @override_settings(WARM_CAMERAS=[f' {FIRST} ', f'{SECOND}|remux'])
+    def test_entries_are_parsed(self):
+        self.assertEqual(warm.warm_cameras(), [(FIRST, DEFAULT_PROFILE), (SECOND, 'remux')])
+
+    @override_settings(WARM_CAMERAS=[f'{FIRST}|nonsense', SECOND])
+    def test_unknown_profile_is_skipped(self):
+        with self.assertLogs('stream.warm', 'ERROR') as logs:
+            self.assertEqual(warm.warm_cameras(), [(SECOND, DEFAULT_PROFILE)])
+        self.assertIn('nonsense', logs.output[0])
+
+
+class KeepWarmTests(SimpleTestCase):
+    def setUp(self):
+        self.cameras = [(FIRST, DEFAULT_PROFILE), (SECOND, 'remux')]
+        self.streams = {FIRST: str(uuid.uuid4()), SECOND: str(uuid.uuid4())}
+        self.status = {}
+        patcher = mock.patch.object(warm, 'get_supervisor')
+        self.addCleanup(patcher.stop)
+        patcher.start().return_value.status.side_effect = self._status
+        patcher = mock.patch.object(warm, 'warm_up', side_effect=self._warm_up)
+        self.addCleanup(patcher.stop)
+        self.warm_up = patcher.start()
+
+    def _status(self, stream_id):
+        status = self.status.get(stream_id)
+        if isinstance(status, Exception):
+            raise status
+        return {'stream_id': stream_id, 'status': status} if status else None
+
+    def _warm_up(self, cameras):
+        return {rtsp_url: str(uuid.uuid4()) for rtsp_url, profile in cameras}
+
+    def test_nothing_is_started_while_every_camera_streams(self):
+        self.status = {stream_id: 'running' for stream_id in self.streams.values()}
+
+        warm.keep_warm(self.cameras, self.streams)
+
+        self.warm_up.assert_not_called()
+
+    def test_only_the_failed_camera_is_restarted(self):
+        running, failed = self.streams[FIRST], self.streams[SECOND]
+        self.status = {running: 'running', failed: 'failed'}
+
+        warm.keep_warm(self.cameras, self.streams)
+
+        self.warm_up.assert_called_once_with([(SECOND, 'remux')])
+        self.assertEqual(self.streams[FIRST], running)
+        self.assertNotEqual(self.streams[SECOND], failed)
+
+    def test_gone_or_unreachable_streams_are_restarted(self):
+        self.status = {self.streams[FIRST]: SupervisorError('down')}
+
+        warm.keep_warm(self.cameras, self.streams)
+
+        self.warm_up.assert_called_once_with(self.cameras)
+
+    def test_camera_that_could_not_start_is_retried_next_pass(self):
+        self.warm_up.side_effect = lambda cameras: {rtsp_url: None for rtsp_url, profile in cameras}
+
+        streams = warm.keep_warm(self.cameras, {})
+        self.assertEqual(streams, {})
+        warm.keep_warm(self.cameras, streams)
+
+        self.assertEqual(self.warm_up.call_args_list, [mock.call(self.cameras)] * 2)
@@ -0,0 +1,99 @@
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase
+
+from stream import watcher
+
+
+class PlaylistReadyTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.stream_dir, True)
+        self.playlist = os.path.join(self.stream_dir, 'index.m3u8')
+
+    def test_missing_or_empty_playlist_is_not_ready(self):
+        self.assertFalse(watcher.playlist_ready(self.stream_dir))
+        open(self.playlist, 'w').close()
+        self.assertFalse(watcher.playlist_ready(self.stream_dir))
+        with open(self.playlist, 'w') as f:
+            f.write('#EXTM3U\n')
+        self.assertTrue(watcher.playlist_ready(self.stream_dir))
+
+    def test_playlist_written_before_since_is_not_ready(self):
+        with open(self.playlist, 'w') as f:
+            f.write('#EXTM3U\n')
+        before = time.time() - 10
+        os.utime(self.playlist, (before, before))
+
+        self.assertFalse(watcher.playlist_ready(self.stream_dir, since=before + 1))
+        self.assertTrue(watcher.playlist_ready(self.stream_dir, since=before))
+
+
+class WaitForTests(SimpleTestCase):
+    def setUp(self):
+        self.stream_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.stream_dir, True)
+
+    def _publish_later(self, delay):
+        def publish():
+            with open(os.path.join(self.stream_dir, 'index.m3u8'), 'w') as f:
+                f.write('#EXTM3U\n')
+        asyncio.get_running_loop().call_later(delay, publish)
+
+    async def _wait(self, timeout, poll_interval):
+        started = time.monotonic()
+        ready = await watcher.wait_for(self.stream_dir, lambda: watcher.playlist_ready(self.stream_dir),
+                                       timeout, poll_interval)
+        return ready, time.monotonic() - started
+
+    @skipUnless(watcher._libc is not None, 'needs inotify')
+    async def test_inotify_wakes_the_waiter(self):
+        self._publish_later(0.1)
+
+        # Polling alone would not look again within the timeout
+        ready, waited = await self._wait(timeout=5, poll_interval=60)
+
+        self.assertTrue(ready)
+        self.assertLess(waited, 1)
+        self.assertEqual(watcher._shared_watches, {})
+
+    async def test_polls_without_inotify(self):
+        self._publish_later(0.1)
+
+        with mock.patch.object(watcher, '_libc', None):
+            ready, waited = await self._wait(timeout=5, poll_interval=0.05)
+
+        self.assertTrue(ready)
+        self.assertLess(waited, 1)
+
+    async def test_polls_when_the_watch_cannot_be_added(self):
+        self._publish_later(0.1)
+
+        with mock.patch.object(watcher, 'DirectoryWatch', side_effect=OSError(28, 'no watches left')), \
+                self.assertLogs('stream.watcher', 'WARNING'):
+            ready, waited = await self._wait(timeout=5, poll_interval=0.05)
+
+        self.assertTrue(ready)
+        self.assertLess(waited, 1)
+
+    async def test_times_out(self):
+        ready, waited = await self._wait(timeout=0.2, poll_interval=0.05)
+
+        self.assertFalse(ready)
+        self.assertEqual(watcher._shared_watches, {})
+
+    @skipUnless(watcher._libc is not None, 'needs inotify')
+    async def test_waiters_on_one_directory_share_a_watch(self):
+        self._publish_later(0.2)
+
+        with mock.patch.object(watcher, 'DirectoryWatch', wraps=watcher.DirectoryWatch) as watch:
+            results = await asyncio.gather(self._wait(5, 60), self._wait(5, 60), self._wait(5, 60))
+
+        self.assertEqual([ready for ready, waited in results], [True] * 3)
+        self.assertEqual(watch.call_count, 1)
+        self.assertEqual(watcher._shared_watches, {})
@@ -1,8 +1,24 @@
 from django.urls import path
-from .views import StreamView, TestRTSPView, StopStreamView
+from .views import StreamView, TestRTSPView, BatchTestRTSPView, SnapshotView, MosaicView, StopStreamView, StreamStatusView, StreamListView, BulkStartView, BulkStopView, BulkStatusView, MotionThresholdView, keyframe_view, recording_playlist_view, recording_seek_view, recording_segment_view, llhls_view, segment_store_view
 
 urlpatterns = [
     path('stream/start/', StreamView.as_view(), name='stream-start'),
     path('test-rtsp/', TestRTSPView.as_view(), name='test-rtsp'),
+    path('test-rtsp/batch/', BatchTestRTSPView.as_view(), name='test-rtsp-batch'),
+    path('snapshot/', SnapshotView.as_view(), name='snapshot'),
+    path('snapshot/mosaic/', MosaicView.as_view(), name='snapshot-mosaic'),
     path('stream/stop/', StopStreamView.as_view(), name='stream-stop'),
+    path('stream/status/', StreamStatusView.as_view(), name='stream-status'),
+    path('streams/', StreamListView.as_view(), name='stream-list'),
+    path('stream/bulk/start/', BulkStartView.as_view(), name='stream-bulk-start'),
+    path('stream/bulk/stop/', BulkStopView.as_view(), name='stream-bulk-stop'),
+    path('stream/bulk/status/', BulkStatusView.as_view(), name='stream-bulk-status'),
+    path('stream/motion/', MotionThresholdView.as_view(), name='stream-motion'),
+    path('stream/keyframe/<uuid:stream_id>/keyframe.jpg', keyframe_view, name='stream-keyframe'),
+    path('recordings/<str:camera_id>/index.m3u8', recording_playlist_view, name='recording-playlist'),
+    path('recordings/<str:camera_id>/seek', recording_seek_view, name='recording-seek'),
+    path('recordings/<str:camera_id>/<int:start_ms>.ts', recording_segment_view, name='recording-segment'),
+    path('stream/llhls/<uuid:stream_id>/<str:name>', llhls_view, name='stream-llhls'),
+    path('stream/store/<uuid:stream_id>/<str:name>', segment_store_view, name='stream-store'),
+    path('stream/store/<uuid:stream_id>/<str:run>/<str:name>', segment_store_view, name='stream-store-ingest'),
 ]
\ No newline at end of file
@@ -1,281 +1,224 @@
 import os
-import uuid
-import ffmpeg
-import redis
-import boto3
-import logging
-import subprocess
+import re
+import json
 import time
-import platform
-from urllib.parse import unquote
+import asyncio
+import logging
+from datetime import timezone
+from urllib.parse import unquote, urlsplit
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('ffmpeg.log')
-    ]
-)
+from . import archive, encoder, llhls, logs, metrics, probe, runner, snapshot, watcher
+from .registry import normalize_rtsp_url, DEFAULT_PROFILE, PROFILES
+from .store import segment_store
+from .supervisor import get_supervisor, SupervisorError, SupervisorSaturated, SupervisorUnavailable
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Profiles whose HLS output can live in the segment store instead of on disk
+STORE_PROFILES = ('transcode', 'remux', 'abr')
+
+def uses_segment_store(profile):
+    return settings.SEGMENT_STORE_ENABLED and profile in STORE_PROFILES
+
+def on_node(url, origin):
+    """``url`` served by the web server at ``origin`` of the node writing the stream's files."""
+    if not origin:
+        return url
+    return origin + urlsplit(url)._replace(scheme='', netloc='').geturl()
+
+def stream_url_for(stream_id, profile, origin=None):
+    """Playback URL. Files written by a stream node (``origin``) are fetched from it, MSE
+    and the segment store go through this web tier."""
+    if profile == 'llhls':
+        return on_node(f'{settings.LLHLS_URL}{stream_id}/index.m3u8', origin)
+    if profile == 'mse':
+        return f'{settings.MSE_WS_URL}{stream_id}/media/'
+    if uses_segment_store(profile):
+        return f'{settings.SEGMENT_STORE_URL}{stream_id}/index.m3u8'
+    return on_node(f'{settings.HLS_URL}{stream_id}/index.m3u8', origin)
+
+# Profiles writing single-variant MPEG-TS segments, which the recorder archives as they are
+RECORD_PROFILES = ('transcode', 'remux')
+
+def recording_url_for(camera):
+    return f'{settings.RECORDING_URL}{camera}/index.m3u8'
+
+def parse_motion_threshold(value):
+    """``(threshold, error)``: the fraction of changed pixels that counts as activity."""
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        return None, 'motion_threshold must be a number'
+    if not 0 < threshold <= 1:
+        return None, 'motion_threshold must be above 0 and at most 1'
+    return threshold, ''
+
+def keyframe_url_for(stream_id, origin=None):
+    return on_node(f'{settings.KEYFRAME_URL}{stream_id}/keyframe.jpg', origin)
+
+def start_options(data):
+    """``(options, error)``: the ``StreamView.start`` arguments of a start request body."""
+    rtsp_url = data.get('rtsp_url')
+    if not rtsp_url or not isinstance(rtsp_url, str):
+        return None, 'RTSP URL is required'
+    # Decode URL if it's encoded
+    rtsp_url = unquote(rtsp_url)
+
+    profile = data.get('profile', DEFAULT_PROFILE)
+    if profile not in PROFILES:
+        return None, f'Unknown profile: {profile}'
+
+    try:
+        normalize_rtsp_url(rtsp_url)
+    except ValueError as e:
+        return None, f'Invalid RTSP URL: {str(e)}'
+
+    record = bool(data.get('record'))
+    if record and profile not in RECORD_PROFILES:
+        return None, f'Recording needs one of the profiles {", ".join(RECORD_PROFILES)}'
+
+    motion_threshold = data.get('motion_threshold')
+    if motion_threshold is None and data.get('motion'):
+        motion_threshold = settings.MOTION_DEFAULT_THRESHOLD
+    if motion_threshold is not None:
+        motion_threshold, error = parse_motion_threshold(motion_threshold)
+        if error:
+            return None, error
+
+    return {'rtsp_url': rtsp_url, 'profile': profile, 'record': record, 'motion_threshold': motion_threshold}, ''
 
 class StreamView(APIView):
     def post(self, request):
-        rtsp_url = request.data.get('rtsp_url')
-        logger.info(f"Received RTSP URL: {rtsp_url}")
-        if not rtsp_url:
-            logger.error("RTSP URL is required")
-            return Response({'error': 'RTSP URL is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Decode URL if it's encoded
-        rtsp_url = unquote(rtsp_url)
-        logger.debug(f"Decoded RTSP URL: {rtsp_url}")
-        
+        logger.info(f"Received RTSP URL: {request.data.get('rtsp_url')}")
+        options, error = start_options(request.data)
+        if error:
+            logger.error(error)
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        logger.debug(f"Decoded RTSP URL: {options['rtsp_url']}")
+        return self.start(**options)
+
+    def start(self, rtsp_url, profile, warm=False, record=False, motion_threshold=None):
+        """Share or start the stream for a validated URL; also used by the warm pool."""
         try:
-            # Determine FFmpeg path (Windows compatibility)
-            ffmpeg_path = os.path.abspath('./ffmpeg.exe') if os.path.exists('./ffmpeg.exe') else 'ffmpeg'
-            logger.debug(f"Using FFmpeg path: {ffmpeg_path}")
-            
-            # Generate a unique stream ID and create absolute paths
-            stream_id = str(uuid.uuid4())
-            stream_dir = os.path.abspath(os.path.join(settings.MEDIA_ROOT, 'streams', stream_id))
-            # Output paths will now be relative to stream_dir when used in FFmpeg command with cwd=stream_dir
-            ffmpeg_output_playlist = 'index.m3u8'
-            ffmpeg_segment_pattern = '%03d.ts'
-            
-            logger.info(f"Stream directory (absolute): {stream_dir}")
-            # logger.info(f"Output path (absolute): {output_path}") # No longer the primary ffmpeg output path variable
-            # logger.info(f"Segment pattern (absolute): {segment_pattern}") # No longer the primary ffmpeg segment pattern variable
-            
-            # Ensure parent directories exist
-            os.makedirs(os.path.dirname(stream_dir), exist_ok=True)
-            
-            # Create stream directory with explicit permissions
-            try:
-                if os.path.exists(stream_dir):
-                    logger.warning(f"Stream directory already exists: {stream_dir}")
-                    # Clean up existing directory
-                    for file in os.listdir(stream_dir):
-                        os.remove(os.path.join(stream_dir, file))
-                else:
-                    os.makedirs(stream_dir, exist_ok=True)
-                    logger.info(f"Created stream directory: {stream_dir}")
-                
-                # Verify directory permissions
-                if not os.access(stream_dir, os.W_OK):
-                    logger.error(f"No write permission for directory: {stream_dir}")
-                    return Response({'error': 'No write permission for stream directory'}, 
-                                 status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
-            except Exception as e:
-                logger.error(f"Error creating/verifying stream directory: {str(e)}")
-                return Response({'error': f'Failed to create stream directory: {str(e)}'}, 
-                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            supervisor = get_supervisor()
+            stream = supervisor.acquire(rtsp_url, profile, warm)
+        except SupervisorError as e:
+            logger.error(f"Stream supervisor error: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-            try:
-                # Test RTSP connection first using direct FFmpeg command
-                logger.info("Testing RTSP connection...")
-                test_cmd = [ffmpeg_path, '-rtsp_transport', 'tcp', '-i', rtsp_url, '-t', '1', '-f', 'null', '-']
-                logger.debug(f"Test command: {' '.join(test_cmd)}")
-                
-                test_result = subprocess.run(
-                    test_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=5  # Reduced timeout to 5 seconds
-                )
-                
-                if test_result.returncode != 0:
-                    error_msg = test_result.stderr.decode()
-                    logger.error(f"RTSP connection test failed: {error_msg}")
-                    # Check for specific error messages
-                    if "Failed to resolve hostname" in error_msg:
-                        return Response({'error': 'Failed to resolve RTSP server hostname. Please check the URL and network connection.'}, 
-                                     status=status.HTTP_400_BAD_REQUEST)
-                    elif "Connection refused" in error_msg:
-                        return Response({'error': 'Connection refused by RTSP server. Please check if the server is running and accessible.'}, 
-                                     status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return Response({'error': f'Failed to connect to RTSP stream: {error_msg}'}, 
-                                     status=status.HTTP_400_BAD_REQUEST)
-                logger.info("RTSP connection test successful")
-            except subprocess.TimeoutExpired:
+        stream_id = stream['stream_id']
+        if not stream['created']:
+            logger.info(f"Sharing stream {stream_id} ({stream['viewers']} viewers) for {rtsp_url}")
+            response = Response({
+                'stream_id': stream_id,
+                'stream_url': stream_url_for(stream_id, profile, stream.get('origin')),
+                'status': stream['status'],
+                'mime_type': encoder.MSE_MIME if profile == 'mse' else 'application/x-mpegURL',
+                'keyframe_url': keyframe_url_for(stream_id, stream.get('origin')) if stream['warm'] else None
+            }, status=status.HTTP_200_OK if stream['status'] == 'connected' else status.HTTP_202_ACCEPTED)
+            if record:
+                try:
+                    supervisor.record(stream_id)
+                except SupervisorError as e:
+                    # Still being launched, or written to the segment store by an earlier start
+                    logger.warning(f"Could not record shared stream {stream_id}: {str(e)}")
+                    return response
+                response.data.update(self._recording(rtsp_url))
+            return response
+
+        return self.launch(supervisor, stream_id, rtsp_url, profile, warm, record, motion_threshold)
+
+    def launch(self, supervisor, stream_id, rtsp_url, profile, warm=False, record=False, motion_threshold=None):
+        """Start ffmpeg for a registered stream; also used to recover streams after a restart."""
+        with logs.bound(stream_id=stream_id):
+            response = self._start_ffmpeg(supervisor, stream_id, rtsp_url, profile, warm, record, motion_threshold)
+        if response.status_code >= 400:
+            # Viewers that joined while this start was in flight share its fate
+            supervisor.abandon(stream_id, response.data.get('error', ''))
+            segment_store.drop(stream_id)
+        elif record:
+            response.data.update(self._recording(rtsp_url))
+        return response
+
+    def _recording(self, rtsp_url):
+        camera = archive.camera_id(rtsp_url)
+        return {'camera_id': camera, 'recording_url': recording_url_for(camera)}
+
+    def _start_ffmpeg(self, supervisor, stream_id, rtsp_url, profile, warm=False, record=False,
+                      motion_threshold=None):
+        try:
+            # Test RTSP connection first. A recent successful probe (from
+            # test-rtsp or an earlier start) is reused; ffprobe also tells
+            # the remux profile whether the codec can be copied.
+            logger.debug("Testing RTSP connection...")
+            result = probe.probe_url(rtsp_url)
+            if result['timed_out']:
                 logger.error("RTSP connection test timed out")
                 return Response({'error': 'Connection timeout. The RTSP server is not responding. Please check if the URL is correct and the server is accessible.'}, 
                              status=status.HTTP_408_REQUEST_TIMEOUT)
-            except Exception as e:
-                logger.error(f"Error testing RTSP connection: {str(e)}")
-                return Response({'error': f'Error connecting to RTSP stream: {str(e)}'}, 
-                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if not result['reachable']:
+                error_msg = result['error']
+                logger.error(f"RTSP connection test failed: {error_msg}")
+                # Check for specific error messages
+                if "Failed to resolve hostname" in error_msg:
+                    return Response({'error': 'Failed to resolve RTSP server hostname. Please check the URL and network connection.'}, 
+                                 status=status.HTTP_400_BAD_REQUEST)
+                elif "Connection refused" in error_msg:
+                    return Response({'error': 'Connection refused by RTSP server. Please check if the server is running and accessible.'}, 
+                                 status=status.HTTP_400_BAD_REQUEST)
+                else:
+                    return Response({'error': f'Failed to connect to RTSP stream: {error_msg}'}, 
+                                 status=status.HTTP_400_BAD_REQUEST)
+            logger.debug("RTSP connection test successful")
+            video = result['video']
+        except Exception as e:
+            logger.error(f"Error testing RTSP connection: {str(e)}")
+            return Response({'error': f'Error connecting to RTSP stream: {str(e)}'}, 
+                         status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Start FFmpeg process to convert RTSP to HLS
-            logger.info("Starting FFmpeg process")
-            try:
-                # Build FFmpeg command with absolute paths for input, relative for output (due to cwd)
-                ffmpeg_cmd = [
-                    ffmpeg_path,
-                    '-rtsp_transport', 'tcp',
-                    '-analyzeduration', '1000000',  # Increased analyze duration
-                    '-probesize', '1000000',        # Increased probe size
-                    '-timeout', '5000000',
-                    '-i', rtsp_url, # rtsp_url is already absolute or fully qualified
-                    '-c:v', 'libx264',
-                    '-preset', 'ultrafast',
-                    '-tune', 'zerolatency',
-                    '-g', '15',
-                    '-keyint_min', '15',
-                    '-sc_threshold', '0',
-                    '-bf', '0',
-                    '-maxrate', '500k',
-                    '-bufsize', '1000k',
-                    '-s', '640x360',
-                    '-r', '15',
-                    '-threads', '4',
-                    '-f', 'hls',
-                    '-hls_time', '2',
-                    '-hls_list_size', '3',
-                    '-hls_flags', 'delete_segments+append_list+independent_segments+program_date_time',
-                    '-hls_segment_type', 'mpegts',
-                    '-hls_playlist_type', 'event',
-                    '-hls_segment_filename', ffmpeg_segment_pattern, # Use relative pattern
-                    '-hls_init_time', '1', # This causes a warning, consider removing if issues persist
-                    '-hls_start_number_source', 'datetime',
-                    '-hls_allow_cache', '0',
-                    # Redundant HLS flags removed below
-                    # '-hls_segment_type', 'mpegts',
-                    # '-hls_playlist_type', 'event',
-                    # '-hls_flags', 'delete_segments+append_list+independent_segments+program_date_time',
-                    ffmpeg_output_playlist # Use relative playlist path
-                ]
-                logger.debug(f"Full FFmpeg command: {' '.join(ffmpeg_cmd)}")
-
-                # Start FFmpeg process
-                process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    cwd=stream_dir  # Set working directory to stream_dir
-                )
-                
-                logger.info(f"FFmpeg process started with PID: {process.pid}")
-                
-                # Store process ID in memory
-                if not hasattr(StreamView, '_processes'):
-                    StreamView._processes = {}
-                StreamView._processes[stream_id] = process.pid
-                logger.debug(f"Started FFmpeg process with PID: {process.pid}")
-
-                # Wait for index.m3u8 or .ts segments to be generated
-                timeout = 45  # increased timeout to 45 seconds
-                start_time = time.time()
-                logger.info(f"Waiting for index.m3u8 or .ts segments to be generated (timeout: {timeout}s)")
-                
-                def stream_ready():
-                    # Check for playlist or at least one segment using paths relative to stream_dir
-                    # but os.path.exists needs absolute paths or paths relative to Django's CWD.
-                    # So we construct absolute paths for checking here.
-                    absolute_output_playlist = os.path.join(stream_dir, ffmpeg_output_playlist)
-                    if os.path.exists(absolute_output_playlist) and os.path.getsize(absolute_output_playlist) > 0:
-                        logger.info(f"Found playlist file: {absolute_output_playlist}")
-                        return True
-                    tmp_path = absolute_output_playlist + '.tmp'
-                    if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
-                        logger.info(f"Found temporary playlist file: {tmp_path}")
-                        return True
-                    ts_files = [f for f in os.listdir(stream_dir) if f.endswith('.ts')]
-                    if ts_files:
-                        logger.info(f"Found {len(ts_files)} .ts files")
-                        return True
-                    return False
-                
-                while not stream_ready():
-                    if time.time() - start_time > timeout:
-                        process.terminate()
-                        if stream_id in StreamView._processes:
-                            del StreamView._processes[stream_id]
-                        logger.error("Timeout waiting for index.m3u8 or .ts segments")
-                        # Get FFmpeg error output
-                        try:
-                            stderr_output = process.stderr.read()
-                            logger.error(f"FFmpeg error output: {stderr_output}")
-                            # Log the last few lines of FFmpeg output for debugging
-                            if stderr_output:
-                                last_lines = stderr_output.strip().split('\n')[-10:]
-                                logger.error("Last 10 lines of FFmpeg output:")
-                                for line in last_lines:
-                                    logger.error(line)
-                        except Exception as e:
-                            logger.error(f"Error reading FFmpeg stderr: {str(e)}")
-                        # Log directory contents
-                        try:
-                            dir_contents = os.listdir(stream_dir)
-                            logger.error(f"Stream directory contents on timeout: {dir_contents}")
-                            # Log directory permissions
-                            logger.error(f"Directory permissions: {oct(os.stat(stream_dir).st_mode)[-3:]}")
-                            # Log file sizes if any exist
-                            for file in dir_contents:
-                                file_path = os.path.join(stream_dir, file)
-                                if os.path.isfile(file_path):
-                                    logger.error(f"File {file} size: {os.path.getsize(file_path)} bytes")
-                        except Exception as e:
-                            logger.error(f"Error listing stream directory: {str(e)}")
-                        # Clean up stream directory
-                        try:
-                            for file in os.listdir(stream_dir):
-                                os.remove(os.path.join(stream_dir, file))
-                            os.rmdir(stream_dir)
-                        except Exception as e:
-                            logger.error(f"Error cleaning up stream directory: {str(e)}")
-                        return Response({'error': 'FFmpeg failed to generate HLS playlist or segments within timeout'}, 
-                                     status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    
-                    time.sleep(0.1)
-                    # Check if FFmpeg process is still running
-                    if process.poll() is not None:
-                        try:
-                            stderr_output = process.stderr.read()
-                            logger.error(f"FFmpeg process exited prematurely. Error: {stderr_output}")
-                        except Exception as e:
-                            logger.error(f"Error reading FFmpeg stderr: {str(e)}")
-                        return Response({'error': f'FFmpeg process failed: {stderr_output}'}, 
-                                     status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    # Log progress
-                    elapsed = time.time() - start_time
-                    if elapsed % 1 < 0.1:
-                        logger.debug(f"Still waiting for index.m3u8 or .ts segments... Elapsed time: {elapsed:.1f}s")
-                
-                logger.info(f"HLS playlist generated: {os.path.join(stream_dir, ffmpeg_output_playlist)}")
-
-                # Notify frontend via WebSocket
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    'streams', {'type': 'stream_update', 'stream_id': stream_id, 'status': 'connected'}
-                )
-                logger.debug("Sent WebSocket notification")
-
-                stream_url = f'{settings.HLS_URL}{stream_id}/{ffmpeg_output_playlist}'
-                logger.info(f"Stream URL generated: {stream_url}")
-                return Response({
-                    'stream_id': stream_id,
-                    'stream_url': stream_url
-                }, status=status.HTTP_200_OK)
-                
-            except Exception as e:
-                logger.error(f"Error starting FFmpeg process: {str(e)}", exc_info=True)
-                return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Start FFmpeg process to convert RTSP to HLS
+        logger.debug("Starting FFmpeg process")
+        try:
+            if profile == 'mse':
+                output = 'pipe'
+            elif uses_segment_store(profile) and not record:
+                # The recorder picks finished segments up from the stream directory
+                output = 'push'
+            else:
+                output = 'files'
+
+            # Start FFmpeg in the background; readiness is pushed to the
+            # frontend over the channel layer instead of holding this worker.
+            # The supervisor builds the command from the registered URL and profile.
+            stream = supervisor.launch(stream_id, video, output, record, motion_threshold)
+            video_mode = stream['video_mode']
+            logger.info(f"Video mode for stream {stream_id}: {video_mode}")
+            logger.info(f"FFmpeg process started with PID: {stream['pid']}")
+
+            stream_url = stream_url_for(stream_id, profile, stream.get('origin'))
+            logger.debug(f"Stream URL generated: {stream_url}")
+            return Response({
+                'stream_id': stream_id,
+                'stream_url': stream_url,
+                'status': stream['status'],
+                'video_mode': video_mode,
+                'mime_type': encoder.MSE_MIME if profile == 'mse' else 'application/x-mpegURL',
+                'keyframe_url': keyframe_url_for(stream_id, stream.get('origin')) if warm else None
+            }, status=status.HTTP_202_ACCEPTED)
             
+        except SupervisorSaturated as e:
+            logger.warning(f"Refusing stream {stream_id}: {str(e)}")
+            return Response({'error': str(e), 'status': 'saturated'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+            logger.error(f"Error starting FFmpeg process: {str(e)}", exc_info=True)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class TestRTSPView(APIView):
@@ -285,52 +228,520 @@ class TestRTSPView(APIView):
             return Response({'error': 'RTSP URL is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            ffmpeg_path = './ffmpeg.exe' if os.path.exists('./ffmpeg.exe') else 'ffmpeg'
-            # Test RTSP connection using FFmpeg directly
-            result = subprocess.run(
-                [ffmpeg_path, '-rtsp_transport', 'tcp', '-i', rtsp_url, '-t', '1', '-f', 'null', '-'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=10
-            )
-            if result.returncode == 0:
-                return Response({'status': 'success'}, status=status.HTTP_200_OK)
+            result = probe.probe_url(rtsp_url, refresh=request.query_params.get('refresh') == '1')
+            if result['reachable']:
+                return Response({'status': 'success', 'video': result['video']}, status=status.HTTP_200_OK)
+            elif result['timed_out']:
+                return Response({'error': 'Connection timeout'}, status=status.HTTP_408_REQUEST_TIMEOUT)
             else:
-                return Response({'error': result.stderr.decode()}, status=status.HTTP_400_BAD_REQUEST)
-        except subprocess.TimeoutExpired:
-            return Response({'error': 'Connection timeout'}, status=status.HTTP_408_REQUEST_TIMEOUT)
+                return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class BatchTestRTSPView(APIView):
+    """Probe many RTSP URLs in parallel, e.g. to validate a camera inventory."""
+
+    def post(self, request):
+        rtsp_urls = request.data.get('rtsp_urls')
+        if not isinstance(rtsp_urls, list) or not rtsp_urls:
+            return Response({'error': 'rtsp_urls must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rtsp_urls) > settings.PROBE_BATCH_LIMIT:
+            return Response({'error': f'At most {settings.PROBE_BATCH_LIMIT} URLs per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(rtsp_url, str) and rtsp_url for rtsp_url in rtsp_urls):
+            return Response({'error': 'rtsp_urls must contain URL strings'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results = probe.probe_urls([unquote(rtsp_url) for rtsp_url in rtsp_urls],
+                                       refresh=bool(request.data.get('refresh')))
+        except Exception as e:
+            logger.error(f"Error probing RTSP URLs: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        reachable = sum(1 for result in results if result['reachable'])
+        logger.info(f"Probed {len(results)} RTSP URLs, {reachable} reachable")
+        return Response({'results': results, 'reachable': reachable}, status=status.HTTP_200_OK)
+
+SNAPSHOT_HEADERS = {'Cache-Control': 'no-cache'}
+
+class SnapshotView(APIView):
+    """Latest keyframe of one camera as a JPEG, without starting a stream for it."""
+
+    def post(self, request):
+        rtsp_url = request.data.get('rtsp_url')
+        if not rtsp_url:
+            return Response({'error': 'RTSP URL is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = snapshot.snapshot_url(unquote(rtsp_url), refresh=bool(request.data.get('refresh')))
+        except Exception as e:
+            logger.error(f"Error taking snapshot: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if result['image'] is None:
+            return Response({'error': result['error']}, status=status.HTTP_502_BAD_GATEWAY)
+        headers = dict(SNAPSHOT_HEADERS, **{'X-Snapshot-Source': result['source'],
+                                            'X-Snapshot-Taken-At': f"{result['taken_at']:.3f}"})
+        return HttpResponse(result['image'], content_type='image/jpeg', headers=headers)
+
+class MosaicView(APIView):
+    """Snapshots of many cameras tiled into one JPEG, for camera-wall overviews.
+
+    Cameras are placed left to right, top to bottom in ``columns`` columns
+    (a square grid by default); cameras without a snapshot get a blank tile
+    and are listed by position in the ``X-Mosaic-Missing`` header.
+    """
+
+    def post(self, request):
+        rtsp_urls = request.data.get('rtsp_urls')
+        if not isinstance(rtsp_urls, list) or not rtsp_urls:
+            return Response({'error': 'rtsp_urls must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rtsp_urls) > settings.SNAPSHOT_MOSAIC_LIMIT:
+            return Response({'error': f'At most {settings.SNAPSHOT_MOSAIC_LIMIT} cameras per mosaic'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(rtsp_url, str) and rtsp_url for rtsp_url in rtsp_urls):
+            return Response({'error': 'rtsp_urls must contain URL strings'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            columns = int(request.data.get('columns') or 0) or None
+            tile_width = int(request.data.get('tile_width') or 320)
+        except (TypeError, ValueError):
+            return Response({'error': 'columns and tile_width must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if columns is not None and not 1 <= columns <= len(rtsp_urls):
+            return Response({'error': f'columns must be between 1 and {len(rtsp_urls)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 64 <= tile_width <= 1920:
+            return Response({'error': 'tile_width must be between 64 and 1920'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            image, results = snapshot.mosaic_urls([unquote(rtsp_url) for rtsp_url in rtsp_urls], columns,
+                                                  tile_width // 2 * 2, refresh=bool(request.data.get('refresh')))
         except Exception as e:
+            logger.error(f"Error building mosaic: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if image is None:
+            return Response({'error': 'Could not composite the mosaic'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        missing = [str(index) for index, result in enumerate(results) if result['image'] is None]
+        if missing:
+            logger.info(f"Mosaic of {len(results)} cameras is missing {len(missing)}")
+        headers = dict(SNAPSHOT_HEADERS, **{'X-Mosaic-Missing': ','.join(missing)})
+        return HttpResponse(image, content_type='image/jpeg', headers=headers)
 
 class StopStreamView(APIView):
     def post(self, request):
         stream_id = request.data.get('stream_id')
         if not stream_id:
             return Response({'error': 'Stream ID is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
+        return self.stop(str(stream_id))
+
+    def stop(self, stream_id):
+        """Release one viewer of a stream; also used by the bulk endpoint."""
         try:
-            if hasattr(StreamView, '_processes') and stream_id in StreamView._processes:
-                pid = StreamView._processes[stream_id]
-                if platform.system() == 'Windows':
-                    subprocess.run(['taskkill', '/F', '/PID', str(pid)], check=True)
-                else:
-                    subprocess.run(['kill', '-9', str(pid)], check=True)
-                del StreamView._processes[stream_id]
-                
-                # Clean up stream directory
-                stream_dir = os.path.join(settings.MEDIA_ROOT, 'streams', stream_id)
-                if os.path.exists(stream_dir):
-                    for file in os.listdir(stream_dir):
-                        os.remove(os.path.join(stream_dir, file))
-                    os.rmdir(stream_dir)
-
-                # Notify frontend
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    'streams', {'type': 'stream_update', 'stream_id': stream_id, 'status': 'stopped'}
-                )
-                return Response({'message': f'Stream {stream_id} stopped'}, status=status.HTTP_200_OK)
-            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+            result = get_supervisor().release(stream_id)
+            if result is None:
+                return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+            if result['viewers']:
+                logger.info(f"Released a viewer of stream {stream_id}, {result['viewers']} remaining")
+                return Response({'message': f'Stream {stream_id} released', 'viewers': result['viewers']},
+                                status=status.HTTP_200_OK)
+            segment_store.drop(stream_id)
+            return Response({'message': f'Stream {stream_id} stopped'}, status=status.HTTP_200_OK)
+        except SupervisorUnavailable as e:
+            logger.error(f"Error stopping stream {stream_id}: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.error(f"Error stopping stream {stream_id}: {str(e)}")
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class MotionThresholdView(APIView):
+    """Change the activity threshold of a stream started with motion detection."""
+
+    def post(self, request):
+        stream_id = request.data.get('stream_id')
+        if not stream_id:
+            return Response({'error': 'Stream ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        threshold, error = parse_motion_threshold(request.data.get('motion_threshold'))
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            motion = get_supervisor().set_motion_threshold(str(stream_id), threshold)
+        except SupervisorUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except SupervisorError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({'stream_id': stream_id, 'motion': motion}, status=status.HTTP_200_OK)
+
+class StreamStatusView(APIView):
+    def get(self, request):
+        stream_id = request.query_params.get('stream_id')
+        if not stream_id:
+            return Response({'error': 'Stream ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            stream_status = get_supervisor().status(stream_id, history=request.query_params.get('history') == '1')
+        except SupervisorError as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if stream_status is None:
+            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+        if stream_status.get('node'):
+            # Changes when the stream is moved off a node that went down
+            stream_status['stream_url'] = stream_url_for(stream_id, stream_status['profile'], stream_status['origin'])
+        return Response(stream_status, status=status.HTTP_200_OK)
+
+class StreamListView(APIView):
+    """All supervised streams with their state, in one cheap call.
+
+    ``stream_id`` (repeatable) narrows the listing to those streams and
+    ``full=1`` adds each stream's metrics and encoder allocation.
+    """
+
+    def get(self, request):
+        stream_ids = request.query_params.getlist('stream_id') or None
+        return list_streams(stream_ids, brief=request.query_params.get('full') != '1')
+
+def list_streams(stream_ids=None, brief=True):
+    try:
+        streams = get_supervisor().list(stream_ids, brief)
+    except SupervisorError as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    body = {'streams': streams, 'count': len(streams)}
+    if stream_ids is not None:
+        found = {stream['stream_id'] for stream in streams}
+        body['missing'] = [stream_id for stream_id in stream_ids if stream_id not in found]
+    return Response(body, status=status.HTTP_200_OK)
+
+BULK_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def _bulk_list(request, key):
+    """``(items, error)`` for a bulk request body holding a non-empty list under ``key``."""
+    items = request.data.get(key)
+    if not isinstance(items, list) or not items:
+        return None, f'{key} must be a non-empty list'
+    if len(items) > settings.STREAM_BULK_LIMIT:
+        return None, f'At most {settings.STREAM_BULK_LIMIT} {key} per request'
+    return items, ''
+
+async def _ndjson_results(func, items):
+    """Run ``func(item)`` for every item in threads, ``STREAM_BULK_CONCURRENCY`` at a time.
+
+    Yields one JSON line per item as its call finishes, with the item's
+    ``index`` in the request, then a ``done`` line with the totals.
+    """
+    semaphore = asyncio.Semaphore(settings.STREAM_BULK_CONCURRENCY)
+    call = sync_to_async(func, thread_sensitive=False)
+
+    async def run(index, item):
+        async with semaphore:
+            return index, await call(item)
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, result = await next_done
+            if result['status_code'] >= 400:
+                failed += 1
+            yield json.dumps(dict(result, index=index)) + '\n'
+        yield json.dumps({'done': True, 'count': len(items), 'failed': failed}) + '\n'
+    finally:
+        # The client went away: items still waiting for a slot are not started
+        for task in tasks:
+            task.cancel()
+
+def _ndjson_response(func, items):
+    return StreamingHttpResponse(_ndjson_results(func, items), content_type='application/x-ndjson',
+                                 headers=BULK_HEADERS)
+
+def _bulk_item(response, **item):
+    return dict(response.data, status_code=response.status_code, **item)
+
+class BulkStartView(APIView):
+    """Start many streams in one request, e.g. to bring up a whole site.
+
+    Takes ``streams``, a list of start request bodies, or ``rtsp_urls``
+    with the other start options (profile, record, motion...) shared. The
+    response is NDJSON with one line per stream as its start finishes,
+    which is the body and ``status_code`` the single start endpoint would
+    have answered, so one bad camera does not fail the batch.
+    """
+
+    def post(self, request):
+        if 'rtsp_urls' in request.data:
+            rtsp_urls, error = _bulk_list(request, 'rtsp_urls')
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            shared = {key: value for key, value in request.data.items() if key != 'rtsp_urls'}
+            items = [dict(shared, rtsp_url=rtsp_url) for rtsp_url in rtsp_urls]
+        else:
+            items, error = _bulk_list(request, 'streams')
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            if not all(isinstance(item, dict) for item in items):
+                return Response({'error': 'streams must contain objects'}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Starting {len(items)} streams")
+        return _ndjson_response(self.start_one, items)
+
+    def start_one(self, item):
+        options, error = start_options(item)
+        if error:
+            return {'rtsp_url': item.get('rtsp_url'), 'error': error, 'status_code': status.HTTP_400_BAD_REQUEST}
+        try:
+            response = StreamView().start(**options)
+        except Exception as e:
+            logger.error(f"Error starting stream for {options['rtsp_url']}: {str(e)}", exc_info=True)
+            return {'rtsp_url': item['rtsp_url'], 'error': str(e),
+                    'status_code': status.HTTP_500_INTERNAL_SERVER_ERROR}
+        return _bulk_item(response, rtsp_url=item['rtsp_url'])
+
+class BulkStopView(APIView):
+    """Release one viewer of each of ``stream_ids``, answering NDJSON like ``BulkStartView``."""
+
+    def post(self, request):
+        stream_ids, error = _bulk_list(request, 'stream_ids')
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(stream_id, str) and stream_id for stream_id in stream_ids):
+            return Response({'error': 'stream_ids must contain stream ID strings'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Stopping {len(stream_ids)} streams")
+        return _ndjson_response(self.stop_one, stream_ids)
+
+    def stop_one(self, stream_id):
+        return _bulk_item(StopStreamView().stop(stream_id), stream_id=stream_id)
+
+class BulkStatusView(APIView):
+    """The listing of ``StreamListView`` for ``stream_ids`` in a POST body, for lists too long for a URL."""
+
+    def post(self, request):
+        stream_ids, error = _bulk_list(request, 'stream_ids')
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(stream_id, str) for stream_id in stream_ids):
+            return Response({'error': 'stream_ids must contain stream ID strings'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return list_streams(stream_ids, brief=not request.data.get('full'))
+
+def metrics_view(request):
+    """Prometheus scrape endpoint with per-stream encoder health."""
+    try:
+        supervisor = get_supervisor()
+        streams = supervisor.list()
+        capacity = supervisor.capacity()
+    except SupervisorError as e:
+        logger.error(f"Stream supervisor error: {str(e)}")
+        return HttpResponse(f'# stream supervisor unavailable: {str(e)}\n', status=503,
+                            content_type='text/plain; version=0.0.4')
+    return HttpResponse(metrics.render_prometheus(streams, capacity), content_type='text/plain; version=0.0.4')
+
+def keyframe_view(request, stream_id):
+    """Latest keyframe of a warm stream as a JPEG, to show while the player loads."""
+    data = runner.run(snapshot.stream_keyframe(os.path.join(settings.MEDIA_ROOT, 'streams', str(stream_id))))
+    if data is None:
+        return JsonResponse({'error': 'No keyframe for this stream'}, status=404)
+    return HttpResponse(data, content_type='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
+CAMERA_ID = re.compile(r'[0-9a-f]{16}')
+RECORDING_DEFAULT_RANGE = 3600
+RECORDING_MAX_RANGE = 24 * 3600
+RECORDING_PLAYLIST_HEADERS = {'Cache-Control': 'no-cache'}
+RECORDING_SEGMENT_HEADERS = {'Cache-Control': 'max-age=86400'}
+
+def _parse_time(value, default_ms):
+    """Epoch seconds or an ISO 8601 date (UTC unless it has an offset) as epoch milliseconds."""
+    if not value:
+        return default_ms
+    try:
+        return int(float(value) * 1000)
+    except ValueError:
+        pass
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(f'Invalid time: {value}')
+    if is_naive(moment):
+        moment = make_aware(moment, timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+def recording_playlist_view(request, camera_id):
+    """VOD playlist of a camera's recording between ``start`` and ``end`` (default: the last hour)."""
+    if not CAMERA_ID.fullmatch(camera_id):
+        return JsonResponse({'error': 'Recording not found'}, status=404)
+    now_ms = int(time.time() * 1000)
+    try:
+        end_ms = _parse_time(request.GET.get('end'), now_ms)
+        start_ms = _parse_time(request.GET.get('start'), end_ms - RECORDING_DEFAULT_RANGE * 1000)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not 0 < end_ms - start_ms <= RECORDING_MAX_RANGE * 1000:
+        return JsonResponse({'error': f'end must be after start and at most {RECORDING_MAX_RANGE}s later'},
+                            status=400)
+    playlist = archive.get_archive().playlist(camera_id, start_ms, end_ms, settings.RECORDING_URL)
+    if playlist is None:
+        return JsonResponse({'error': 'Nothing was recorded in this range'}, status=404)
+    return HttpResponse(playlist, content_type='application/vnd.apple.mpegurl', headers=RECORDING_PLAYLIST_HEADERS)
+
+def recording_seek_view(request, camera_id):
+    """Resolve time ``t`` to a playlist from the segment holding it plus the offset into it."""
+    if not CAMERA_ID.fullmatch(camera_id):
+        return JsonResponse({'error': 'Recording not found'}, status=404)
+    try:
+        t_ms = _parse_time(request.GET.get('t'), None)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if t_ms is None:
+        return JsonResponse({'error': 't is required'}, status=400)
+    found = archive.get_archive().index.seek(camera_id, t_ms)
+    if found is None:
+        return JsonResponse({'error': 'Nothing was recorded at or after this time'}, status=404)
+    start_ms, duration_ms = found
+    end_ms = min(start_ms + RECORDING_MAX_RANGE * 1000, int(time.time() * 1000))
+    return JsonResponse({
+        'camera_id': camera_id,
+        'segment_start': start_ms / 1000,
+        'segment_duration': duration_ms / 1000,
+        'offset': max(t_ms - start_ms, 0) / 1000,
+        'playlist_url': f'{settings.RECORDING_URL}{camera_id}/index.m3u8?start={start_ms / 1000:.3f}&end={end_ms / 1000:.3f}',
+    })
+
+def recording_segment_view(request, camera_id, start_ms):
+    if not CAMERA_ID.fullmatch(camera_id):
+        return JsonResponse({'error': 'Recording not found'}, status=404)
+    store = archive.get_archive().store
+    key = archive.segment_key(camera_id, start_ms)
+    url = store.url(key)
+    if url:
+        return HttpResponseRedirect(url)
+    try:
+        data = store.read(key)
+    except FileNotFoundError:
+        return JsonResponse({'error': 'Segment not found'}, status=404)
+    return HttpResponse(data, content_type=archive.SEGMENT_CONTENT_TYPE, headers=RECORDING_SEGMENT_HEADERS)
+
+LLHLS_MEDIA_HEADERS = {'Cache-Control': 'max-age=60'}
+
+def _llhls_block_timeout(parts):
+    # The spec asks servers to give up after three target durations
+    return 3 * (llhls.target_duration(parts) if parts else 2)
+
+async def llhls_view(request, stream_id, name):
+    """Serve a stream started with the 'llhls' profile.
+
+    Playlist requests carrying ``_HLS_msn``/``_HLS_part`` and requests for the
+    preload-hinted part are parked on the stream directory until ffmpeg has
+    written what they ask for, instead of clients polling for it.
+    """
+    stream_dir = os.path.join(settings.MEDIA_ROOT, 'streams', str(stream_id))
+    if not os.path.isdir(stream_dir):
+        return JsonResponse({'error': 'Stream not found'}, status=404)
+
+    if name == 'index.m3u8':
+        return await _llhls_playlist(request, stream_dir)
+
+    if name == encoder.LLHLS_INIT:
+        path = os.path.join(stream_dir, name)
+        if not os.path.exists(path):
+            await watcher.wait_for(stream_dir, lambda: os.path.exists(path),
+                                   timeout=_llhls_block_timeout([]), poll_interval=0.05)
+        return _llhls_file(path)
+
+    match = llhls.PART_RE.match(name)
+    if match:
+        path = os.path.join(stream_dir, name)
+        if not os.path.exists(path):
+            parts = llhls.read_parts(stream_dir)
+            # Only the hinted next part is worth waiting for
+            if parts and int(match.group(1)) == parts[-1][0] + 1:
+                await watcher.wait_for(stream_dir, lambda: os.path.exists(path),
+                                       timeout=_llhls_block_timeout(parts), poll_interval=0.05)
+        return _llhls_file(path)
+
+    match = llhls.SEGMENT_RE.match(name)
+    if match:
+        try:
+            data = b''.join(_read_file(os.path.join(stream_dir, part))
+                            for part in llhls.segment_parts(int(match.group(1))))
+        except FileNotFoundError:
+            return JsonResponse({'error': 'Segment not available'}, status=404)
+        return HttpResponse(data, content_type='video/iso.segment', headers=LLHLS_MEDIA_HEADERS)
+
+    return JsonResponse({'error': 'Not found'}, status=404)
+
+async def _llhls_playlist(request, stream_dir):
+    msn = request.GET.get('_HLS_msn')
+    part = request.GET.get('_HLS_part')
+    if msn is not None:
+        try:
+            msn = int(msn)
+            part = int(part) if part is not None else None
+        except ValueError:
+            return JsonResponse({'error': 'Invalid _HLS_msn/_HLS_part'}, status=400)
+        if part is not None and not 0 <= part < llhls.PARTS_PER_SEGMENT:
+            return JsonResponse({'error': 'Invalid _HLS_part'}, status=400)
+
+        parts = llhls.read_parts(stream_dir)
+        if parts and msn > parts[-1][0] // llhls.PARTS_PER_SEGMENT + 2:
+            return JsonResponse({'error': '_HLS_msn is too far in the future'}, status=400)
+        wanted = llhls.blocking_target(msn, part)
+
+        def available():
+            last = llhls.last_part(stream_dir)
+            return last is not None and last >= wanted
+
+        if not await watcher.wait_for(stream_dir, available, timeout=_llhls_block_timeout(parts), poll_interval=0.05):
+            return JsonResponse({'error': 'Requested part not produced in time'}, status=503)
+    elif part is not None:
+        return JsonResponse({'error': '_HLS_part requires _HLS_msn'}, status=400)
+
+    playlist = llhls.render_playlist(llhls.read_parts(stream_dir))
+    if playlist is None:
+        return JsonResponse({'error': 'Stream not ready'}, status=404)
+    return HttpResponse(playlist, content_type='application/vnd.apple.mpegurl',
+                        headers={'Cache-Control': 'no-cache'})
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _llhls_file(path):
+    # Parts and the init segment are a few KB, reading them whole is cheaper
+    # than streaming them through a sync iterator from an async view.
+    try:
+        data = _read_file(path)
+    except FileNotFoundError:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return HttpResponse(data, content_type='video/mp4', headers=LLHLS_MEDIA_HEADERS)
+
+# ffmpeg runs next to the web server; nobody else may write into the store
+INGEST_ADDRESSES = ('127.0.0.1', '::1')
+STORE_PLAYLIST_HEADERS = {'Cache-Control': 'no-cache'}
+STORE_SEGMENT_HEADERS = {'Cache-Control': 'max-age=60'}
+
+@csrf_exempt
+async def segment_store_view(request, stream_id, name, run=None):
+    """Ingest (PUT/DELETE from ffmpeg) and playback (GET) of in-memory HLS files.
+
+    ffmpeg sends chunked PUTs over a persistent connection, which needs an
+    ASGI server such as the one Channels provides. Each encoder run PUTs
+    under its own ``run`` token; players GET without one.
+    """
+    stream_id = str(stream_id)
+    if request.method in ('PUT', 'DELETE') and run is not None:
+        if request.META.get('REMOTE_ADDR') not in INGEST_ADDRESSES:
+            return JsonResponse({'error': 'Forbidden'}, status=403)
+        if request.method == 'DELETE':
+            segment_store.delete(stream_id, name)
+            return HttpResponse(status=204)
+        if segment_store.put(stream_id, name, request.body, run):
+            try:
+                await sync_to_async(get_supervisor().mark_ready, thread_sensitive=False)(stream_id, run)
+            except SupervisorError as e:
+                logger.error(f"Could not report stream {stream_id} as ready: {str(e)}")
+        return HttpResponse(status=201)
+
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'] if run is None else ['GET', 'HEAD', 'PUT', 'DELETE'])
+    stored = segment_store.get(stream_id, name)
+    if stored is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    headers = dict(STORE_PLAYLIST_HEADERS if name.endswith('.m3u8') else STORE_SEGMENT_HEADERS)
+    headers['ETag'] = stored.etag
+    if request.headers.get('If-None-Match') == stored.etag:
+        return HttpResponseNotModified(headers=headers)
+    # The stored bytes object is handed to the response as is, not copied
+    return HttpResponse(stored.data, content_type=stored.content_type, headers=headers)
@@ -0,0 +1,91 @@
+"""Warm pool: cameras in ``settings.WARM_CAMERAS`` are kept streaming.
+
+Their RTSP sessions stay open and their encoders keep the live edge (and a
+JPEG of the latest keyframe) ready, so a start request for one of them is
+answered from the shared, already connected stream instead of paying the
+probe, the RTSP handshake and the first segment. Pinned streams are exempt
+from idle suspension and are restarted here if they fail.
+"""
+import time
+import logging
+import threading
+
+from django.conf import settings
+
+from .registry import DEFAULT_PROFILE, PROFILES
+from .supervisor import get_supervisor, SupervisorError
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 60
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def warm_cameras():
+    """``[(rtsp_url, profile)]`` from ``WARM_CAMERAS`` entries of the form ``url`` or ``url|profile``.
+
+    Entries naming an unknown profile are logged and skipped.
+    """
+    cameras = []
+    for item in settings.WARM_CAMERAS:
+        rtsp_url, _, profile = item.partition('|')
+        profile = profile.strip() or DEFAULT_PROFILE
+        if profile not in PROFILES:
+            logger.error(f"Not warming {rtsp_url.strip()}: unknown profile '{profile}'")
+            continue
+        cameras.append((rtsp_url.strip(), profile))
+    return cameras
+
+
+def warm_up(cameras=None):
+    """Start (or pin) every warm camera, or just ``cameras``. Returns ``{rtsp_url: stream_id or None}``."""
+    # Imported here: views import the whole stream stack
+    from .views import StreamView
+    started = {}
+    for rtsp_url, profile in warm_cameras() if cameras is None else cameras:
+        response = StreamView().start(rtsp_url, profile, warm=True)
+        if response.status_code >= 400:
+            logger.error(f"Could not warm {rtsp_url}: {response.data.get('error')}")
+            started[rtsp_url] = None
+        else:
+            started[rtsp_url] = response.data['stream_id']
+    return started
+
+
+def keep_warm(cameras, streams):
+    """One pass of the pool: restart the ``cameras`` missing from ``streams`` (``{rtsp_url: stream_id}``, updated in place).
+
+    A camera is missing when it has no stream yet or its stream is gone or
+    failed. Cameras that are still streaming are left alone, so their
+    viewer counts are not bumped by another start.
+    """
+    for rtsp_url, stream_id in list(streams.items()):
+        try:
+            stream = get_supervisor().status(stream_id)
+        except SupervisorError:
+            stream = None
+        if stream is None or stream['status'] == 'failed':
+            streams.pop(rtsp_url)
+    missing = [(rtsp_url, profile) for rtsp_url, profile in cameras if rtsp_url not in streams]
+    if missing:
+        streams.update({url: stream_id for url, stream_id in warm_up(missing).items() if stream_id})
+    return streams
+
+
+def _keep_warm():
+    cameras = warm_cameras()
+    streams = {}
+    while True:
+        keep_warm(cameras, streams)
+        time.sleep(CHECK_INTERVAL)
+
+
+def start():
+    """Warm the pool in the background; called once the web process is up."""
+    global _thread
+    with _thread_lock:
+        if _thread is None and settings.WARM_CAMERAS:
+            _thread = threading.Thread(target=_keep_warm, name='stream-warm-pool', daemon=True)
+            _thread.start()
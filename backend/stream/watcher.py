@@ -0,0 +1,139 @@
+import os
+import sys
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+# inotify flags (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Used when inotify is unavailable (Windows, macOS, exhausted watch limits)
+POLL_INTERVAL = 0.5
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def playlist_ready(stream_dir, playlist='index.m3u8', since=None):
+    """Return True once ffmpeg has published a non-empty playlist.
+
+    Segments alone are not enough: players are handed the playlist URL as soon
+    as the stream reports connected, and for ABR output the master playlist
+    is only written after every variant has a segment. With ``since`` (a
+    ``time.time()``), a playlist last written before then does not count,
+    e.g. the one a restarted encoder's predecessor left behind.
+    """
+    try:
+        stat = os.stat(os.path.join(stream_dir, playlist))
+    except FileNotFoundError:
+        return False
+    return stat.st_size > 0 and (since is None or stat.st_mtime >= since)
+
+
+class DirectoryWatch:
+    """Wakes an asyncio task whenever a file is created or finished in a directory."""
+
+    def __init__(self, path):
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+        if _libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f'inotify_add_watch failed for {path}')
+        self._changed = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def _on_readable(self):
+        # The event payload is irrelevant, callers re-check the directory.
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._changed.set()
+
+    async def changed(self):
+        await self._changed.wait()
+        self._changed.clear()
+
+    def close(self):
+        self._loop.remove_reader(self._fd)
+        os.close(self._fd)
+
+
+# (loop, path) -> [DirectoryWatch or None, number of waiters]. Parked requests
+# on the same stream share one inotify instance; the per-user limit is small.
+_shared_watches = {}
+
+
+def _acquire_watch(path):
+    key = (asyncio.get_running_loop(), path)
+    shared = _shared_watches.get(key)
+    if shared is None:
+        watch = None
+        if _libc is not None:
+            try:
+                watch = DirectoryWatch(path)
+            except OSError as e:
+                logger.warning(f"inotify unavailable for {path}, polling instead: {e}")
+        shared = _shared_watches[key] = [watch, 0]
+    shared[1] += 1
+    return key, shared[0]
+
+
+def _release_watch(key):
+    shared = _shared_watches[key]
+    shared[1] -= 1
+    if shared[1] == 0:
+        del _shared_watches[key]
+        if shared[0] is not None:
+            shared[0].close()
+
+
+async def wait_for(path, predicate, timeout=None, poll_interval=POLL_INTERVAL):
+    """Wait until ``predicate()`` holds, re-checking whenever ``path`` changes.
+
+    Returns False if ``timeout`` seconds pass first. Never blocks the loop.
+    """
+    key, watch = _acquire_watch(path)
+    try:
+        # The watch is armed before the first check, so no write can be missed.
+        async def until():
+            while not predicate():
+                if watch is not None:
+                    await watch.changed()
+                else:
+                    await asyncio.sleep(poll_interval)
+        await asyncio.wait_for(until(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _release_watch(key)
+
+
+async def wait_until_ready(stream_dir, playlist='index.m3u8', since=None):
+    """Wait, without blocking the event loop, until ``playlist_ready`` holds."""
+    await wait_for(stream_dir, lambda: playlist_ready(stream_dir, playlist, since))
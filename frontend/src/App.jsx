@@ -21,6 +21,8 @@ function App() {
             setStreams(prevStreams => [...prevStreams, response.data]);
         } else {
             console.warn(`Stream ${response.data.stream_id} already exists.`);
+            // The backend counted this request as another viewer, hand the reference back
+            await axios.post(`${backendUrl}/api/stream/stop/`, { stream_id: response.data.stream_id });
         }
         return true;
       } else {
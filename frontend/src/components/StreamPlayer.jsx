@@ -7,23 +7,102 @@ function StreamPlayer({ stream }) {
   const playerRef = useRef(null);
   const [status, setStatus] = useState('connecting');
   const [error, setError] = useState('');
+  // The backend answers 202 while ffmpeg is still starting (or queued for CPU); wait for it to report the playlist.
+  const [ready, setReady] = useState(stream.status !== 'starting' && stream.status !== 'queued');
+
+  const defaultBackendUrl = import.meta.env.DEV ? 'http://localhost:8000' : 'https://rtsp-stream-viewer-backend.vercel.app';
+  const baseUrl = import.meta.env.VITE_BACKEND_URL || defaultBackendUrl;
 
   useEffect(() => {
-    const defaultBackendUrl = import.meta.env.DEV ? 'http://localhost:8000' : 'https://rtsp-stream-viewer-backend.vercel.app';
-    const baseUrl = import.meta.env.VITE_BACKEND_URL || defaultBackendUrl;
-    const streamUrl = stream.stream_url;
-    console.log('Stream URL:', streamUrl);
+    const applyStatus = (data) => {
+      setStatus(data.status);
+      setError(data.error || '');
+      if (data.status === 'connected') {
+        setReady(true);
+      } else if (data.status === 'suspended') {
+        // The encoder was paused for lack of viewers; rebuild the player once it is back
+        setReady(false);
+      }
+    };
 
-    // Initialize WebSocket
-    const ws = new WebSocket(baseUrl.replace('http', 'ws').replace('https', 'wss') + '/ws/streams/');
+    // Initialize WebSocket, subscribed to this stream's events only
+    const ws = new WebSocket(
+      baseUrl.replace('http', 'ws').replace('https', 'wss') +
+        `/ws/streams/?stream_id=${encodeURIComponent(stream.stream_id)}`
+    );
+    ws.onopen = () => {
+      // Catch up on an event that may have been sent before the socket opened
+      fetch(`${baseUrl}/api/stream/status/?stream_id=${encodeURIComponent(stream.stream_id)}`)
+        .then((response) => (response.ok ? response.json() : null))
+        .then((data) => data && applyStatus(data))
+        .catch((err) => console.error('Failed to fetch stream status:', err));
+    };
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.stream_id === stream.stream_id) {
+        applyStatus(data);
+      }
+    };
+    ws.onclose = () => console.log('WebSocket closed');
+
+    return () => ws.close();
+  }, [baseUrl, stream.stream_id]);
+
+  // 'mse' streams push fragmented MP4 over a WebSocket straight into Media Source Extensions
+  const isMse = stream.stream_url.startsWith('ws');
+
+  useEffect(() => {
+    if (!ready || !isMse) {
+      return undefined;
+    }
+    const video = videoRef.current;
+    const mediaSource = new MediaSource();
+    const pending = [];
+    let sourceBuffer = null;
+
+    const appendNext = () => {
+      if (sourceBuffer && !sourceBuffer.updating && pending.length) {
+        sourceBuffer.appendBuffer(pending.shift());
+      }
+    };
+
+    mediaSource.addEventListener('sourceopen', () => {
+      sourceBuffer = mediaSource.addSourceBuffer(stream.mime_type);
+      // The server may skip fragments for a slow client, so ignore timestamp gaps
+      sourceBuffer.mode = 'sequence';
+      sourceBuffer.addEventListener('updateend', appendNext);
+      appendNext();
+    });
+
+    const socket = new WebSocket(stream.stream_url);
+    socket.binaryType = 'arraybuffer';
+    socket.onmessage = (event) => {
+      if (typeof event.data === 'string') {
+        const data = JSON.parse(event.data);
         setStatus(data.status);
         setError(data.error || '');
+        return;
       }
+      pending.push(event.data);
+      appendNext();
     };
-    ws.onclose = () => console.log('WebSocket closed');
+
+    const objectUrl = URL.createObjectURL(mediaSource);
+    video.src = objectUrl;
+    video.play().catch((err) => console.log('Autoplay blocked:', err));
+
+    return () => {
+      socket.close();
+      URL.revokeObjectURL(objectUrl);
+    };
+  }, [ready, isMse, stream.stream_url, stream.mime_type]);
+
+  useEffect(() => {
+    if (!ready || isMse) {
+      return undefined;
+    }
+    const streamUrl = stream.stream_url;
+    console.log('Stream URL:', streamUrl);
 
     // Initialize Video.js player
     if (!playerRef.current) {
@@ -75,13 +154,12 @@ function StreamPlayer({ stream }) {
     }
 
     return () => {
-      ws.close();
       if (playerRef.current) {
         playerRef.current.dispose();
         playerRef.current = null;
       }
     };
-  }, [stream.stream_id, stream.stream_url]);
+  }, [ready, isMse, stream.stream_id, stream.stream_url]);
 
   return (
     <div className="border rounded overflow-hidden relative bg-black">
@@ -90,22 +168,26 @@ function StreamPlayer({ stream }) {
         className="video-js vjs-default-skin vjs-big-play-centered" 
         controls 
         playsInline
+        poster={stream.keyframe_url}
       />
       <div
         className={`absolute top-2 left-2 text-white p-1 px-2 rounded text-sm ${
           status === 'connecting' ? 'bg-blue-500' :
-          status === 'buffering' ? 'bg-yellow-500' :
+          status === 'buffering' || status === 'restarting' || status === 'queued' ? 'bg-yellow-500' :
           status === 'connected' ? 'bg-green-500' :
           status === 'failed' ? 'bg-red-500' :
-          status === 'stopped' ? 'bg-gray-500' :
+          status === 'stopped' || status === 'suspended' ? 'bg-gray-500' :
           'bg-black bg-opacity-50'
         }`}
       >
         {status === 'connecting' && 'Connecting...'}
         {status === 'buffering' && 'Buffering...'}
+        {status === 'restarting' && 'Reconnecting...'}
+        {status === 'queued' && 'Waiting for encoder capacity...'}
         {status === 'connected' && 'Connected'}
         {status === 'failed' && `Error: ${error || 'Unknown error'}`}
         {status === 'stopped' && 'Stream Stopped'}
+        {status === 'suspended' && 'Paused (no viewers)'}
       </div>
     </div>
   );